@@ -0,0 +1,74 @@
+from ..daemon.client import DaemonClient
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+READY = re.compile(r"daemon ready (\S+) in ([\d.]+)ms")
+
+
+class DaemonProcess:
+    def __init__(self, workdir: str, args: list[str] | None = None) -> None:
+        self.workdir = workdir
+        self.path = os.path.join(workdir, "chat.sock")
+        # Seconds from spawn until the control socket accepted a client
+        self.startup: float | None = None
+        self._args = args or []
+        self._proc: subprocess.Popen | None = None
+
+    def start(self, timeout: float = 60.0) -> str:
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join(sys.path),
+            "CHAT_LOG_FILE": os.path.join(self.workdir, "app.log"),
+        }
+
+        started = time.perf_counter()
+        self._proc = subprocess.Popen(
+            [sys.executable, "-u", "-m", "chat_peer.daemon", "--socket", self.path]
+            + self._args,
+            cwd=self.workdir,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+
+        deadline = time.monotonic() + timeout
+        assert self._proc.stdout
+        while time.monotonic() < deadline:
+            line = self._proc.stdout.readline()
+            if not line:
+                break
+
+            if READY.search(line):
+                self.startup = time.perf_counter() - started
+                threading.Thread(target=self._proc.stdout.read, daemon=True).start()
+                return self.path
+
+        self.stop()
+        raise Exception("Chat daemon did not start")
+
+    def client(self) -> DaemonClient:
+        return DaemonClient(self.path)
+
+    def stop(self):
+        if not self._proc or self._proc.poll() is not None:
+            return
+
+        self._proc.send_signal(signal.SIGTERM)
+        try:
+            self._proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
@@ -0,0 +1,315 @@
+from typing import Literal, Any
+from dataclasses import dataclass, asdict, field, replace
+from common.utils.metrics import Histogram
+from common.utils.impairment import Impairment, TcpProxy
+from ..chat.chat_model import ChatModel
+from ..chat.events import ChatEvent
+from ..chat.connections import ConnectionConfig
+from ..libs.crypto import generate_rsa_keypair
+import argparse
+import json
+import logging
+import random
+import secrets
+import threading
+import time
+
+type Topology = Literal["star", "ring", "random", "full"]
+
+GROUP = "mesh"
+
+
+@dataclass
+class MeshConfig:
+    peers: int = 8
+    topology: Topology = "ring"
+    # Average links per peer for the random graph
+    degree: int = 3
+    rate: float = 20.0
+    duration: float = 5.0
+    size: int = 64
+    # Time allowed after the last send for deliveries to arrive
+    settle: float = 5.0
+    # One keypair for every peer, generating N of them dominates start up
+    shared_key: bool = True
+    seed: int | None = None
+    # Extra ChatModel arguments, e.g. gossip or batch configs
+    model: dict[str, Any] = field(default_factory=dict)
+    # Applied to every link through a proxy per direction, None for loopback
+    impairment: Impairment | None = None
+
+
+@dataclass
+class MeshResult:
+    peers: int
+    topology: str
+    links: int
+    messages: int
+    expected: int
+    delivered: int
+    delivery_ratio: float
+    duplicates: int
+    duplicate_rate: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+    bytes_per_delivery: float
+    cpu_per_delivery: float
+    elapsed: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def build_topology(
+    topology: Topology, n: int, degree: int = 3, rng: random.Random | None = None
+) -> set[tuple[int, int]]:
+    rng = rng or random.Random()
+    edges: set[tuple[int, int]] = set()
+
+    def link(a: int, b: int):
+        if a != b:
+            edges.add((min(a, b), max(a, b)))
+
+    match topology:
+        case "star":
+            for i in range(1, n):
+                link(0, i)
+        case "ring":
+            for i in range(n):
+                link(i, (i + 1) % n)
+        case "full":
+            for a in range(n):
+                for b in range(a + 1, n):
+                    link(a, b)
+        case "random":
+            # A random spanning tree keeps the graph connected, extra edges
+            # are added until the average degree is reached
+            order = list(range(n))
+            rng.shuffle(order)
+            for i in range(1, n):
+                link(order[i], order[rng.randrange(i)])
+
+            target = min(n * degree // 2, n * (n - 1) // 2)
+            while len(edges) < target:
+                link(rng.randrange(n), rng.randrange(n))
+        case _:
+            raise Exception(f"Unknown topology '{topology}'")
+
+    return edges
+
+
+class Mesh:
+    def __init__(self, config: MeshConfig) -> None:
+        self.config = config
+        self.models: list[ChatModel] = []
+        self.edges: set[tuple[int, int]] = set()
+        self.proxies: list[TcpProxy] = []
+        self._routes: list[dict[tuple[str, int], tuple[str, int]]] = []
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._deliveries: set[tuple[int, str]] = set()
+        self._latency = Histogram()
+
+    def start(self):
+        config = self.config
+        keys = generate_rsa_keypair() if config.shared_key else None
+
+        for i in range(config.peers):
+            private_key, public_key = keys or generate_rsa_keypair()
+
+            # Peers dial their neighbours through the link's proxy
+            routes: dict[tuple[str, int], tuple[str, int]] = {}
+            self._routes.append(routes)
+            connections = replace(
+                config.model.get("connections") or ConnectionConfig(),
+                route=lambda address, routes=routes: routes.get(address, address),
+            )
+
+            model = ChatModel(
+                logging.getLogger(f"mesh-{i}"),
+                "127.0.0.1",
+                0,
+                private_key,
+                public_key,
+                **{**config.model, "connections": connections},
+            )
+            model.listen()
+            model.subscribe(lambda events, i=i: self._on_events(i, events))
+            self.models.append(model)
+
+        # Every peer holds the token, links are made only along the edges
+        token = secrets.token_hex(16)
+        for model in self.models:
+            model.join_group(GROUP, token)
+
+        self.edges = build_topology(
+            config.topology, config.peers, config.degree, self._rng
+        )
+        if config.impairment:
+            for a, b in sorted(self.edges):
+                for src, dst in ((a, b), (b, a)):
+                    target = self.models[dst].address
+                    proxy = TcpProxy(target, config.impairment, seed=config.seed)
+                    self._routes[src][target] = proxy.start()
+                    self.proxies.append(proxy)
+
+        for a, b in sorted(self.edges):
+            self.models[a].link(GROUP, self.models[b].address)
+            self.models[b].link(GROUP, self.models[a].address)
+
+    def run(self) -> MeshResult:
+        config = self.config
+        total = int(config.rate * config.duration)
+        content = "x" * config.size
+
+        bytes_before = self._bytes_sent()
+        cpu_before = time.process_time()
+        start = time.perf_counter()
+
+        # Open loop, each message is sent on schedule by a random peer
+        for i in range(total):
+            delay = start + i / config.rate - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._rng.choice(self.models).send(GROUP, content)
+
+        expected = total * (config.peers - 1)
+        deadline = time.perf_counter() + config.settle
+        while time.perf_counter() < deadline:
+            with self._lock:
+                if len(self._deliveries) >= expected:
+                    break
+            time.sleep(0.05)
+
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_before
+        sent_bytes = self._bytes_sent() - bytes_before
+
+        with self._lock:
+            delivered = len(self._deliveries)
+        duplicates = sum(self._metric(m, "chat_duplicates_total") for m in self.models)
+        quantiles = self._latency.quantiles((0.5, 0.9, 0.99))
+
+        return MeshResult(
+            peers=config.peers,
+            topology=config.topology,
+            links=len(self.edges),
+            messages=total,
+            expected=expected,
+            delivered=delivered,
+            delivery_ratio=delivered / expected if expected else 0.0,
+            duplicates=int(duplicates),
+            duplicate_rate=duplicates / delivered if delivered else 0.0,
+            p50=quantiles[0.5],
+            p90=quantiles[0.9],
+            p99=quantiles[0.99],
+            max=self._latency.snapshot()["max"],
+            bytes_per_delivery=sent_bytes / delivered if delivered else 0.0,
+            cpu_per_delivery=cpu / delivered if delivered else 0.0,
+            elapsed=elapsed,
+        )
+
+    def close(self):
+        for model in self.models:
+            model.close()
+        for proxy in self.proxies:
+            proxy.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _on_events(self, index: int, events: list[ChatEvent]):
+        address = self.models[index].address if index < len(self.models) else None
+
+        with self._lock:
+            for event in events:
+                message = event.message
+                if event.type != "message" or not message:
+                    continue
+
+                # The sender's own copy is the send, every other one a delivery
+                if tuple(message.sender) == address:
+                    continue
+
+                key = (index, message.id)
+                if key in self._deliveries:
+                    continue
+
+                self._deliveries.add(key)
+                self._latency.record(message.received_at - message.sent_at)
+
+    def _bytes_sent(self) -> float:
+        return sum(
+            self._metric(m, "chat_peer_bytes_out_total", prefix=True)
+            for m in self.models
+        )
+
+    @staticmethod
+    def _metric(model: ChatModel, name: str, prefix: bool = False) -> float:
+        metrics = model.stats()["metrics"]
+        if not prefix:
+            return metrics.get(name, 0)
+        return sum(v for k, v in metrics.items() if k.startswith(name + "{"))
+
+
+def format_result(result: MeshResult) -> str:
+    return (
+        f"{result.topology:<6} peers={result.peers} links={result.links} "
+        f"delivered={result.delivery_ratio:.1%} dup={result.duplicate_rate:.2f} "
+        f"p50={result.p50 * 1000:.1f}ms p90={result.p90 * 1000:.1f}ms "
+        f"p99={result.p99 * 1000:.1f}ms "
+        f"bytes={result.bytes_per_delivery:.0f}/msg "
+        f"cpu={result.cpu_per_delivery * 1e6:.0f}us/msg"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process chat mesh benchmark")
+    parser.add_argument("--peers", type=int, default=8)
+    parser.add_argument("--topology", default="ring,star,random")
+    parser.add_argument("--degree", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=20.0)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--size", type=int, default=64)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--delay", type=float, default=0.0, help="ms per link")
+    parser.add_argument("--jitter", type=float, default=0.0, help="ms per link")
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, help="bytes/s per link")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    impairment = None
+    if args.delay or args.jitter or args.loss or args.bandwidth:
+        impairment = Impairment(
+            delay=args.delay / 1000,
+            jitter=args.jitter / 1000,
+            loss=args.loss,
+            rate=args.bandwidth,
+        )
+
+    for topology in args.topology.split(","):
+        config = MeshConfig(
+            peers=args.peers,
+            topology=topology,
+            degree=args.degree,
+            rate=args.rate,
+            duration=args.duration,
+            size=args.size,
+            seed=args.seed,
+            impairment=impairment,
+        )
+        with Mesh(config) as mesh:
+            result = mesh.run()
+
+        print(json.dumps(result.to_dict()) if args.json else format_result(result))
+
+
+if __name__ == "__main__":
+    main()
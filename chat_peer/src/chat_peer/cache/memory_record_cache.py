@@ -15,20 +15,20 @@ class MemoryRecordCache(RecordCache):
     def set(self, record: Record):
         with self._lock:
             self._cache[record.name] = record
-            self._logger.debug(f"cache set '{record.name}'")
+        self._logger.debug("cache set '%s'", record.name)
 
     def get(self, name: str) -> Record | None:
         with self._lock:
             r = self._cache.get(name)
 
-            if not r or r.expires_at <= time.time():
-                self._logger.debug(f"cache miss '{name}'")
-                return None
+        if not r or r.expires_at <= time.time():
+            self._logger.debug("cache miss '%s'", name)
+            return None
 
-        self._logger.debug(f"cache hit '{name}'")
+        self._logger.debug("cache hit '%s'", name)
         return r
 
     def delete(self, name: str) -> None:
         with self._lock:
             del self._cache[name]
-        self._logger.debug(f"cache del '{name}'")
+        self._logger.debug("cache del '%s'", name)
@@ -0,0 +1,84 @@
+from typing import Callable, Iterable, Iterator
+from dataclasses import dataclass
+from ..libs.message import Message
+from ..libs.message_store import MessageStore
+import hashlib
+import time
+
+
+@dataclass
+class SyncConfig:
+    bucket: float = 60.0
+    window: float = 24 * 60 * 60
+    interval: float = 30.0
+
+
+class AntiEntropy:
+    def __init__(self, config: SyncConfig) -> None:
+        self.config = config
+
+    def since(self, messages: MessageStore) -> float:
+        # Only compare the range still held in memory, starting at the next
+        # bucket boundary so a partially held bucket is never compared
+        since = time.time() - self.config.window
+        if not messages.complete and len(messages):
+            since = max(since, messages[0].sent_at)
+        return (self.bucket_of(since) + 1) * self.config.bucket
+
+    def bucket_of(self, sent_at: float) -> int:
+        return int(sent_at // self.config.bucket)
+
+    def digests(self, messages: Iterable[Message], since: float) -> dict[str, str]:
+        # Order independent digest per bucket, message count and XOR of id hashes
+        counts: dict[int, int] = {}
+        hashes: dict[int, int] = {}
+        for m in messages:
+            if m.sent_at < since:
+                continue
+
+            b = self.bucket_of(m.sent_at)
+            counts[b] = counts.get(b, 0) + 1
+            hashes[b] = hashes.get(b, 0) ^ _id_hash(m.id)
+
+        return {str(b): f"{counts[b]}:{hashes[b]:016x}" for b in counts}
+
+    def diff(
+        self,
+        mine: dict[str, str],
+        theirs: dict[str, str],
+    ) -> list[str]:
+        return [b for b in mine.keys() | theirs.keys() if mine.get(b) != theirs.get(b)]
+
+    def ids(
+        self, messages: Iterable[Message], buckets: list[str]
+    ) -> dict[str, list[str]]:
+        wanted = {int(b) for b in buckets}
+        ids: dict[str, list[str]] = {b: [] for b in buckets}
+        for m in messages:
+            b = self.bucket_of(m.sent_at)
+            if b in wanted:
+                ids[str(b)].append(m.id)
+        return ids
+
+
+def split_by_size[T](
+    items: Iterable[T], size: Callable[[T], int], budget: int
+) -> Iterator[list[T]]:
+    # Consecutive runs whose sizes add up to at most budget, an item larger
+    # than the budget goes alone
+    chunk: list[T] = []
+    total = 0
+    for item in items:
+        n = size(item)
+        if chunk and total + n > budget:
+            yield chunk
+            chunk, total = [], 0
+        chunk.append(item)
+        total += n
+
+    if chunk:
+        yield chunk
+
+
+def _id_hash(id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(id.encode(), digest_size=8).digest())
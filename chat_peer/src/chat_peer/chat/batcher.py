@@ -0,0 +1,31 @@
+from dataclasses import dataclass
+
+# Rough per-entry JSON overhead on top of the content itself
+ENTRY_OVERHEAD = 96
+
+
+@dataclass
+class BatchConfig:
+    enabled: bool = False
+    delay: float = 0.002
+    max_bytes: int = 16 * 1024
+
+
+class Batcher:
+    def __init__(self, config: BatchConfig) -> None:
+        self.config = config
+        self._entries: dict[str, list[dict]] = {}
+        self._sizes: dict[str, int] = {}
+
+    def add(self, group: str, entry: dict) -> bool:
+        self._entries.setdefault(group, []).append(entry)
+        self._sizes[group] = (
+            self._sizes.get(group, 0) + len(entry["content"]) + ENTRY_OVERHEAD
+        )
+
+        # Full batches are flushed right away instead of waiting for the timer
+        return self._sizes[group] >= self.config.max_bytes
+
+    def take(self, group: str) -> list[dict]:
+        self._sizes.pop(group, None)
+        return self._entries.pop(group, [])
@@ -1,16 +1,58 @@
-from typing import Callable
+from typing import Callable, Coroutine, Any, BinaryIO, cast
+from concurrent.futures import ThreadPoolExecutor
 
+import os
 import json
 import time
+import dataclasses
 import uuid
+import random
+import asyncio
 import secrets
 import threading
-from common.utils.tcp_socket import TcpSocket
+from common.utils.async_tcp_socket import AsyncTcpSocket
+from common.utils.metrics import MetricsRegistry
+from common.utils.profiling import Profiler
 from ..infra.logger import Logger
-from .chat_schema import Header, ConversationBody, AdvertisementBody
+from .chat_schema import (
+    Header,
+    ConversationBody,
+    AdvertisementBody,
+    MembersBody,
+    BatchBody,
+    IHaveBody,
+    IWantBody,
+    SyncDigestBody,
+    SyncIdsBody,
+    SyncWantBody,
+    SyncMessagesBody,
+    StreamOpenBody,
+    StreamAckBody,
+    InboundFrame,
+)
+from .anti_entropy import AntiEntropy, SyncConfig, split_by_size
+from .batcher import Batcher, BatchConfig
+from .gossip import GossipConfig, GossipState, CachedFrame
+from .liveness import HeartbeatConfig, Liveness
+from .connections import ConnectionConfig
+from .events import ChatEvent, Subscriber
+from .streams import (
+    file_notice,
+    StreamConfig,
+    OutgoingStream,
+    IncomingStream,
+    seal_chunk,
+    chunk_prefix,
+    open_chunk,
+)
 from ..libs.group import Group
 from ..libs.peer import Peer
 from ..libs.message import Message
+from ..libs.message_store import MessageStore, MESSAGE_CAP
+from ..history.sqlite_history import SqliteHistory, PAGE_SIZE
+from ..libs.outbound_queue import OutboundQueue, OverflowPolicy
+from ..libs.seen_filter import SeenFilter
+from ..libs.compression import CODECS, compress, decompress
 from ..libs.crypto import (
     public_key_from_json,
     public_key_to_json,
@@ -22,9 +64,44 @@ from ..libs.crypto import (
     rsa,
 )
 
-
 HEADER_SIZE = 256
 
+# Upper bound for a single frame section, protects against huge allocations
+MAX_BODY_SIZE = 1024 * 1024
+
+# Room left under MAX_BODY_SIZE for the AES tag and the batch envelope, a
+# body that fits before encryption still fits once sent
+BODY_HEADROOM = 1024
+
+# Frames per connection that may be decrypting while the next ones are read
+PIPELINE_DEPTH = 32
+
+# Destinations resolved, dialed and handshaked at once by advertise_many
+ADVERTISE_CONCURRENCY = 32
+
+# Encoded bytes of ids or messages per SYNC_* frame, well under MAX_BODY_SIZE
+SYNC_FRAME_BYTES = 256 * 1024
+
+# Frames that can reach a peer twice, relayed or served from the gossip
+# cache. Point to point frames never repeat and would only crowd the filter
+SEEN_TYPES = frozenset({"CONVERSATION", "BATCH"})
+
+CRYPTO_OPS = ("rsa_encrypt", "rsa_decrypt", "aes_encrypt", "aes_decrypt")
+
+BODY_SCHEMAS = {
+    "ADVERTISEMENT": AdvertisementBody,
+    "MEMBERS": MembersBody,
+    "CONVERSATION": ConversationBody,
+    "BATCH": BatchBody,
+    "IHAVE": IHaveBody,
+    "IWANT": IWantBody,
+    "SYNC_DIGEST": SyncDigestBody,
+    "SYNC_IDS": SyncIdsBody,
+    "SYNC_WANT": SyncWantBody,
+    "SYNC_MESSAGES": SyncMessagesBody,
+    "STREAM_OPEN": StreamOpenBody,
+}
+
 type Address = tuple[str, int]
 
 
@@ -32,6 +109,21 @@ def address_str(address: Address):
     return f"{address[0]}:{address[1]}"
 
 
+def check_body(type: str, body: bytes):
+    # Receivers drop the connection on oversized frames, so they are refused
+    # before anything is sent
+    if len(body) + BODY_HEADROOM > MAX_BODY_SIZE:
+        raise Exception(
+            f"{type} body of {len(body)} bytes is over the {MAX_BODY_SIZE} byte "
+            "frame limit, send large payloads with send_file"
+        )
+
+
+def id_size(id: str) -> int:
+    # Quotes and separator around an id in a JSON list
+    return len(id) + 4
+
+
 def eq_address(a: Address, b: Address):
     return a[0] == b[0] and a[1] == b[1]
 
@@ -45,6 +137,22 @@ class ChatModel:
         port: int,
         private_key: rsa.RSAPrivateKey,
         public_key: rsa.RSAPublicKey,
+        workers: int | None = None,
+        queue_size: int = 1024,
+        overflow: OverflowPolicy = "drop-oldest",
+        pipeline_depth: int = PIPELINE_DEPTH,
+        seen: SeenFilter | None = None,
+        gossip: GossipConfig | None = None,
+        history_cap: int = MESSAGE_CAP,
+        history: SqliteHistory | None = None,
+        sync: SyncConfig | None = None,
+        batch: BatchConfig | None = None,
+        compression: str | None = "zlib",
+        stream: StreamConfig | None = None,
+        heartbeat: HeartbeatConfig | None = None,
+        connections: ConnectionConfig | None = None,
+        metrics: MetricsRegistry | None = None,
+        profiler: Profiler | None = None,
     ) -> None:
         self._logger = logger
         self._address = (host, port)
@@ -52,250 +160,1628 @@ class ChatModel:
         self._private_key = private_key
         self._groups: dict[str, Group] = {}
         self._peers: dict[str, Peer] = {}
-        self._seen: set[str] = set[str]()
+        self._seen = seen or SeenFilter()
+        self._gossip = GossipState(gossip or GossipConfig())
+        self._conn_peers: dict[AsyncTcpSocket, Peer] = {}
+        self._history_cap = history_cap
+        self._history = history
+        self._sync = AntiEntropy(sync or SyncConfig())
+        self._tasks: set[asyncio.Task] = set()
+        self._batcher = Batcher(batch or BatchConfig())
+        self._batch_timers: dict[str, asyncio.TimerHandle] = {}
+        self._compression = compression if compression in CODECS else None
+        self._stream = stream or StreamConfig()
+        # Keyed by the connection a stream was opened on, acks from any other
+        # connection can not open its window
+        self._streams_out: dict[tuple[AsyncTcpSocket, str], OutgoingStream] = {}
+        self._streams_in: dict[str, IncomingStream] = {}
+        # Ids of SYNC_IDS buckets split over frames, per (peer, group, bucket)
+        # until the bucket's last piece arrives
+        self._partial_ids: dict[tuple[str, str, str], set[str]] = {}
+        self._liveness = Liveness(heartbeat or HeartbeatConfig())
+        self._connections = connections or ConnectionConfig()
+        self._dials: dict[str, asyncio.Task] = {}
+        self._outbound: set[AsyncTcpSocket] = set()
+        self._subscribers: list[Subscriber] = []
+        self._events: list[ChatEvent] = []
         self._lock = threading.Lock()
         self._stop_event = threading.Event()
+        self._server: AsyncTcpSocket | None = None
+        self._queue_size = queue_size
+        self._overflow: OverflowPolicy = overflow
+        self._pipeline_depth = pipeline_depth
+
+        # Hot path metrics are resolved once, per peer and per type series
+        # are looked up on use
+        self._metrics = metrics or MetricsRegistry()
+        self._profiler = profiler
+        self._crypto_time = {
+            op: self._metrics.histogram(
+                "chat_crypto_seconds", "Time spent in RSA and AES", op=op
+            )
+            for op in CRYPTO_OPS
+        }
+        self._duplicates = self._metrics.counter(
+            "chat_duplicates_total", "Frames and batch entries dropped as seen"
+        )
+        self._metrics.gauge(
+            "chat_outbox_depth",
+            lambda: sum(p.outbox.stats.depth for p in self._peers.values() if p.outbox),
+            "Frames waiting in outbound queues",
+        )
+        self._metrics.gauge(
+            "chat_peers_connected",
+            lambda: sum(1 for p in self._peers.values() if p.conn),
+            "Peers with an open connection",
+        )
+
+        if history:
+            self._restore_history(history)
+
+        # All networking runs on a single event loop, crypto runs on the executor
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="chat-crypto")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+        config = self._gossip.config
+        if config.mode == "gossip" and config.lazy:
+            asyncio.run_coroutine_threadsafe(self._gossip_loop(), self._loop)
+
+        asyncio.run_coroutine_threadsafe(self._anti_entropy_loop(), self._loop)
+
+        if self._liveness.config.enabled:
+            asyncio.run_coroutine_threadsafe(self._heartbeat_loop(), self._loop)
 
     def __del__(self):
-        self._stop_event.set()
+        self.close()
 
     # ===================================
     # PUBLIC
     # ===================================
 
+    @property
+    def address(self) -> Address:
+        return self._address
+
+    @property
+    def groups(self) -> dict[str, Group]:
+        return self._groups
+
     def create_group(self, name: str):
         if name in self._groups:
             raise Exception("Group already exist")
 
         token = secrets.token_hex(16)
-        group = Group(name, token, [], [])
-        self._groups[name] = group
+        group = self._add_group(name, token)
 
-        self._logger.debug(f"group created '{name}'")
+        self._logger.debug("group created '%s'", name)
 
         return group
 
+    def join_group(self, name: str, token: str) -> Group:
+        # For groups whose token was shared out of band
+        return self._add_group(name, token)
+
     def advertise_group(self, group_name: str, dest: Address):
-        group = self._groups[group_name]
+        self._run(self._advertise_group(group_name, dest))
+
+    def advertise_many(
+        self,
+        group_name: str,
+        destinations: list[Address | str],
+        resolve: Callable[[str], Address] | None = None,
+        limit: int = ADVERTISE_CONCURRENCY,
+    ) -> dict[str, Exception | None]:
+        return self._run(self._advertise_many(group_name, destinations, resolve, limit))
+
+    def send(self, group_name: str, content: str):
+        self._run(self._send(group_name, content))
+
+    def send_file(self, group_name: str, path: str):
+        with open(path, "rb") as f:
+            self._run(self._send_stream(group_name, os.path.basename(path), f))
+
+    def link(self, group_name: str, dest: Address):
+        self._run(self._link(group_name, dest))
+
+    def listen(self) -> Address:
+        return self._run(self._listen())
+
+    def load_older(self, group_name: str, limit: int = PAGE_SIZE) -> int:
+        return self._run(self._load_older(group_name, limit))
+
+    def subscribe(self, callback: Subscriber) -> Callable[[], None]:
+        self._subscribers.append(callback)
+
+        def unsubscribe():
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def queue_stats(self) -> dict[str, dict]:
+        return {
+            key: peer.outbox.stats.to_dict()
+            for key, peer in list(self._peers.items())
+            if peer.outbox
+        }
+
+    def stats(self) -> dict:
+        return {
+            "metrics": self._metrics.snapshot(),
+            "queues": self.queue_stats(),
+            "peers": self.peer_health(),
+        }
+
+    def dump_stats(self, path: str):
+        # Written aside and renamed so readers never see a partial snapshot
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"timestamp": time.time(), **self.stats()}, f, indent=2)
+        os.replace(tmp, path)
+
+    def peer_health(self) -> dict[str, dict]:
+        return {
+            key: {"connection": peer.state, **self._liveness.to_dict(key)}
+            for key, peer in list(self._peers.items())
+            if peer.conn
+        }
+
+    def close(self):
+        if self._stop_event.is_set():
+            return
+
+        self._stop_event.set()
+
+        future = asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        if threading.current_thread() is not self._thread:
+            future.result(timeout=5)
+
+        self._executor.shutdown(wait=False)
+
+        if self._history:
+            self._history.close()
+
+        if self._profiler:
+            self._profiler.close()
+
+    # ===================================
+    # PRIVATE
+    # ===================================
+
+    def _run[T](self, coro: Coroutine[Any, Any, T]) -> T:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _spawn(self, coro: Coroutine):
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        task.add_done_callback(self._log_failure)
+
+    def _log_failure(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            self._logger.debug("background task failed: %r", task.exception())
+
+    async def _offload[T](self, fn: Callable[..., T], *args) -> T:
+        return await self._loop.run_in_executor(self._executor, fn, *args)
+
+    def _emit(self, event: ChatEvent):
+        if threading.current_thread() is not self._thread:
+            self._loop.call_soon_threadsafe(self._emit, event)
+            return
+
+        # Events are handed out once per loop iteration, a burst of frames
+        # reaches subscribers as one batch
+        self._events.append(event)
+        if len(self._events) == 1:
+            self._loop.call_soon(self._flush_events)
+
+    def _flush_events(self):
+        events, self._events = self._events, []
+        for callback in list(self._subscribers):
+            try:
+                callback(events)
+            except Exception as e:
+                self._logger.error("subscriber error: %r", e)
+
+    async def _shutdown(self):
+        for name in list(self._batch_timers):
+            await self._flush_batch(name)
+
+        if self._server:
+            self._server.close()
+
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop.call_soon(self._loop.stop)
+
+    def _restore_history(self, history: SqliteHistory):
+        # Only the latest page per group is loaded, older pages come on demand
+        for name, token in history.groups():
+            group = Group(name, token, messages=MessageStore(self._history_cap))
+            page = history.page(name)
+            for message in page:
+                group.messages.add(message)
+            group.messages.complete = len(page) < PAGE_SIZE
+            self._groups[name] = group
+
+            # Members are dialed once the peer listens, until one answers a
+            # send reaches nobody
+            for address in history.members(name):
+                group.add_peer(self._get_peer(address))
+
+    async def _load_older(self, group_name: str, limit: int) -> int:
+        group = self._groups.get(group_name)
         if not group:
             raise Exception(f"Unknown group '{group_name}'")
 
-        peer = self._get_peer(dest)
-        if not peer.conn:
-            peer.conn = self._initiate_connection(peer)
+        if not self._history:
+            return 0
+
+        before = None
+        if len(group.messages):
+            oldest = group.messages[0]
+            before = (oldest.sent_at, oldest.id)
+
+        page = await self._offload(self._history.page, group_name, before, limit)
+        if len(page) < limit:
+            group.messages.complete = True
+
+        return group.messages.prepend(page)
+
+    def _add_group(self, name: str, token: str) -> Group:
+        existing = self._groups.get(name)
+        if existing and existing.token == token:
+            return existing
 
-        group.peers.append(peer)
+        # A new token means a different group under the same name
+        if existing:
+            for peer in list(existing.peers.values()):
+                existing.remove_peer(peer)
+
+        group = Group(name, token, messages=MessageStore(self._history_cap))
+        self._groups[name] = group
+        self._emit(ChatEvent("group", group=name))
+
+        if self._history:
+            self._history.save_group(name, token)
+
+        return group
+
+    def _store_message(self, group: Group, message: Message) -> bool:
+        added = group.messages.add(message)
+        if added and self._history:
+            self._history.append(group.name, message)
+
+        if added:
+            self._emit(ChatEvent("message", group=group.name, message=message))
+
+        return added
+
+    async def _listen(self) -> Address:
+        self._server = AsyncTcpSocket()
+        port = await self._server.listen(
+            self._address[0], self._address[1], self._handler
+        )
+
+        # Port 0 takes an ephemeral port, frames must carry the real one
+        self._address = (self._address[0], port)
+
+        # Groups restored from history rejoin through the members they had
+        for group in self._groups.values():
+            self._dial_members(
+                group, list(group.peers.values()), self._connections.reconnect
+            )
+
+        return self._address
+
+    async def _advertise_group(self, group_name: str, dest: Address):
+        group = self._groups.get(group_name)
+        if not group:
+            raise Exception(f"Unknown group '{group_name}'")
+
+        peer = self._get_peer(dest)
+        await self._connect(peer)
 
         body = AdvertisementBody(group.name, group.token).dump()
-        msg = self._create_message("ADVERTISEMENT", body, peer.public_key)
+        msg = await self._create_message("ADVERTISEMENT", body, peer.public_key)
 
-        peer.conn.send(msg)
+        await self._enqueue(peer, msg)
+        await self._join(group, [peer])
 
-        self._logger.debug(f"-> ADVERTISEMENT to {address_str(peer.address)}")
+        self._logger.debug("-> ADVERTISEMENT to %s", address_str(peer.address))
 
-    def send(self, group_name: str, content: str):
+    async def _advertise_many(
+        self,
+        group_name: str,
+        destinations: list[Address | str],
+        resolve: Callable[[str], Address] | None,
+        limit: int,
+    ) -> dict[str, Exception | None]:
+        if group_name not in self._groups:
+            raise Exception(f"Unknown group '{group_name}'")
+
+        semaphore = asyncio.Semaphore(limit)
+
+        async def attempt(dest: Address | str):
+            address = dest
+            if isinstance(dest, str):
+                if not resolve:
+                    raise Exception(f"Cannot resolve '{dest}' without DNS")
+
+                # Lookups block, they get the default executor so they
+                # never hold up crypto work
+                address = await self._loop.run_in_executor(None, resolve, dest)
+
+            await self._advertise_group(group_name, address)
+
+        async def advertise(dest: Address | str):
+            # The lookup counts against the deadline, a lost DNS reply must
+            # not hold a slot forever
+            async with semaphore:
+                await asyncio.wait_for(attempt(dest), self._connections.deadline())
+
+        targets = {
+            dest if isinstance(dest, str) else address_str(dest): dest
+            for dest in destinations
+        }
+        results = await asyncio.gather(
+            *(advertise(dest) for dest in targets.values()), return_exceptions=True
+        )
+
+        self._logger.debug(
+            "-> ADVERTISEMENT of '%s' to %s destinations", group_name, len(targets)
+        )
+
+        return {
+            key: result if isinstance(result, Exception) else None
+            for key, result in zip(targets, results)
+        }
+
+    async def _send(self, group_name: str, content: str):
         group = self._groups.get(group_name)
         if not group:
             raise Exception(f"Unknown group '{group_name}'")
 
-        for peer in group.peers:
-            if not peer.conn or not peer.public_key:
-                continue
+        # Every copy of the message shares one id so relays can drop duplicates
+        id = uuid.uuid4().hex
+        ts = time.time()
+        body = ConversationBody(
+            sender=self._address,
+            content=content,
+            timestamp=ts,
+            group=group.name,
+            group_token=group.token,
+        ).dump()
 
-            ts = time.time()
-            body = ConversationBody(
-                sender=self._address,
-                content=content,
-                timestamp=ts,
-                group=group.name,
-                group_token=group.token,
-            ).dump()
+        # Refused before it is stored, anti-entropy would keep offering it
+        check_body("CONVERSATION", body)
+        self._store_message(group, Message(self._address, content, ts, ts, id))
+
+        if self._batcher.config.enabled:
+            # A message filling a batch on its own goes out alone, pending
+            # ones can not push the batch over the frame limit
+            if len(body) >= self._batcher.config.max_bytes:
+                await self._flush_batch(group.name)
+
+            entry = {
+                "id": id,
+                "sender": self._address,
+                "content": content,
+                "timestamp": ts,
+            }
+
+            if self._batcher.add(group.name, entry):
+                await self._flush_batch(group.name)
+            elif group.name not in self._batch_timers:
+                self._batch_timers[group.name] = self._loop.call_later(
+                    self._batcher.config.delay,
+                    lambda: self._spawn(self._flush_batch(group.name)),
+                )
+            return
 
-            msg = self._create_message("CONVERSATION", body, peer.public_key)
-            peer.conn.send(msg)
+        await self._publish(group, "CONVERSATION", id, body)
 
-            chat_msg = Message(self._address, content, ts, ts)
-            self._insert_message(group_name, chat_msg)
+        self._logger.debug("-> CONVERSATION to group '%s'", group.name)
 
-            self._logger.debug(f"-> CONVERSATION to {address_str(peer.address)}")
+    async def _flush_batch(self, group_name: str):
+        timer = self._batch_timers.pop(group_name, None)
+        if timer:
+            timer.cancel()
 
-    def listen(self):
-        tcp = TcpSocket()
-        tcp.listen(self._address[0], self._address[1], self._handler)
+        group = self._groups.get(group_name)
+        entries = self._batcher.take(group_name)
+        if not group or not entries:
+            return
 
-    # ===================================
-    # PRIVATE
-    # ===================================
+        body = BatchBody(group.name, group.token, entries).dump()
+        await self._publish(group, "BATCH", uuid.uuid4().hex, body)
+
+        self._logger.debug("-> BATCH of %s to group '%s'", len(entries), group.name)
 
-    def _insert_message(self, group_name: str, message: Message):
-        group = self._groups[group_name]
+    async def _publish(self, group: Group, type: str, id: str, body: bytes):
+        # Checked uncompressed, peers without codecs get a plain copy
+        check_body(type, body)
 
-        i = len(group.messages)
-        while i > 0 and group.messages[i - 1].sent_at > message.sent_at:
-            i -= 1
+        # The body is compressed and encrypted once, only the AES key is
+        # wrapped per peer
+        key, nonce, body, encoding = await self._offload(
+            self._encode_body, body, self._compression
+        )
 
-        group.messages.insert(i, message)
+        frame = CachedFrame(
+            type=type,
+            id=id,
+            group=group.name,
+            sender=self._address,
+            ttl=self._gossip.config.initial_ttl(),
+            key=key,
+            nonce=nonce,
+            body=body,
+            encoding=encoding,
+        )
+        self._remember(frame)
 
-    def _forward(
+        await self._relay(group, frame)
+
+    async def _forward(
         self,
         group: Group,
         header: Header,
         key: bytes,
         nonce: bytes,
         body: bytes,
+        source: Peer | None = None,
     ):
         if not group:
             raise Exception(f"Unknown group '{group}'")
 
-        for peer in group.peers:
-            if not peer.conn or not peer.public_key:
-                continue
+        frame = CachedFrame(
+            type=header.type,
+            id=header.id,
+            group=group.name,
+            sender=header.sender,
+            ttl=None if header.ttl is None else header.ttl - 1,
+            key=key,
+            nonce=nonce,
+            body=body,
+            encoding=header.encoding,
+        )
+        self._remember(frame)
+
+        exclude = [header.sender]
+        if source:
+            exclude.append(source.address)
+
+        forwarded = await self._relay(group, frame, exclude)
+        self._metrics.counter(
+            "chat_forwards_total", "Frames relayed to other peers", type=header.type
+        ).inc(len(forwarded))
+
+        for peer in forwarded:
+            self._logger.debug(
+                "forwarded %s (%s -> %s)",
+                header.type,
+                address_str(header.sender),
+                address_str(peer.address),
+            )
 
-            if eq_address(peer.address, header.sender):
-                continue
+    def _remember(self, frame: CachedFrame):
+        # Only frames announced by IHAVE are ever asked for again, flooding
+        # would fill the cache with bodies nobody requests
+        config = self._gossip.config
+        if config.mode == "gossip" and config.lazy:
+            self._gossip.remember(frame)
 
-            new_key = rsa_encrypt(peer.public_key, key)
-            header.key_len = len(new_key)
+    async def _relay(
+        self,
+        group: Group,
+        frame: CachedFrame,
+        exclude: list[Address] = [],
+    ) -> list[Peer]:
+        candidates = [
+            peer
+            for peer in group.peers.values()
+            if peer.conn
+            and peer.public_key
+            and not any(eq_address(peer.address, a) for a in exclude)
+            and self._liveness.state(address_str(peer.address)) != "dead"
+        ]
+
+        # Eager pushes go to live, low latency peers first
+        eager, lazy = self._gossip.config.split(
+            candidates,
+            frame.ttl,
+            lambda peer: self._liveness.rank(address_str(peer.address)),
+        )
+
+        for peer in lazy:
+            self._gossip.announce(address_str(peer.address), group.name, frame.id)
+
+        # Each peer has its own queue, a slow peer does not hold back the others
+        await asyncio.gather(*(self._wrap_for(peer, frame) for peer in eager))
+
+        return eager
+
+    async def _wrap_for(self, peer: Peer, frame: CachedFrame):
+        if not peer.public_key:
+            return
+
+        # Peers that did not negotiate the encoding get a plain copy
+        if frame.encoding and frame.encoding not in peer.codecs:
+            if not frame.fallback:
+                frame.fallback = await self._offload(self._plain_copy, frame)
+            frame = frame.fallback
+
+        key = await self._offload(self._rsa_encrypt, peer.public_key, frame.key)
+        header = Header(
+            type=frame.type,
+            id=frame.id,
+            sender=frame.sender,
+            key_len=len(key),
+            nonce_len=len(frame.nonce),
+            body_len=len(frame.body),
+            ttl=frame.ttl,
+            encoding=frame.encoding,
+        )
+
+        await self._enqueue(
+            peer,
+            header.dump().ljust(HEADER_SIZE, b" ") + key + frame.nonce + frame.body,
+        )
+
+    async def _gossip_loop(self):
+        while not self._stop_event.is_set():
+            await asyncio.sleep(self._gossip.config.ihave_interval)
 
-            peer.conn.send(
-                header.dump().ljust(HEADER_SIZE, b" ") + new_key + nonce + body
-            )
+            for (peer_key, group), ids in self._gossip.take_announcements().items():
+                peer = self._peers.get(peer_key)
+                if not peer or not peer.outbox or not peer.public_key:
+                    continue
 
-            self._logger.debug(
-                f"forwarded CONVERSATION ({address_str(header.sender)} -> {address_str(peer.address)})"
-            )
+                body = IHaveBody(group, ids).dump()
+                msg = await self._create_message("IHAVE", body, peer.public_key)
+                try:
+                    await self._enqueue(peer, msg)
+                except ConnectionError:
+                    continue
 
-    def _handler(self, conn: TcpSocket, _):
+    async def _handler(self, conn: AsyncTcpSocket, _):
+        # Frames are opened on the executor while the next ones are being read,
+        # the dispatcher consumes them in arrival order
+        pending = asyncio.Queue[asyncio.Future[InboundFrame] | None](
+            self._pipeline_depth
+        )
+        dispatcher = asyncio.create_task(self._dispatch_loop(conn, pending))
+
+        try:
+            await self._read_frames(conn, pending)
+        except ConnectionError as e:
+            self._logger.debug("connection closed: %r", e)
+        except Exception as e:
+            self._logger.error("handler error: %r", e)
+        finally:
+            await pending.put(None)
+            await dispatcher
+
+            conn.close()
+            self._outbound.discard(conn)
+
+            for incoming in list(self._streams_in.values()):
+                if incoming.conn is conn:
+                    await self._abort_stream(incoming, "connection closed")
+
+            for peer in list(self._peers.values()):
+                if peer.conn is conn:
+                    self._detach(peer)
+                    self._schedule_reconnect(peer)
+
+    async def _read_frames(
+        self,
+        conn: AsyncTcpSocket,
+        pending: asyncio.Queue[asyncio.Future[InboundFrame] | None],
+    ):
         while not self._stop_event.is_set():
             # Get header
-            header_bytes = conn.recv_exact(256)
+            header_bytes = await conn.recv_exact(HEADER_SIZE)
             header = Header(**json.loads(header_bytes.decode()))
 
-            # Get and decrypt key
+            if max(header.key_len, header.nonce_len, header.body_len) > MAX_BODY_SIZE:
+                raise ConnectionError(f"Frame too large from {header.sender}")
+
+            # Get key
             key: bytes | None = None
             if header.key_len:
-                key = conn.recv_exact(header.key_len)
-                key = rsa_decrypt(self._private_key, key)
+                key = await conn.recv_exact(header.key_len)
 
             # Get nonce
             nonce: bytes | None = None
             if header.nonce_len:
-                nonce = conn.recv_exact(header.nonce_len)
+                nonce = await conn.recv_exact(header.nonce_len)
 
-            # Get and decrypt body
-            body_bytes = conn.recv_exact(header.body_len)
-            body_bytes_unmodified = body_bytes
-            if key and nonce:
-                body_bytes = aes_decrypt(key, nonce, body_bytes)
+            # Get body
+            body = await conn.recv_exact(header.body_len)
 
-            # Ignore if seen
-            if header.id in self._seen:
+            self._count_in(conn, header)
+
+            # Drop duplicates before any decryption work is spent on them
+            if header.type in SEEN_TYPES and self._seen.check_and_add(header.id):
+                self._duplicates.inc()
                 continue
-            else:
-                self._seen.add(header.id)
 
-            # Get peer
-            peer = self._get_peer(header.sender)
+            frame = InboundFrame(header, key, nonce, body)
+            opener = self._profiled_open if self._profiler else self._open_frame
+            await pending.put(self._loop.run_in_executor(self._executor, opener, frame))
 
-            # self._logger.debug(peer)
+    def _profiled_open(self, frame: InboundFrame) -> InboundFrame:
+        with cast(Profiler, self._profiler).track(f"open {frame.header.type}"):
+            return self._open_frame(frame)
 
-            if header.type == "PING":
-                pong = self._create_message("PONG", b"")
-                conn.send(pong)
+    def _open_frame(self, frame: InboundFrame) -> InboundFrame:
+        header = frame.header
 
-            if header.type == "PUBLIC_KEY":
-                peer.conn = conn
-                with self._lock:
-                    peer.public_key = public_key_from_json(body_bytes.decode())
-                self._exchange_public_key(peer)
+        if header.type == "PUBLIC_KEY":
+            handshake = frame.body.decode()
+            codecs = json.loads(handshake).get("codecs", [])
+            frame.payload = (public_key_from_json(handshake), codecs)
 
-                self._logger.debug(f"<- PUBLIC_KEY from {address_str(header.sender)}")
+        if not frame.key or not frame.nonce:
+            return frame
 
-            elif header.type == "ADVERTISEMENT":
-                if not key or not nonce:
-                    continue
+        # Decrypt key and body
+        with self._crypto_time["rsa_decrypt"].time():
+            frame.key = rsa_decrypt(self._private_key, frame.key)
+        with self._crypto_time["aes_decrypt"].time():
+            body_bytes = aes_decrypt(frame.key, frame.nonce, frame.body)
+        if header.encoding:
+            body_bytes = decompress(body_bytes, header.encoding)
+
+        schema = BODY_SCHEMAS.get(header.type)
+        if schema:
+            frame.payload = schema(**json.loads(body_bytes.decode()))
 
-                body = AdvertisementBody(**json.loads(body_bytes.decode()))
-                self._groups[body.group] = Group(body.group, body.token, [peer])
+        return frame
 
+    async def _dispatch_loop(
+        self,
+        conn: AsyncTcpSocket,
+        pending: asyncio.Queue[asyncio.Future[InboundFrame] | None],
+    ):
+        while True:
+            future = await pending.get()
+            if future is None:
+                return
+
+            try:
+                frame = await future
+                timer = self._metrics.histogram(
+                    "chat_dispatch_seconds",
+                    "Time to handle a frame by type",
+                    type=frame.header.type,
+                )
+                with timer.time():
+                    if self._profiler:
+                        with self._profiler.track(f"dispatch {frame.header.type}"):
+                            await self._dispatch(conn, frame)
+                    else:
+                        await self._dispatch(conn, frame)
+            except asyncio.CancelledError:
+                raise
+            except ConnectionError as e:
+                # Keep draining so the reader is never stuck on a full queue,
+                # closing the connection makes it stop on its next read
+                self._logger.debug("connection lost while dispatching: %r", e)
+                conn.close()
+            except Exception as e:
+                self._logger.error("dispatch error: %r", e)
+
+    async def _dispatch(self, conn: AsyncTcpSocket, frame: InboundFrame):
+        header = frame.header
+
+        # Get peer
+        peer = self._get_peer(header.sender)
+        if peer.conn is conn:
+            self._liveness.heard(address_str(peer.address))
+
+        if header.type == "PING":
+            # The pong echoes the ping id so the sender can measure the RTT
+            pong = await self._create_message("PONG", header.id.encode())
+            if peer.conn is conn:
+                await self._enqueue(peer, pong)
+            else:
+                await conn.send(pong)
+
+        elif header.type == "PONG":
+            rtt = self._liveness.pong(address_str(peer.address), frame.body.decode())
+            if rtt is not None:
                 self._logger.debug(
-                    f"<- ADVERTISEMENT from {address_str(header.sender)}"
+                    "<- PONG from %s, rtt %.1fms",
+                    address_str(header.sender),
+                    rtt * 1000,
                 )
 
-            elif header.type == "CONVERSATION":
-                if not key or not nonce:
+        elif header.type == "PUBLIC_KEY":
+            public_key, codecs = frame.payload
+            peer.codecs = [c for c in codecs if c in CODECS]
+            peer.set_public_key(public_key)
+
+            # Both sides dialed at once, only one of the connections is kept
+            if not self._adopt(peer, conn):
+                self._logger.debug(
+                    "duplicate connection from %s closed", address_str(header.sender)
+                )
+                conn.close()
+                return
+
+            await self._exchange_public_key(peer)
+            peer.state = "ready"
+
+            # Catch up on whatever was exchanged while the link was down
+            self._spawn(self._sync_with(peer))
+
+            self._logger.debug("<- PUBLIC_KEY from %s", address_str(header.sender))
+
+        elif header.type == "ADVERTISEMENT":
+            body = frame.payload
+            if not isinstance(body, AdvertisementBody):
+                return
+
+            group = self._add_group(body.group, body.token)
+            await self._join(group, [peer], source=peer)
+
+            self._logger.debug("<- ADVERTISEMENT from %s", address_str(header.sender))
+
+        elif header.type == "MEMBERS":
+            body = frame.payload
+            if not isinstance(body, MembersBody):
+                return
+
+            group = self._groups.get(body.group)
+            if not group or body.group_token != group.token:
+                return
+
+            peers = [self._get_peer(tuple(a)) for a in body.peers]
+            added = await self._join(group, [peer, *peers], source=peer)
+
+            self._logger.debug(
+                "<- MEMBERS from %s, %s new", address_str(header.sender), added
+            )
+
+        elif header.type == "CONVERSATION":
+            if not frame.key or not frame.nonce:
+                return
+
+            body = frame.payload
+            if not isinstance(body, ConversationBody):
+                return
+
+            group = self._groups.get(body.group)
+            if not group:
+                return
+
+            if body.group_token != group.token:
+                return
+
+            msg = Message(
+                sender=body.sender,
+                content=body.content,
+                received_at=time.time(),
+                sent_at=body.timestamp,
+                id=header.id,
+            )
+
+            self._store_message(group, msg)
+            self._gossip.received(header.id)
+            self._logger.debug("<- CONVERSATION from %s", address_str(header.sender))
+
+            await self._forward(
+                group=group,
+                header=header,
+                key=frame.key,
+                nonce=frame.nonce,
+                body=frame.body,
+                source=self._conn_peers.get(conn),
+            )
+
+        elif header.type == "BATCH":
+            if not frame.key or not frame.nonce:
+                return
+
+            body = frame.payload
+            if not isinstance(body, BatchBody):
+                return
+
+            group = self._groups.get(body.group)
+            if not group or body.group_token != group.token:
+                return
+
+            received_at = time.time()
+            for entry in body.messages:
+                if self._seen.check_and_add(entry["id"]):
+                    self._duplicates.inc()
                     continue
 
-                body = ConversationBody(**json.loads(body_bytes.decode()))
+                msg = Message(
+                    sender=tuple(entry["sender"]),
+                    content=entry["content"],
+                    received_at=received_at,
+                    sent_at=entry["timestamp"],
+                    id=entry["id"],
+                )
+                self._store_message(group, msg)
+
+            self._gossip.received(header.id)
+            self._logger.debug(
+                "<- BATCH of %s from %s", len(body.messages), address_str(header.sender)
+            )
+
+            await self._forward(
+                group=group,
+                header=header,
+                key=frame.key,
+                nonce=frame.nonce,
+                body=frame.body,
+                source=self._conn_peers.get(conn),
+            )
+
+        elif header.type == "IHAVE":
+            body = frame.payload
+            if not isinstance(body, IHaveBody) or body.group not in self._groups:
+                return
+
+            # Pull only the bodies we have not seen and did not ask for yet
+            missing = [i for i in body.ids if i not in self._seen]
+            wanted = self._gossip.want(missing)
+            if not wanted or not peer.public_key:
+                return
+
+            msg = await self._create_message(
+                "IWANT", IWantBody(body.group, wanted).dump(), peer.public_key
+            )
+            await self._enqueue(peer, msg)
+
+            self._logger.debug(
+                "<- IHAVE from %s, want %s", address_str(header.sender), len(wanted)
+            )
+
+        elif header.type == "IWANT":
+            body = frame.payload
+            if not isinstance(body, IWantBody):
+                return
+
+            group = self._groups.get(body.group)
+            if not group or not group.has_peer(peer):
+                return
+
+            for id in body.ids:
+                cached = self._gossip.lookup(id)
+                if cached and cached.group == group.name:
+                    await self._wrap_for(peer, cached)
+
+        elif header.type.startswith("SYNC_"):
+            await self._dispatch_sync(peer, frame.payload)
+
+        elif header.type.startswith("STREAM_"):
+            await self._dispatch_stream(conn, peer, frame)
+
+    # ===================================
+    # STREAMS
+    # ===================================
+
+    async def _send_stream(self, group_name: str, name: str, source: BinaryIO):
+        group = self._groups.get(group_name)
+        if not group:
+            raise Exception(f"Unknown group '{group_name}'")
+
+        config = self._stream
+        ts = time.time()
+        message_id = uuid.uuid4().hex
+
+        # Every direct member gets its own stream key, chunks are not relayed
+        streams: dict[str, tuple[Peer, OutgoingStream]] = {}
+        opened: list[tuple[AsyncTcpSocket, str]] = []
+        for peer in group.peers.values():
+            if not peer.conn or not peer.outbox or not peer.public_key:
+                continue
 
-                group = self._groups[body.group]
-                if not group:
+            stream = OutgoingStream(
+                secrets.token_bytes(16), generate_aes_key(), config.window
+            )
+            body = StreamOpenBody(
+                stream=stream.id.hex(),
+                key=stream.key.hex(),
+                group=group.name,
+                group_token=group.token,
+                name=name,
+                sent_at=ts,
+                message=message_id,
+            ).dump()
+            msg = await self._create_message("STREAM_OPEN", body, peer.public_key)
+            await self._enqueue(peer, msg)
+
+            streams[stream.id.hex()] = (peer, stream)
+            opened.append((peer.conn, stream.id.hex()))
+            self._streams_out[opened[-1]] = stream
+
+        if not streams:
+            raise Exception(f"No connected members in group '{group_name}'")
+
+        size = 0
+        try:
+            # Only one chunk is held in memory at a time, whatever the payload size
+            while streams:
+                data = await self._offload(source.read, config.chunk_size)
+                final = len(data) < config.chunk_size
+                size += len(data)
+
+                results = await asyncio.gather(
+                    *(
+                        self._send_chunk(peer, stream, final, data)
+                        for peer, stream in streams.values()
+                    ),
+                    return_exceptions=True,
+                )
+
+                for (id, (peer, _)), result in zip(list(streams.items()), results):
+                    if isinstance(result, BaseException):
+                        self._logger.debug(
+                            "stream to %s failed: %r", address_str(peer.address), result
+                        )
+                        streams.pop(id)
+
+                if final:
+                    break
+
+            for id, (peer, stream) in list(streams.items()):
+                try:
+                    await stream.wait_done(config.timeout)
+                except asyncio.TimeoutError:
+                    streams.pop(id)
+
+        finally:
+            for key in opened:
+                self._streams_out.pop(key, None)
+
+        content = file_notice(name, size)
+        self._store_message(group, Message(self._address, content, ts, ts, message_id))
+
+        self._logger.debug(
+            "-> STREAM '%s' (%s bytes) to %s peers in '%s'",
+            name,
+            size,
+            len(streams),
+            group.name,
+        )
+
+    async def _send_chunk(
+        self, peer: Peer, stream: OutgoingStream, final: bool, data: bytes
+    ):
+        await stream.wait_window(self._stream.timeout)
+
+        seq = stream.sent
+        stream.sent += 1
+
+        nonce, body = await self._offload(
+            self._timed,
+            "aes_encrypt",
+            seal_chunk,
+            stream.key,
+            stream.id,
+            seq,
+            final,
+            data,
+        )
+        header = Header(
+            type="STREAM_CHUNK",
+            id=uuid.uuid4().hex,
+            sender=self._address,
+            key_len=0,
+            nonce_len=len(nonce),
+            body_len=len(body),
+        )
+
+        await self._enqueue(peer, header.dump().ljust(HEADER_SIZE, b" ") + nonce + body)
+
+    async def _dispatch_stream(
+        self, conn: AsyncTcpSocket, peer: Peer, frame: InboundFrame
+    ):
+        header = frame.header
+
+        if header.type == "STREAM_OPEN":
+            body = frame.payload
+            if not isinstance(body, StreamOpenBody):
+                return
+
+            group = self._groups.get(body.group)
+            if not group or body.group_token != group.token:
+                return
+
+            name = os.path.basename(body.name) or "file"
+            path = os.path.join(self._stream.directory, f"{body.stream[:8]}-{name}")
+            file = await self._offload(self._open_download, path)
+
+            self._streams_in[body.stream] = IncomingStream(
+                id=bytes.fromhex(body.stream),
+                key=bytes.fromhex(body.key),
+                group=group.name,
+                name=name,
+                path=path,
+                file=file,
+                conn=conn,
+                message=body.message,
+                sent_at=body.sent_at,
+            )
+
+            self._logger.debug(
+                "<- STREAM_OPEN '%s' from %s", name, address_str(header.sender)
+            )
+
+        elif header.type == "STREAM_CHUNK":
+            if not frame.nonce:
+                return
+
+            stream_id, seq, final = chunk_prefix(frame.body)
+            incoming = self._streams_in.get(stream_id.hex())
+            if not incoming or incoming.conn is not conn:
+                return
+
+            if seq != incoming.next_seq:
+                await self._abort_stream(
+                    incoming, f"expected chunk {incoming.next_seq}, got {seq}"
+                )
+                return
+
+            try:
+                data = await self._offload(
+                    self._timed,
+                    "aes_decrypt",
+                    open_chunk,
+                    incoming.key,
+                    frame.nonce,
+                    frame.body,
+                )
+            except Exception:
+                await self._abort_stream(incoming, f"chunk {seq} failed authentication")
+                return
+
+            await self._offload(incoming.file.write, data)
+            incoming.next_seq += 1
+            incoming.received += len(data)
+
+            # Acks open the sender's window, one per chunk written to disk
+            ack = await self._create_message(
+                "STREAM_ACK", StreamAckBody(stream_id.hex(), seq).dump()
+            )
+            await self._enqueue(peer, ack)
+
+            if not final:
+                return
+
+            self._streams_in.pop(stream_id.hex(), None)
+            await self._offload(incoming.file.close)
+
+            group = self._groups.get(incoming.group)
+            if group:
+                msg = Message(
+                    sender=header.sender,
+                    content=file_notice(incoming.name, incoming.received),
+                    sent_at=incoming.sent_at,
+                    received_at=time.time(),
+                    id=incoming.message,
+                )
+                self._store_message(group, msg)
+
+            self._logger.debug(
+                "<- STREAM '%s' (%s bytes) from %s -> %s",
+                incoming.name,
+                incoming.received,
+                address_str(header.sender),
+                incoming.path,
+            )
+
+        elif header.type == "STREAM_ACK":
+            body = StreamAckBody(**json.loads(frame.body.decode()))
+            stream = self._streams_out.get((conn, body.stream))
+            if stream:
+                await stream.ack(body.seq)
+
+    async def _abort_stream(self, incoming: IncomingStream, reason: str):
+        self._streams_in.pop(incoming.id.hex(), None)
+        await self._offload(self._discard_download, incoming.file, incoming.path)
+
+        self._logger.debug("stream '%s' aborted: %s", incoming.name, reason)
+
+    @staticmethod
+    def _open_download(path: str) -> BinaryIO:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return open(path, "wb")
+
+    @staticmethod
+    def _discard_download(file: BinaryIO, path: str):
+        file.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+    # ===================================
+    # MEMBERSHIP
+    # ===================================
+
+    async def _join(
+        self, group: Group, peers: list[Peer], source: Peer | None = None
+    ) -> int:
+        added = [
+            p
+            for p in peers
+            if not eq_address(p.address, self._address) and group.add_peer(p)
+        ]
+        if not added:
+            return 0
+
+        for p in added:
+            self._emit(ChatEvent("peer", group=group.name, peer=p.key))
+        self._save_members(group, added)
+
+        # Newcomers get the full view, everyone else only the delta. Only new
+        # knowledge is passed on, so the exchange dies out once all agree
+        delta = [p.address for p in added]
+        keys = {p.key for p in added}
+        for member in list(group.peers.values()):
+            if member.key in keys:
+                view = [p.address for p in group.peers.values() if p is not member]
+            elif member is not source:
+                view = delta
+            else:
+                continue
+
+            if view:
+                await self._send_members(member, group, view)
+
+        self._dial_members(group, [p for p in added if p is not source])
+
+        return len(added)
+
+    def _dial_members(self, group: Group, candidates: list[Peer], retry: bool = False):
+        # Members learned second hand stay in the view but are only dialed
+        # while the group has no direct link. Relays only use direct links,
+        # dialing everyone would turn every group into a full mesh
+        if any(p.conn for p in group.peers.values()):
+            return
+
+        idle = [p for p in candidates if not p.conn]
+        random.shuffle(idle)
+        for p in idle[: self._gossip.config.fanout]:
+            self._spawn(self._connect(p, retry))
+
+    async def _link(self, group_name: str, dest: Address):
+        group = self._groups.get(group_name)
+        if not group:
+            raise Exception(f"Unknown group '{group_name}'")
+
+        peer = self._get_peer(dest)
+        await self._connect(peer)
+
+        # Unlike an advertisement the member is never announced, both ends
+        # link each other and the overlay stays the one the caller built
+        if group.add_peer(peer):
+            self._emit(ChatEvent("peer", group=group.name, peer=peer.key))
+            self._save_members(group, [peer])
+
+    def _save_members(self, group: Group, peers: list[Peer]):
+        if self._history and peers:
+            self._history.save_members(group.name, [p.address for p in peers])
+
+    async def _send_members(self, peer: Peer, group: Group, view: list[Address]):
+        if not peer.outbox or not peer.public_key:
+            return
+
+        body = MembersBody(group.name, group.token, view).dump()
+        msg = await self._create_message("MEMBERS", body, peer.public_key)
+        try:
+            await self._enqueue(peer, msg)
+        except ConnectionError:
+            pass
+
+        self._logger.debug(
+            "-> MEMBERS of '%s' (%s) to %s",
+            group.name,
+            len(view),
+            address_str(peer.address),
+        )
+
+    # ===================================
+    # LIVENESS
+    # ===================================
+
+    async def _heartbeat_loop(self):
+        while not self._stop_event.is_set():
+            await asyncio.sleep(self._liveness.config.interval)
+
+            for key, peer in list(self._peers.items()):
+                if not peer.outbox or not peer.public_key:
+                    continue
+
+                # Dead links are closed instead of absorbing writes until TCP
+                # gives up on them
+                if self._liveness.state(key) == "dead":
+                    self._logger.debug("peer %s is dead, closing connection", key)
+                    if peer.conn:
+                        peer.conn.close()
+                    self._detach(peer)
+                    self._schedule_reconnect(peer)
                     continue
 
-                if body.group_token != group.token:
+                id = uuid.uuid4().hex
+                msg = await self._create_message("PING", b"", id=id)
+                self._liveness.ping(key, id)
+                try:
+                    await self._enqueue(peer, msg)
+                except ConnectionError:
                     continue
 
+    # ===================================
+    # ANTI-ENTROPY
+    # ===================================
+
+    async def _anti_entropy_loop(self):
+        while not self._stop_event.is_set():
+            await asyncio.sleep(self._sync.config.interval)
+
+            # Each round reconciles every group with one random ready member
+            for group in list(self._groups.values()):
+                ready = [p for p in group.peers.values() if p.outbox and p.public_key]
+                alive = [
+                    p
+                    for p in ready
+                    if self._liveness.state(address_str(p.address)) == "alive"
+                ]
+                ready = alive or ready
+                if ready:
+                    try:
+                        await self._sync_with(random.choice(ready), [group])
+                    except ConnectionError:
+                        continue
+
+    async def _sync_with(self, peer: Peer, groups: list[Group] | None = None):
+        if groups is None:
+            groups = [self._groups[n] for n in peer.groups if n in self._groups]
+
+        for group in groups:
+            since = self._sync.since(group.messages)
+            buckets = self._sync.digests(group.messages, since)
+            body = SyncDigestBody(group.name, group.token, since, buckets)
+            await self._send_sync(peer, "SYNC_DIGEST", body)
+
+    async def _send_sync(self, peer: Peer, type: str, body):
+        if not peer.public_key or not peer.outbox:
+            return
+
+        msg = await self._create_message(type, body.dump(), peer.public_key)
+        await self._enqueue(peer, msg)
+
+    async def _dispatch_sync(self, peer: Peer, body):
+        group = self._groups.get(body.group)
+        if not group or body.token != group.token:
+            return
+
+        if isinstance(body, SyncDigestBody):
+            since = max(body.since, self._sync.since(group.messages))
+            mine = self._sync.digests(group.messages, since)
+            theirs = {
+                b: d
+                for b, d in body.buckets.items()
+                if int(b) >= self._sync.bucket_of(since)
+            }
+
+            diff = self._sync.diff(mine, theirs)
+            if not diff:
+                return
+
+            await self._send_ids(peer, group, self._sync.ids(group.messages, diff))
+
+            self._logger.debug(
+                "<- SYNC_DIGEST from %s, %s buckets differ",
+                address_str(peer.address),
+                len(diff),
+            )
+
+        elif isinstance(body, SyncIdsBody):
+            theirs = {id for ids in body.buckets.values() for id in ids}
+            buckets = self._sync.ids(group.messages, list(body.buckets))
+            mine = {id for ids in buckets.values() for id in ids}
+
+            missing = [id for id in theirs - mine if id not in group.messages]
+            for ids in split_by_size(missing, id_size, SYNC_FRAME_BYTES):
+                await self._send_sync(
+                    peer, "SYNC_WANT", SyncWantBody(group.name, group.token, ids)
+                )
+
+            # Ours are only pushed once every piece of a bucket is in, an id
+            # missing from one piece may well be in the next
+            extra: list[str] = []
+            for b, ids in buckets.items():
+                key = (peer.key, group.name, b)
+                listed = self._partial_ids.pop(key, set())
+                listed.update(body.buckets[b])
+                if b in body.partial:
+                    self._partial_ids[key] = listed
+                else:
+                    extra.extend(id for id in ids if id not in listed)
+
+            await self._send_messages(peer, group, extra)
+
+        elif isinstance(body, SyncWantBody):
+            await self._send_messages(peer, group, body.ids)
+
+        elif isinstance(body, SyncMessagesBody):
+            received = 0
+            for m in body.messages:
+                self._seen.add(m["id"])
                 msg = Message(
-                    sender=body.sender,
-                    content=body.content,
+                    sender=tuple(m["sender"]),
+                    content=m["content"],
+                    sent_at=m["sent_at"],
                     received_at=time.time(),
-                    sent_at=body.timestamp,
+                    id=m["id"],
                 )
+                if self._store_message(group, msg):
+                    received += 1
+
+            self._logger.debug(
+                "<- SYNC_MESSAGES from %s, %s new", address_str(peer.address), received
+            )
+
+    async def _send_ids(self, peer: Peer, group: Group, buckets: dict[str, list[str]]):
+        # A bucket too large for one frame is cut into pieces, all but the
+        # last flagged so the receiver waits for the rest
+        pieces: list[tuple[str, list[str], bool]] = []
+        for b, ids in buckets.items():
+            parts = list(split_by_size(ids, id_size, SYNC_FRAME_BYTES)) or [[]]
+            pieces.extend((b, part, i < len(parts) - 1) for i, part in enumerate(parts))
+
+        def piece_size(piece: tuple[str, list[str], bool]) -> int:
+            return id_size(piece[0]) + 4 + sum(map(id_size, piece[1]))
+
+        for frame in split_by_size(pieces, piece_size, SYNC_FRAME_BYTES):
+            body = SyncIdsBody(
+                group.name,
+                group.token,
+                {b: ids for b, ids, _ in frame},
+                [b for b, _, split in frame if split],
+            )
+            await self._send_sync(peer, "SYNC_IDS", body)
+
+    async def _send_messages(self, peer: Peer, group: Group, ids: list[str]):
+        entries = [
+            {
+                "id": m.id,
+                "sender": m.sender,
+                "content": m.content,
+                "sent_at": m.sent_at,
+            }
+            for m in map(group.messages.get, ids)
+            if m
+        ]
+
+        # Split by encoded size, a count alone lets long messages overflow
+        # MAX_BODY_SIZE and the receiver drops the connection
+        def entry_size(entry: dict) -> int:
+            return len(json.dumps(entry)) + 2
+
+        for batch in split_by_size(entries, entry_size, SYNC_FRAME_BYTES):
+            body = SyncMessagesBody(group.name, group.token, batch)
+            await self._send_sync(peer, "SYNC_MESSAGES", body)
+
+    # ===================================
+    # CONNECTIONS
+    # ===================================
+
+    async def _connect(self, peer: Peer, retry: bool = False):
+        if peer.conn and peer.state == "ready":
+            return
+
+        # Concurrent callers share one dial instead of racing their own
+        key = address_str(peer.address)
+        dial = self._dials.get(key)
+        if not dial:
+            dial = self._loop.create_task(self._dial(peer, retry))
+            self._dials[key] = dial
+            dial.add_done_callback(lambda _: self._dials.pop(key, None))
+
+        timeout = None if retry else self._connections.deadline()
+        await asyncio.wait_for(asyncio.shield(dial), timeout)
+
+    async def _dial(self, peer: Peer, retry: bool):
+        config = self._connections
+        attempt = 0
 
-                group.messages.append(msg)
-                self._logger.debug(f"<- CONVERSATION from {address_str(header.sender)}")
+        while not self._stop_event.is_set():
+            try:
+                await self._dial_once(peer)
+                return
+            except (OSError, asyncio.TimeoutError) as e:
+                if not retry:
+                    peer.state = "idle"
+                    raise
+
+                delay = config.backoff(attempt)
+                attempt += 1
+                peer.state = "backoff"
 
-                self._forward(
-                    group=group,
-                    header=header,
-                    key=key,
-                    nonce=nonce,
-                    body=body_bytes_unmodified,
+                self._logger.debug(
+                    "dial %s failed: %r, retry in %.1fs",
+                    address_str(peer.address),
+                    e,
+                    delay,
+                )
+                await asyncio.sleep(delay)
+
+    async def _dial_once(self, peer: Peer):
+        if peer.conn and peer.state == "ready":
+            return
+
+        config = self._connections
+        peer.state = "connecting"
+
+        conn = AsyncTcpSocket()
+        host, port = config.dial_address(peer.address)
+        await asyncio.wait_for(
+            conn.connect(host, port, self._handler),
+            config.connect_timeout,
+        )
+        self._outbound.add(conn)
+
+        if not self._adopt(peer, conn):
+            # An inbound connection from the same peer won the race
+            conn.close()
+            return
+
+        peer.state = "handshaking"
+        try:
+            await asyncio.wait_for(
+                self._exchange_public_key(peer), config.handshake_timeout
+            )
+        except asyncio.TimeoutError:
+            conn.close()
+            if peer.conn is conn:
+                self._detach(peer)
+            raise
+
+        peer.state = "ready"
+
+    def _adopt(self, peer: Peer, conn: AsyncTcpSocket) -> bool:
+        current = peer.conn
+        if current is None or current is conn:
+            self._attach(peer, conn)
+            return True
+
+        # Both ends keep the connection dialed by the lower address, so they
+        # agree on the winner without another round trip
+        if self._dialer(peer, current) <= self._dialer(peer, conn):
+            return False
+
+        self._attach(peer, conn)
+        current.close()
+        return True
+
+    def _dialer(self, peer: Peer, conn: AsyncTcpSocket) -> Address:
+        return self._address if conn in self._outbound else peer.address
+
+    def _schedule_reconnect(self, peer: Peer):
+        if not self._connections.reconnect or self._stop_event.is_set():
+            return
+
+        # Only group members are worth a reconnect
+        if not peer.groups:
+            return
+
+        async def reconnect():
+            # Give a connection the peer is dialing right now time to arrive
+            await asyncio.sleep(self._connections.backoff(0))
+            try:
+                await self._connect(peer, retry=True)
+            except Exception as e:
+                self._logger.debug(
+                    "reconnect to %s failed: %r", address_str(peer.address), e
                 )
-            else:
-                pass
 
-    def _initiate_connection(self, peer: Peer):
-        conn = TcpSocket()
-        conn.connect(peer.address[0], peer.address[1], self._handler)
+        peer.state = "backoff"
+        self._spawn(reconnect())
 
-        peer.conn = conn
-        self._exchange_public_key(peer)
-        peer.wait_public_key()
+    def _attach(self, peer: Peer, conn: AsyncTcpSocket):
+        if peer.conn is conn:
+            return
+
+        if peer.outbox:
+            peer.outbox.close()
 
-        return conn
+        if peer.conn:
+            self._conn_peers.pop(peer.conn, None)
 
-    def _exchange_public_key(self, peer: Peer):
+        peer.conn = conn
+        peer.outbox = OutboundQueue(conn, self._queue_size, self._overflow)
+        peer.public_key_sent = False
+        self._conn_peers[conn] = peer
+
+        # Heartbeat history of an earlier connection says nothing about this one
+        self._liveness.reset(address_str(peer.address))
+        self._emit(ChatEvent("peer", peer=peer.key))
+
+    def _detach(self, peer: Peer):
+        if peer.outbox:
+            peer.outbox.close()
+
+        if peer.conn:
+            self._conn_peers.pop(peer.conn, None)
+
+        peer.conn = None
+        peer.outbox = None
+        peer.state = "idle"
+        peer.reset_handshake()
+        self._liveness.forget(address_str(peer.address))
+        for key in [k for k in self._partial_ids if k[0] == peer.key]:
+            del self._partial_ids[key]
+        self._emit(ChatEvent("peer", peer=peer.key))
+
+    async def _enqueue(self, peer: Peer, frame: bytes):
+        if not peer.outbox:
+            raise ConnectionError(f"No connection to {address_str(peer.address)}")
+
+        key = peer.key
+        self._metrics.counter(
+            "chat_peer_frames_out_total", "Frames queued per peer", peer=key
+        ).inc()
+        self._metrics.counter(
+            "chat_peer_bytes_out_total", "Bytes queued per peer", peer=key
+        ).inc(len(frame))
+
+        try:
+            await peer.outbox.put(frame)
+        except ConnectionError:
+            self._logger.debug(
+                "outbound queue overflow, dropping %s", address_str(peer.address)
+            )
+            self._detach(peer)
+
+    async def _exchange_public_key(self, peer: Peer):
         if not peer.conn:
             raise Exception("Peer have no connection")
 
         if not peer.public_key_sent:
             peer.public_key_sent = True
-            public_key = public_key_to_json(self._public_key).encode()
-            msg = self._create_message("PUBLIC_KEY", public_key)
-            peer.conn.send(msg)
+            # The handshake also advertises the body encodings we can read
+            handshake = json.loads(public_key_to_json(self._public_key))
+            handshake["codecs"] = list(CODECS) if self._compression else []
+
+            msg = await self._create_message(
+                "PUBLIC_KEY", json.dumps(handshake).encode()
+            )
+            await self._enqueue(peer, msg)
 
-            self._logger.debug(f"-> PUBLIC_KEY to {address_str(peer.address)}")
+            self._logger.debug("-> PUBLIC_KEY to %s", address_str(peer.address))
 
-        peer.wait_public_key()
+        await peer.wait_public_key()
 
-    def _create_message(
+    async def _create_message(
         self,
         type: str,
         body: bytes,
         public_key: rsa.RSAPublicKey | None = None,
+        id: str | None = None,
     ):
 
-        if public_key:
-            aes_key = generate_aes_key()
-            key = rsa_encrypt(public_key, aes_key)
+        check_body(type, body)
 
-            nonce, body = aes_encrypt(aes_key, body)
+        if public_key:
+            key, nonce, body = await self._offload(self._seal, public_key, body)
         else:
             key = bytes()
             nonce = bytes()
 
-        id = uuid.uuid4().hex
+        id = id or uuid.uuid4().hex
         header = Header(
             type=type,
             id=id,
@@ -305,13 +1791,75 @@ class ChatModel:
             body_len=len(body),
         ).dump()
 
-        self._seen.add(id)
+        if type in SEEN_TYPES:
+            self._seen.add(id)
+        self._metrics.counter(
+            "chat_frames_created_total", "Frames built by type", type=type
+        ).inc()
 
         if len(header) > HEADER_SIZE:
             raise Exception("Header JSON too large")
 
         return header.ljust(HEADER_SIZE, b" ") + key + nonce + body
 
+    def _count_in(self, conn: AsyncTcpSocket, header: Header):
+        # Attributed to the connection's peer, the sender of a forwarded
+        # frame is not the one that spent our bandwidth
+        peer = self._conn_peers.get(conn)
+        key = peer.key if peer else address_str(header.sender)
+        size = HEADER_SIZE + header.key_len + header.nonce_len + header.body_len
+
+        self._metrics.counter(
+            "chat_frames_in_total", "Frames received by type", type=header.type
+        ).inc()
+        self._metrics.counter(
+            "chat_peer_frames_in_total", "Frames received per peer", peer=key
+        ).inc()
+        self._metrics.counter(
+            "chat_peer_bytes_in_total", "Bytes received per peer", peer=key
+        ).inc(size)
+
+    def _timed[T](self, op: str, fn: Callable[..., T], *args) -> T:
+        with self._crypto_time[op].time():
+            return fn(*args)
+
+    def _rsa_encrypt(self, public_key: rsa.RSAPublicKey, data: bytes) -> bytes:
+        return self._timed("rsa_encrypt", rsa_encrypt, public_key, data)
+
+    def _seal(self, public_key: rsa.RSAPublicKey, body: bytes):
+        aes_key, nonce, body = self._encrypt_body(body)
+        key = self._rsa_encrypt(public_key, aes_key)
+
+        return key, nonce, body
+
+    def _encrypt_body(self, body: bytes):
+        aes_key = generate_aes_key()
+        nonce, body = self._timed("aes_encrypt", aes_encrypt, aes_key, body)
+
+        return aes_key, nonce, body
+
+    def _encode_body(self, body: bytes, codec: str | None):
+        encoding = None
+        if codec:
+            body, encoding = compress(body, codec)
+
+        aes_key, nonce, body = self._encrypt_body(body)
+
+        return aes_key, nonce, body, encoding
+
+    def _plain_copy(self, frame: CachedFrame) -> CachedFrame:
+        body = self._timed(
+            "aes_decrypt", aes_decrypt, frame.key, frame.nonce, frame.body
+        )
+        if frame.encoding:
+            body = decompress(body, frame.encoding)
+
+        aes_key, nonce, body = self._encrypt_body(body)
+
+        return dataclasses.replace(
+            frame, key=aes_key, nonce=nonce, body=body, encoding=None
+        )
+
     def _get_peer(self, address: tuple[str, int]) -> Peer:
         key = address_str(address)
 
@@ -320,10 +1868,7 @@ class ChatModel:
 
             # Save peer if not saved yet
             if not peer:
-                peer = Peer(
-                    address=address,
-                    groups=[],
-                )
+                peer = Peer(address=address)
 
                 self._peers[key] = peer
 
@@ -1,4 +1,5 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Any
 import json
 
 """
@@ -8,7 +9,14 @@ Public key message structure:
 length: fixed 256 bytes
 ---
 [body]
-No encryption
+No encryption, public key and the supported body encodings
+
+Ping / pong message structure (heartbeats):
+[header]
+length: fixed 256 bytes
+---
+[body]
+No encryption, empty for a ping, the ping id for a pong
 
 Advertise message structure:
 [header]
@@ -22,6 +30,18 @@ RSA encrypted
 [body]
 AES encrypted
 
+Members message structure (membership gossip):
+[header]
+length: fixed 256 bytes
+---
+[key]
+RSA encrypted
+---
+[nonce]
+---
+[body]
+AES encrypted, group members the receiver may not know yet
+
 Conversation message structure:
 [header]
 length: fixed 256 bytes
@@ -32,7 +52,75 @@ RSA encrypted
 [nonce]
 ---
 [body]
-AES encrypted
+AES encrypted, compressed first when the header names an encoding
+
+Batch message structure (conversation micro-batching):
+[header]
+length: fixed 256 bytes
+---
+[key]
+RSA encrypted
+---
+[nonce]
+---
+[body]
+AES encrypted, list of conversation entries with their own ids
+
+IHAVE / IWANT message structure (gossip mode):
+[header]
+length: fixed 256 bytes
+---
+[key]
+RSA encrypted
+---
+[nonce]
+---
+[body]
+AES encrypted, group name and list of message ids
+
+Stream open message structure (chunked transfer):
+[header]
+length: fixed 256 bytes
+---
+[key]
+RSA encrypted
+---
+[nonce]
+---
+[body]
+AES encrypted, stream id, stream key and file metadata
+
+Stream chunk message structure:
+[header]
+length: fixed 256 bytes
+---
+[nonce]
+---
+[body]
+stream id (16 bytes), sequence number (4 bytes) and flags (1 byte) in
+clear, followed by the chunk AES encrypted with the stream key, the prefix
+is authenticated as associated data
+
+Stream ack message structure:
+[header]
+length: fixed 256 bytes
+---
+[body]
+No encryption, stream id and highest chunk written
+
+SYNC_DIGEST / SYNC_IDS / SYNC_WANT / SYNC_MESSAGES structure (anti-entropy):
+[header]
+length: fixed 256 bytes
+---
+[key]
+RSA encrypted
+---
+[nonce]
+---
+[body]
+AES encrypted, group name, group token and the exchanged digests, ids or
+messages. Ids and messages are split over frames by size, SYNC_IDS lists
+the buckets continued in the next frame in "partial"
 
 """
 
@@ -45,6 +133,8 @@ class Header:
     key_len: int
     nonce_len: int
     body_len: int
+    ttl: int | None = None
+    encoding: str | None = None
 
     def dump(self) -> bytes:
         return json.dumps(
@@ -55,6 +145,8 @@ class Header:
                 "key_len": self.key_len,
                 "nonce_len": self.nonce_len,
                 "body_len": self.body_len,
+                "ttl": self.ttl,
+                "encoding": self.encoding,
             }
         ).encode()
 
@@ -73,6 +165,22 @@ class AdvertisementBody:
         ).encode()
 
 
+@dataclass
+class MembersBody:
+    group: str
+    group_token: str
+    peers: list[tuple[str, int]]
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "group": self.group,
+                "group_token": self.group_token,
+                "peers": self.peers,
+            }
+        ).encode()
+
+
 @dataclass
 class ConversationBody:
     sender: tuple[str, int]
@@ -91,3 +199,164 @@ class ConversationBody:
                 "group_token": self.group_token,
             }
         ).encode()
+
+
+@dataclass
+class BatchBody:
+    group: str
+    group_token: str
+    messages: list[dict]
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "group": self.group,
+                "group_token": self.group_token,
+                "messages": self.messages,
+            }
+        ).encode()
+
+
+@dataclass
+class IHaveBody:
+    group: str
+    ids: list[str]
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "group": self.group,
+                "ids": self.ids,
+            }
+        ).encode()
+
+
+@dataclass
+class IWantBody:
+    group: str
+    ids: list[str]
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "group": self.group,
+                "ids": self.ids,
+            }
+        ).encode()
+
+
+@dataclass
+class SyncDigestBody:
+    group: str
+    token: str
+    since: float
+    buckets: dict[str, str]
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "group": self.group,
+                "token": self.token,
+                "since": self.since,
+                "buckets": self.buckets,
+            }
+        ).encode()
+
+
+@dataclass
+class SyncIdsBody:
+    group: str
+    token: str
+    buckets: dict[str, list[str]]
+    # Buckets continued in the next frame
+    partial: list[str] = field(default_factory=list)
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "group": self.group,
+                "token": self.token,
+                "buckets": self.buckets,
+                "partial": self.partial,
+            }
+        ).encode()
+
+
+@dataclass
+class SyncWantBody:
+    group: str
+    token: str
+    ids: list[str]
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "group": self.group,
+                "token": self.token,
+                "ids": self.ids,
+            }
+        ).encode()
+
+
+@dataclass
+class SyncMessagesBody:
+    group: str
+    token: str
+    messages: list[dict]
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "group": self.group,
+                "token": self.token,
+                "messages": self.messages,
+            }
+        ).encode()
+
+
+@dataclass
+class StreamOpenBody:
+    stream: str
+    key: str
+    group: str
+    group_token: str
+    name: str
+    sent_at: float
+    # Id of the file notice, shared by the sender and every receiver
+    message: str
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "stream": self.stream,
+                "key": self.key,
+                "group": self.group,
+                "group_token": self.group_token,
+                "name": self.name,
+                "sent_at": self.sent_at,
+                "message": self.message,
+            }
+        ).encode()
+
+
+@dataclass
+class StreamAckBody:
+    stream: str
+    seq: int
+
+    def dump(self) -> bytes:
+        return json.dumps(
+            {
+                "stream": self.stream,
+                "seq": self.seq,
+            }
+        ).encode()
+
+
+@dataclass
+class InboundFrame:
+    header: Header
+    key: bytes | None
+    nonce: bytes | None
+    body: bytes
+    payload: Any = None
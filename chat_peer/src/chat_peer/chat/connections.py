@@ -0,0 +1,31 @@
+from typing import Callable
+from dataclasses import dataclass
+import random
+
+type Address = tuple[str, int]
+
+
+@dataclass
+class ConnectionConfig:
+    connect_timeout: float = 5.0
+    handshake_timeout: float = 5.0
+    reconnect: bool = True
+    backoff_initial: float = 0.5
+    backoff_max: float = 30.0
+    backoff_factor: float = 2.0
+    jitter: float = 0.2
+    # Maps a peer address to the one actually dialed, e.g. an impairment proxy
+    route: Callable[[Address], Address] | None = None
+
+    def backoff(self, attempt: int) -> float:
+        delay = min(
+            self.backoff_max, self.backoff_initial * self.backoff_factor**attempt
+        )
+        # Jitter keeps peers that lost each other from redialing in lockstep
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def deadline(self) -> float:
+        return self.connect_timeout + self.handshake_timeout
+
+    def dial_address(self, address: Address) -> Address:
+        return self.route(address) if self.route else address
@@ -0,0 +1,18 @@
+from typing import Callable, Literal
+from dataclasses import dataclass
+from ..libs.message import Message
+
+type EventType = Literal["message", "group", "peer"]
+
+
+@dataclass
+class ChatEvent:
+    type: EventType
+    group: str | None = None
+    peer: str | None = None
+    message: Message | None = None
+
+
+# Called on the chat event loop with every event of one loop iteration,
+# subscribers must hand the batch off instead of doing work inline
+type Subscriber = Callable[[list[ChatEvent]], None]
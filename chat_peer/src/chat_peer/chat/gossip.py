@@ -0,0 +1,98 @@
+from typing import Callable, Literal, Any
+from dataclasses import dataclass
+from collections import OrderedDict
+import random
+import time
+
+type GossipMode = Literal["flood", "gossip"]
+
+
+@dataclass
+class GossipConfig:
+    mode: GossipMode = "flood"
+    fanout: int = 3
+    ttl: int = 6
+    lazy: bool = True
+    ihave_interval: float = 0.2
+    cache_size: int = 1024
+    want_timeout: float = 1.0
+
+    def initial_ttl(self) -> int | None:
+        return self.ttl if self.mode == "gossip" else None
+
+    def split[T](
+        self,
+        peers: list[T],
+        ttl: int | None,
+        rank: Callable[[T], Any] | None = None,
+    ) -> tuple[list[T], list[T]]:
+        # Eager peers get the full body, lazy peers only get an IHAVE
+        if self.mode == "flood":
+            return peers, []
+
+        peers = list(peers)
+        random.shuffle(peers)
+
+        # Ranking is stable, peers that rank the same keep their random order
+        if rank:
+            peers.sort(key=rank)
+
+        # Once the hop budget is spent the body is only announced, never pushed
+        fanout = self.fanout if ttl is None or ttl > 0 else 0
+        eager, rest = peers[:fanout], peers[fanout:]
+
+        return eager, rest if self.lazy else []
+
+
+@dataclass
+class CachedFrame:
+    type: str
+    id: str
+    group: str
+    sender: tuple[str, int]
+    ttl: int | None
+    key: bytes
+    nonce: bytes
+    body: bytes
+    encoding: str | None = None
+    fallback: "CachedFrame | None" = None
+
+
+class GossipState:
+    def __init__(self, config: GossipConfig) -> None:
+        self.config = config
+        self._cache: OrderedDict[str, CachedFrame] = OrderedDict()
+        self._announce: dict[tuple[str, str], list[str]] = {}
+        self._wanted: dict[str, float] = {}
+
+    def remember(self, frame: CachedFrame):
+        self._cache[frame.id] = frame
+        self._cache.move_to_end(frame.id)
+        if len(self._cache) > self.config.cache_size:
+            self._cache.popitem(last=False)
+
+    def lookup(self, id: str) -> CachedFrame | None:
+        return self._cache.get(id)
+
+    def announce(self, peer_key: str, group: str, id: str):
+        self._announce.setdefault((peer_key, group), []).append(id)
+
+    def take_announcements(self) -> dict[tuple[str, str], list[str]]:
+        announce, self._announce = self._announce, {}
+        return announce
+
+    def want(self, ids: list[str]) -> list[str]:
+        now = time.monotonic()
+        timeout = self.config.want_timeout
+
+        # Forget stale requests so another announcer can be asked
+        self._wanted = {i: t for i, t in self._wanted.items() if now - t < timeout}
+
+        wanted = [i for i in ids if i not in self._wanted]
+        for i in wanted:
+            self._wanted[i] = now
+
+        return wanted
+
+    def received(self, id: str):
+        self._wanted.pop(id, None)
@@ -0,0 +1,131 @@
+from typing import Literal
+from dataclasses import dataclass
+from collections import deque
+import math
+import time
+
+type PeerState = Literal["alive", "suspect", "dead"]
+
+STATE_RANK: dict[PeerState, int] = {"alive": 0, "suspect": 1, "dead": 2}
+
+# Pings still waiting for a pong, older ones are forgotten
+MAX_PENDING_PINGS = 16
+
+
+@dataclass
+class HeartbeatConfig:
+    enabled: bool = True
+    interval: float = 1.0
+    # Weight of a new sample in the RTT EWMA, same as TCP's SRTT
+    alpha: float = 0.125
+    window: int = 100
+    min_std: float = 0.1
+    # Pause tolerated on top of the mean interval, absorbs GC and busy loops
+    pause: float = 2.0
+    suspect_phi: float = 3.0
+    dead_phi: float = 8.0
+    # RTTs within the same bucket are treated as equal so ties stay random
+    rtt_bucket: float = 0.005
+
+
+class PeerHealth:
+    def __init__(self, window: int) -> None:
+        self.rtt: float | None = None
+        self.last_heard = time.monotonic()
+        self._last_beat: float | None = None
+        self._intervals: deque[float] = deque(maxlen=window)
+        self._pings: dict[str, float] = {}
+
+    def phi(self, now: float, config: HeartbeatConfig) -> float:
+        # Phi accrual: how unlikely the current silence is given the
+        # heartbeat intervals observed so far
+        n = len(self._intervals)
+        mean = sum(self._intervals) / n if n else config.interval
+        var = sum((i - mean) ** 2 for i in self._intervals) / n if n else 0.0
+        std = max(math.sqrt(var), config.min_std)
+
+        elapsed = now - self.last_heard
+        # Clamped, the tails are already 0 and 37 phi and exp would overflow
+        y = min(max((elapsed - mean - config.pause) / std, -10.0), 10.0)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        p = e / (1 + e) if y > 0 else 1 - 1 / (1 + e)
+
+        return max(0.0, -math.log10(max(p, 1e-300)))
+
+
+class Liveness:
+    def __init__(self, config: HeartbeatConfig) -> None:
+        self.config = config
+        self._peers: dict[str, PeerHealth] = {}
+
+    def health(self, peer_key: str) -> PeerHealth:
+        health = self._peers.get(peer_key)
+        if not health:
+            health = self._peers[peer_key] = PeerHealth(self.config.window)
+        return health
+
+    def reset(self, peer_key: str):
+        self._peers[peer_key] = PeerHealth(self.config.window)
+
+    def heard(self, peer_key: str):
+        self.health(peer_key).last_heard = time.monotonic()
+
+    def ping(self, peer_key: str, id: str):
+        pings = self.health(peer_key)._pings
+        pings[id] = time.monotonic()
+        if len(pings) > MAX_PENDING_PINGS:
+            pings.pop(next(iter(pings)))
+
+    def pong(self, peer_key: str, id: str) -> float | None:
+        health = self.health(peer_key)
+        sent = health._pings.pop(id, None)
+        if sent is None:
+            return None
+
+        now = time.monotonic()
+        if health._last_beat is not None:
+            health._intervals.append(now - health._last_beat)
+        health._last_beat = now
+        health.last_heard = now
+
+        sample = now - sent
+        if health.rtt is None:
+            health.rtt = sample
+        else:
+            health.rtt += self.config.alpha * (sample - health.rtt)
+
+        return sample
+
+    def state(self, peer_key: str) -> PeerState:
+        # Without heartbeats silence says nothing, and peers never heard
+        # from are not judged
+        health = self._peers.get(peer_key)
+        if not self.config.enabled or not health:
+            return "alive"
+
+        phi = health.phi(time.monotonic(), self.config)
+        if phi >= self.config.dead_phi:
+            return "dead"
+        if phi >= self.config.suspect_phi:
+            return "suspect"
+        return "alive"
+
+    def rank(self, peer_key: str) -> tuple[int, int]:
+        # Live peers first, then the lowest RTT, unknown RTTs rank as slow
+        health = self._peers.get(peer_key)
+        rtt = self.config.interval if not health or health.rtt is None else health.rtt
+        return STATE_RANK[self.state(peer_key)], int(rtt / self.config.rtt_bucket)
+
+    def to_dict(self, peer_key: str) -> dict:
+        health = self._peers.get(peer_key)
+        phi = 0.0
+        if health and self.config.enabled:
+            phi = health.phi(time.monotonic(), self.config)
+        return {
+            "state": self.state(peer_key),
+            "rtt": health.rtt if health else None,
+            "phi": round(phi, 3),
+        }
+
+    def forget(self, peer_key: str):
+        self._peers.pop(peer_key, None)
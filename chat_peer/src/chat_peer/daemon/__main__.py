@@ -0,0 +1,43 @@
+import time
+
+# Taken before anything else is imported, startup is measured from here
+STARTED = time.perf_counter()
+
+from ..infra.logger import create_logger
+from .server import ChatDaemon
+import argparse
+import asyncio
+import os
+import signal
+
+
+async def run(args: argparse.Namespace):
+    daemon = ChatDaemon(args.socket, create_logger("chat-daemon"), STARTED)
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, daemon.stop)
+
+    if args.dns:
+        await daemon.call("dns", address=args.dns)
+    if args.listen:
+        await daemon.call("listen", address=args.listen, history=args.history)
+
+    await daemon.serve()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless chat peer")
+    parser.add_argument(
+        "--socket", default=os.environ.get("CHAT_DAEMON_SOCKET", "chat.sock")
+    )
+    parser.add_argument("--listen", help="host:port, or send 'listen' later")
+    parser.add_argument("--history", help="history file, history-PORT.db if omitted")
+    parser.add_argument("--dns", help="DNS server host:port")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,244 @@
+from typing import Any, Callable
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from ..chat.events import Subscriber
+from ..libs.message_store import MessageStore
+from .protocol import encode, event_from_dict, message_from_dict
+import itertools
+import json
+import socket
+import threading
+import time
+
+type Address = tuple[str, int]
+
+
+class DaemonClient:
+    def __init__(self, path: str, timeout: float = 30.0) -> None:
+        self.path = path
+        self.timeout = timeout
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._file = self._sock.makefile("rb")
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending: dict[int, Future[dict]] = {}
+        self._listeners: list[Callable[[dict], None]] = []
+        self._reader = threading.Thread(target=self._read, daemon=True)
+        self._reader.start()
+
+    def call(
+        self, cmd: str, args: dict | None = None, timeout: float | None = None
+    ) -> Any:
+        id = next(self._ids)
+        future = Future[dict]()
+        self._pending[id] = future
+
+        try:
+            with self._lock:
+                self._sock.sendall(encode({"id": id, "cmd": cmd, "args": args or {}}))
+            reply = future.result(timeout or self.timeout)
+        finally:
+            self._pending.pop(id, None)
+
+        if not reply["ok"]:
+            raise Exception(reply["error"])
+        return reply.get("result")
+
+    def subscribe(self, callback: Callable[[dict], None]):
+        # Called on the reader thread with every event batch, callbacks must
+        # not call back into the daemon from there
+        self._listeners.append(callback)
+        if len(self._listeners) == 1:
+            self.call("subscribe")
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._reader.join(timeout=5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _read(self):
+        try:
+            for line in self._file:
+                data = json.loads(line)
+                if "events" in data:
+                    for listener in list(self._listeners):
+                        listener(data)
+                    continue
+
+                future = self._pending.get(data.get("id"))
+                if future and not future.done():
+                    future.set_result(data)
+        except (OSError, ValueError):
+            pass
+        finally:
+            for future in list(self._pending.values()):
+                if not future.done():
+                    future.set_exception(Exception("Daemon connection closed"))
+
+
+@dataclass
+class RemoteGroup:
+    name: str
+    token: str
+    peers: list[str] = field(default_factory=list)
+    messages: MessageStore = field(default_factory=MessageStore)
+
+
+# Mirrors the daemon's groups and messages so the TUI renders them the way
+# it renders a ChatModel in the same process
+class RemoteChat:
+    def __init__(self, client: DaemonClient) -> None:
+        self.client = client
+        self.groups: dict[str, RemoteGroup] = {}
+        self._subscribers: list[Subscriber] = []
+
+        # Subscribed first, events racing the snapshot are deduplicated by id
+        client.subscribe(self._on_events)
+        self.sync()
+
+    @property
+    def address(self) -> Address | None:
+        address = self.client.call("ping")["address"]
+        return tuple(address) if address else None
+
+    def sync(self):
+        groups = self.client.call("groups") if self.address else []
+        self._update_groups(groups)
+
+        # Only the latest page is copied, older ones load as the view scrolls
+        for data in groups:
+            group = self.groups[data["name"]]
+            messages = self.client.call("messages", {"group": group.name})
+            for message in messages:
+                group.messages.add(message_from_dict(message))
+            group.messages.complete = (
+                data["complete"] and len(messages) >= data["messages"]
+            )
+
+    def listen(self, address: str, history: str | None = None) -> Address:
+        result = self.client.call("listen", {"address": address, "history": history})
+        self.sync()
+        return tuple(result["address"])
+
+    def create_group(self, name: str) -> RemoteGroup:
+        result = self.client.call("create-group", {"name": name})
+        return self._ensure(result["name"], result["token"])
+
+    def join_group(self, name: str, token: str) -> RemoteGroup:
+        result = self.client.call("join-group", {"name": name, "token": token})
+        return self._ensure(result["name"], result["token"])
+
+    def advertise_many(
+        self,
+        group_name: str,
+        destinations: list[Address | str],
+        resolve: Callable[[str], Address] | None = None,
+    ) -> dict[str, Exception | None]:
+        # Names are resolved here when a resolver is given, otherwise by the
+        # daemon's own DNS client
+        results: dict[str, Exception | None] = {}
+        addresses: list[str] = []
+        for dest in destinations:
+            try:
+                if isinstance(dest, str) and resolve:
+                    dest = resolve(dest)
+                addresses.append(
+                    dest if isinstance(dest, str) else f"{dest[0]}:{dest[1]}"
+                )
+            except Exception as e:
+                results[str(dest)] = e
+
+        remote = self.client.call(
+            "advertise", {"group": group_name, "destinations": addresses}
+        )
+        for dest, error in remote.items():
+            results[dest] = None if error is None else Exception(error)
+        return results
+
+    def link(self, group_name: str, dest: Address):
+        self.client.call(
+            "link", {"group": group_name, "address": f"{dest[0]}:{dest[1]}"}
+        )
+
+    def send(self, group_name: str, content: str):
+        self.client.call("send", {"group": group_name, "content": content})
+
+    def send_file(self, group_name: str, path: str, timeout: float = 3600.0):
+        self.client.call("send-file", {"group": group_name, "path": path}, timeout)
+
+    def load_older(self, group_name: str, limit: int = 100) -> int:
+        group = self.groups.get(group_name)
+        if not group:
+            raise Exception(f"Unknown group '{group_name}'")
+
+        store = group.messages
+        before = store[0].sent_at if len(store) else time.time()
+        page = self.client.call(
+            "load-older", {"group": group_name, "before": before, "limit": limit}
+        )
+
+        loaded = store.prepend([message_from_dict(m) for m in page["messages"]])
+        store.complete = page["complete"]
+        return loaded
+
+    def subscribe(self, callback: Subscriber) -> Callable[[], None]:
+        self._subscribers.append(callback)
+
+        def unsubscribe():
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+        return unsubscribe
+
+    def stats(self) -> dict:
+        return self.client.call("stats")
+
+    def dump_stats(self, path: str):
+        self.client.call("stats", {"path": path})
+
+    def peer_health(self) -> dict[str, dict]:
+        return self.client.call("peer-health")
+
+    def close(self):
+        self.client.close()
+
+    def _ensure(self, name: str, token: str) -> RemoteGroup:
+        group = self.groups.get(name)
+        if not group or group.token != token:
+            group = self.groups[name] = RemoteGroup(name, token)
+        return group
+
+    def _update_groups(self, groups: list[dict]):
+        for data in groups:
+            self._ensure(data["name"], data["token"]).peers = data["peers"]
+
+        names = {data["name"] for data in groups}
+        for name in list(self.groups):
+            if name not in names:
+                del self.groups[name]
+
+    def _on_events(self, data: dict):
+        # Runs on the client's reader thread, like ChatModel subscribers run
+        # on its event loop
+        if "groups" in data:
+            self._update_groups(data["groups"])
+
+        events = [event_from_dict(e) for e in data["events"]]
+        for event in events:
+            if event.type == "message" and event.message and event.group:
+                group = self.groups.get(event.group)
+                if group:
+                    group.messages.add(event.message)
+
+        for subscriber in list(self._subscribers):
+            subscriber(events)
@@ -0,0 +1,46 @@
+from dataclasses import asdict
+from ..chat.events import ChatEvent
+from ..libs.message import Message
+import json
+
+# One JSON object per line in both directions. Requests are
+# {"id", "cmd", "args"}, replies {"id", "ok", "result" | "error"} and event
+# batches {"events": [...], "groups": [...]}, groups only when they changed
+MAX_LINE = 16 * 1024 * 1024
+
+
+def encode(data: dict) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode() + b"\n"
+
+
+def message_to_dict(message: Message) -> dict:
+    return asdict(message)
+
+
+def message_from_dict(data: dict) -> Message:
+    return Message(
+        tuple(data["sender"]),
+        data["content"],
+        data["sent_at"],
+        data["received_at"],
+        data.get("id", ""),
+    )
+
+
+def event_to_dict(event: ChatEvent) -> dict:
+    return {
+        "type": event.type,
+        "group": event.group,
+        "peer": event.peer,
+        "message": message_to_dict(event.message) if event.message else None,
+    }
+
+
+def event_from_dict(data: dict) -> ChatEvent:
+    message = data.get("message")
+    return ChatEvent(
+        data["type"],
+        group=data.get("group"),
+        peer=data.get("peer"),
+        message=message_from_dict(message) if message else None,
+    )
@@ -0,0 +1,399 @@
+from typing import Any, Callable, Awaitable, TYPE_CHECKING
+from ..chat.events import ChatEvent
+from ..infra.logger import Logger, create_logger, set_level
+from .protocol import MAX_LINE, encode, event_to_dict, message_to_dict
+import asyncio
+import json
+import os
+import socket
+import time
+
+# ChatModel pulls in cryptography and DNSClient the DNS schemas, both are
+# imported on first use so the daemon is up before either is needed
+if TYPE_CHECKING:
+    from ..chat.chat_model import ChatModel
+    from dns_client import DNSClient
+
+type Address = tuple[str, int]
+
+# Bytes queued for a subscriber that stopped reading before it is dropped
+MAX_BACKLOG = 4 * 1024 * 1024
+
+
+def parse_address(value: str) -> Address:
+    host, port = value.rsplit(":", 1)
+    return (host, int(port))
+
+
+class ChatDaemon:
+    def __init__(self, path: str, logger: Logger, started: float | None = None) -> None:
+        self.path = path
+        self.started = time.perf_counter() if started is None else started
+        self.chat_model: "ChatModel | None" = None
+        self.dns: Address | None = None
+        # Seconds per phase, "ready" from process start to accepting clients
+        self.startup: dict[str, float] = {}
+        self._logger = logger
+        self._cache = None
+        self._profiler = None
+        self._subscribers: set[asyncio.StreamWriter] = set()
+        self._requests: set[asyncio.Task] = set()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._stopped: asyncio.Event | None = None
+        self._starting = asyncio.Lock()
+        self._commands: dict[str, Callable[..., Awaitable[Any]]] = {
+            "ping": self._ping,
+            "dns": self._dns,
+            "query": self._query,
+            "register": self._register,
+            "deregister": self._deregister,
+            "listen": self._listen,
+            "create-group": self._create_group,
+            "join-group": self._join_group,
+            "advertise": self._advertise,
+            "link": self._link,
+            "send": self._send,
+            "send-file": self._send_file,
+            "groups": self._groups,
+            "messages": self._messages,
+            "load-older": self._load_older,
+            "stats": self._stats,
+            "peer-health": self._peer_health,
+            "log-level": self._log_level,
+            "profile": self._profile,
+            "shutdown": self._shutdown,
+        }
+
+    async def serve(self):
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+
+        # A socket file nobody answers on is left over from a crashed daemon
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                raise Exception(f"Daemon already running at {self.path}")
+            except ConnectionRefusedError:
+                os.unlink(self.path)
+            finally:
+                probe.close()
+
+        server = await asyncio.start_unix_server(
+            self._accept, self.path, limit=MAX_LINE
+        )
+        self.startup["ready"] = time.perf_counter() - self.started
+        self._logger.info("daemon ready in %.1fms", self.startup["ready"] * 1000)
+        print(
+            f"daemon ready {self.path} in {self.startup['ready'] * 1000:.1f}ms",
+            flush=True,
+        )
+
+        try:
+            await self._stopped.wait()
+        finally:
+            server.close()
+            server.close_clients()
+            await server.wait_closed()
+            if self.chat_model:
+                await asyncio.to_thread(self.chat_model.close)
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def call(self, cmd: str, **args) -> Any:
+        handler = self._commands.get(cmd)
+        if not handler:
+            raise Exception(f"Unknown command '{cmd}'")
+        return await handler(**args)
+
+    def stop(self):
+        if self._loop and self._stopped:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    # ===================================
+    # CONNECTIONS
+    # ===================================
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                # Requests run concurrently, replies carry the id to match on
+                task = asyncio.create_task(self._reply(line, writer))
+                self._requests.add(task)
+                task.add_done_callback(self._requests.discard)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            self._subscribers.discard(writer)
+            writer.close()
+
+    async def _reply(self, line: bytes, writer: asyncio.StreamWriter):
+        reply = await self._handle(line, writer)
+        if writer.is_closing():
+            return
+
+        writer.write(encode(reply))
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _handle(self, line: bytes, writer: asyncio.StreamWriter) -> dict:
+        try:
+            request = json.loads(line)
+            id, cmd = request.get("id"), request["cmd"]
+            args = request.get("args") or {}
+        except (ValueError, KeyError, AttributeError):
+            return {"id": None, "ok": False, "error": "Malformed request"}
+
+        if cmd == "subscribe":
+            self._subscribers.add(writer)
+            return {"id": id, "ok": True, "result": None}
+
+        try:
+            result = await self.call(cmd, **args)
+        except Exception as e:
+            self._logger.debug("command '%s' failed: %r", cmd, e)
+            return {"id": id, "ok": False, "error": repr(e)}
+
+        return {"id": id, "ok": True, "result": result}
+
+    def _on_events(self, events: list[ChatEvent]):
+        # Runs on the chat event loop, serialized here while the model is
+        # not changing under it
+        payload: dict = {"events": [event_to_dict(e) for e in events]}
+        if any(e.type != "message" for e in events):
+            payload["groups"] = self._group_list()
+
+        assert self._loop
+        self._loop.call_soon_threadsafe(self._broadcast, encode(payload))
+
+    def _broadcast(self, line: bytes):
+        for writer in list(self._subscribers):
+            if writer.is_closing():
+                self._subscribers.discard(writer)
+                continue
+
+            # A stalled client must not grow the daemon's memory without bound
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                self._logger.warning("dropping subscriber, backlog too large")
+                self._subscribers.discard(writer)
+                writer.close()
+                continue
+
+            writer.write(line)
+
+    # ===================================
+    # COMMANDS
+    # ===================================
+
+    async def _ping(self) -> dict:
+        return {
+            "uptime": time.perf_counter() - self.started,
+            "startup": self.startup,
+            "address": self.chat_model.address if self.chat_model else None,
+            "dns": self.dns,
+        }
+
+    async def _dns(self, address: str) -> dict:
+        self.dns = parse_address(address)
+        return {"address": self.dns}
+
+    async def _query(self, name: str) -> dict:
+        dns = self._dns_client()
+        record = await asyncio.to_thread(dns.query, name)
+        return record.to_dict()
+
+    async def _register(self, name: str, port: int, ttl: int = 86400) -> dict:
+        dns = self._dns_client()
+        record = await asyncio.to_thread(dns.register, name, int(port), int(ttl))
+        return record.to_dict()
+
+    async def _deregister(self, name: str) -> None:
+        dns = self._dns_client()
+        await asyncio.to_thread(dns.deregister, name)
+
+    async def _listen(self, address: str, history: str | None = None) -> dict:
+        async with self._starting:
+            if self.chat_model:
+                raise Exception("Chat peer already listening")
+
+            host, port = parse_address(address)
+            return await asyncio.to_thread(self._start_model, host, port, history)
+
+    async def _create_group(self, name: str) -> dict:
+        group = self._model().create_group(name)
+        return {"name": group.name, "token": group.token}
+
+    async def _join_group(self, name: str, token: str) -> dict:
+        group = self._model().join_group(name, token)
+        return {"name": group.name, "token": group.token}
+
+    async def _advertise(
+        self, group: str, destinations: list[str]
+    ) -> dict[str, str | None]:
+        chat_model = self._model()
+        dns = self.dns
+
+        parsed: list[Address | str] = [
+            parse_address(d) if ":" in d else d for d in destinations
+        ]
+
+        # Every lookup gets its own client, one UDP socket can not serve
+        # concurrent queries
+        def resolve(name: str) -> Address:
+            if not dns:
+                raise Exception("DNS client not created yet")
+
+            record = self._dns_client().query(name)
+            return (record.ip, int(record.port))
+
+        results = await asyncio.to_thread(
+            chat_model.advertise_many, group, parsed, resolve
+        )
+        return {dest: None if e is None else repr(e) for dest, e in results.items()}
+
+    async def _link(self, group: str, address: str) -> None:
+        await asyncio.to_thread(self._model().link, group, parse_address(address))
+
+    async def _send(self, group: str, content: str) -> None:
+        await asyncio.to_thread(self._model().send, group, content)
+
+    async def _send_file(self, group: str, path: str) -> None:
+        await asyncio.to_thread(self._model().send_file, group, path)
+
+    async def _groups(self) -> list[dict]:
+        return self._group_list()
+
+    async def _messages(
+        self, group: str, limit: int = 100, before: float | None = None
+    ) -> list[dict]:
+        store = self._group(group).messages
+        messages = (
+            store.latest(limit) if before is None else store.before(before, limit)
+        )
+        return [message_to_dict(m) for m in messages]
+
+    async def _load_older(self, group: str, before: float, limit: int = 100) -> dict:
+        # Served from memory first, the history is read only past its start
+        store = self._group(group).messages
+        page = store.before(before, limit)
+        if len(page) < limit and not store.complete:
+            await asyncio.to_thread(self._model().load_older, group, limit)
+            page = store.before(before, limit)
+
+        oldest = page[0].sent_at if page else before
+        return {
+            "messages": [message_to_dict(m) for m in page],
+            "complete": store.complete and not store.before(oldest, 1),
+        }
+
+    async def _stats(self, path: str | None = None) -> dict | None:
+        chat_model = self._model()
+        if path:
+            await asyncio.to_thread(chat_model.dump_stats, path)
+            return None
+        return chat_model.stats()
+
+    async def _peer_health(self) -> dict:
+        return self._model().peer_health()
+
+    async def _log_level(self, level: str) -> None:
+        set_level(level)
+
+    async def _profile(self, path: str | None = None) -> str | None:
+        if not self._profiler:
+            raise Exception("Profiling disabled, set PROFILE=1")
+
+        if path:
+            self._profiler.dump(path)
+            return None
+        return self._profiler.report()
+
+    async def _shutdown(self) -> None:
+        assert self._stopped
+        self._stopped.set()
+
+    # ===================================
+    # HELPERS
+    # ===================================
+
+    def _start_model(self, host: str, port: int, history: str | None) -> dict:
+        started = time.perf_counter()
+
+        from ..chat.chat_model import ChatModel
+        from ..history.sqlite_history import SqliteHistory
+        from ..libs.crypto import generate_rsa_keypair
+        from common.utils.profiling import Profiler
+
+        imported = time.perf_counter()
+        private_key, public_key = generate_rsa_keypair()
+        keyed = time.perf_counter()
+
+        logger = create_logger("chat-model")
+        path = history or f"history-{port}.db"
+        self._profiler = Profiler.from_env(logger.warning)
+        chat_model = ChatModel(
+            logger,
+            host,
+            port,
+            private_key,
+            public_key,
+            history=SqliteHistory(path, create_logger("history")),
+            profiler=self._profiler,
+        )
+        chat_model.subscribe(self._on_events)
+        address = chat_model.listen()
+        self.chat_model = chat_model
+
+        done = time.perf_counter()
+        self.startup.update(
+            {
+                "import": imported - started,
+                "keygen": keyed - imported,
+                "listen": done - keyed,
+            }
+        )
+        self._logger.info(
+            "chat peer listening at %s:%d in %.1fms",
+            *address,
+            (done - started) * 1000,
+        )
+
+        return {"address": address, "startup": self.startup}
+
+    def _model(self) -> "ChatModel":
+        if not self.chat_model:
+            raise Exception("Chat peer not created yet")
+        return self.chat_model
+
+    def _group(self, name: str):
+        group = self._model().groups.get(name)
+        if not group:
+            raise Exception(f"Unknown group '{name}'")
+        return group
+
+    def _group_list(self) -> list[dict]:
+        return [
+            {
+                "name": group.name,
+                "token": group.token,
+                "peers": list(group.peers),
+                "messages": len(group.messages),
+                "complete": group.messages.complete,
+            }
+            for group in self._model().groups.values()
+        ]
+
+    def _dns_client(self) -> "DNSClient":
+        from dns_client import DNSClient
+
+        if not self.dns:
+            raise Exception("DNS client not created yet")
+
+        if self._cache is None:
+            from ..cache.memory_record_cache import MemoryRecordCache
+
+            self._cache = MemoryRecordCache(create_logger("cache-model"))
+
+        return DNSClient(*self.dns, self._cache)
@@ -0,0 +1,197 @@
+from ..libs.message import Message
+from ..infra.logger import Logger
+import threading
+import sqlite3
+import queue
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    name TEXT PRIMARY KEY,
+    token TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    group_name TEXT NOT NULL,
+    sent_at REAL NOT NULL,
+    id TEXT NOT NULL,
+    sender_host TEXT NOT NULL,
+    sender_port INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    received_at REAL NOT NULL,
+    PRIMARY KEY (group_name, sent_at, id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS members (
+    group_name TEXT NOT NULL,
+    host TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    PRIMARY KEY (group_name, host, port)
+) WITHOUT ROWID;
+"""
+
+# Number of messages loaded per page
+PAGE_SIZE = 100
+
+type Row = tuple[str, float, str, str, int, str, float]
+
+
+class SqliteHistory:
+    def __init__(
+        self,
+        path: str,
+        logger: Logger,
+        batch_size: int = 256,
+        flush_interval: float = 0.05,
+    ) -> None:
+        self._path = path
+        self._logger = logger
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._pending = queue.Queue[Row | None]()
+        self._flushed = threading.Condition()
+        self._written = 0
+        self._queued = 0
+
+        self._read_lock = threading.Lock()
+        self._reader = self._connect()
+        self._reader.executescript(SCHEMA)
+
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def save_group(self, name: str, token: str):
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT token FROM groups WHERE name = ?", (name,)
+            ).fetchone()
+
+        # A new token is a different group, the old one's history must not be
+        # paged or synced into it. Rows still queued for it are written first
+        replaced = row is not None and row[0] != token
+        if replaced:
+            self.flush()
+
+        with self._read_lock:
+            if replaced:
+                self._reader.execute(
+                    "DELETE FROM messages WHERE group_name = ?", (name,)
+                )
+            self._reader.execute("DELETE FROM members WHERE group_name = ?", (name,))
+            self._reader.execute(
+                "INSERT OR REPLACE INTO groups (name, token) VALUES (?, ?)",
+                (name, token),
+            )
+            self._reader.commit()
+
+    def save_members(self, group: str, addresses: list[tuple[str, int]]):
+        with self._read_lock:
+            self._reader.executemany(
+                "INSERT OR IGNORE INTO members VALUES (?, ?, ?)",
+                [(group, host, port) for host, port in addresses],
+            )
+            self._reader.commit()
+
+    def members(self, group: str) -> list[tuple[str, int]]:
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT host, port FROM members WHERE group_name = ?", (group,)
+            ).fetchall()
+        return [(host, port) for host, port in rows]
+
+    def groups(self) -> list[tuple[str, str]]:
+        with self._read_lock:
+            return self._reader.execute("SELECT name, token FROM groups").fetchall()
+
+    def append(self, group: str, message: Message):
+        self._queued += 1
+        self._pending.put(
+            (
+                group,
+                message.sent_at,
+                message.id,
+                message.sender[0],
+                message.sender[1],
+                message.content,
+                message.received_at,
+            )
+        )
+
+    def page(
+        self,
+        group: str,
+        before: tuple[float, str] | None = None,
+        limit: int = PAGE_SIZE,
+    ) -> list[Message]:
+        # Walks the primary key backwards, cost depends on the page size only
+        sql = (
+            "SELECT sent_at, id, sender_host, sender_port, content, received_at "
+            "FROM messages WHERE group_name = ? "
+        )
+        args: tuple = (group,)
+        if before:
+            sql += "AND (sent_at, id) < (?, ?) "
+            args += before
+        sql += "ORDER BY sent_at DESC, id DESC LIMIT ?"
+        args += (limit,)
+
+        with self._read_lock:
+            rows = self._reader.execute(sql, args).fetchall()
+
+        return [
+            Message((host, port), content, sent_at, received_at, id)
+            for sent_at, id, host, port, content, received_at in reversed(rows)
+        ]
+
+    def flush(self, timeout: float | None = None):
+        target = self._queued
+        with self._flushed:
+            self._flushed.wait_for(lambda: self._written >= target, timeout)
+
+    def close(self):
+        self._pending.put(None)
+        self._writer.join()
+
+        with self._read_lock:
+            self._reader.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self._path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _write_loop(self):
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        stop = False
+
+        while not stop:
+            # Block for the first row, then gather whatever arrives in the window
+            rows = []
+            item = self._pending.get()
+            try:
+                while item is not None:
+                    rows.append(item)
+                    if len(rows) >= self._batch_size:
+                        break
+                    item = self._pending.get(timeout=self._flush_interval)
+            except queue.Empty:
+                pass
+
+            stop = item is None
+
+            if rows:
+                try:
+                    with conn:
+                        conn.executemany(
+                            "INSERT OR IGNORE INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            rows,
+                        )
+                except sqlite3.Error as e:
+                    self._logger.error("history write failed: %r", e)
+
+            with self._flushed:
+                self._written += len(rows)
+                self._flushed.notify_all()
+
+        conn.close()
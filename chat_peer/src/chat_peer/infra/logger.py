@@ -1,18 +1,134 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
 
 type Logger = logging.Logger
 
-file = logging.FileHandler("app.log", mode="a")
-file.setLevel(logging.DEBUG)
+LOG_FILE = os.environ.get("CHAT_LOG_FILE", "app.log")
+LOG_LEVEL = os.environ.get("CHAT_LOG_LEVEL", "DEBUG")
+
+# Rotation, the active file plus this many backups of at most MAX_BYTES
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 3
+
+# Debug records per message template and second, bursts up to DEBUG_BURST
+DEBUG_RATE = 50.0
+DEBUG_BURST = 200
+
+# Templates tracked by the rate limiter before its state is reset
+MAX_TEMPLATES = 1024
+
+# Records skip the process and thread lookups the format never prints
+logging.logThreads = False
+logging.logProcesses = False
+logging.logMultiprocessing = False
 
 fmt = logging.Formatter(
     "%(asctime)s [%(levelname)s] %(name)s: %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
 )
-file.setFormatter(fmt)
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: float = DEBUG_RATE, burst: int = DEBUG_BURST) -> None:
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # Token bucket and suppressed count per (logger, template)
+        self._buckets: dict[tuple[str, str], list[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Per message events are sampled, anything above debug always passes
+        if record.levelno > logging.DEBUG or self.rate <= 0:
+            return True
+
+        now = time.monotonic()
+        key = (record.name, str(record.msg))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= MAX_TEMPLATES:
+                self._buckets.clear()
+            bucket = self._buckets[key] = [float(self.burst), now, 0]
+
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            bucket[2] += 1
+            return False
+
+        bucket[0] = tokens - 1
+        if bucket[2] and isinstance(record.args, tuple):
+            # Without args the message was never %-formatted, a literal % in
+            # it has to be escaped before the count is added
+            msg = str(record.msg) if record.args else str(record.msg).replace("%", "%%")
+            record.msg = f"{msg} (%d similar suppressed)"
+            record.args = (*record.args, int(bucket[2]))
+            bucket[2] = 0
+
+        return True
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the writer thread, only tracebacks are
+        # rendered here while they are still alive
+        if record.exc_info:
+            record.exc_text = fmt.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+_lock = threading.Lock()
+_loggers: dict[str, logging.Logger] = {}
+_handler: QueueHandler | None = None
+_listener: QueueListener | None = None
+_level = logging.getLevelName(LOG_LEVEL.upper())
+
+
+def _queue_handler() -> QueueHandler:
+    global _handler, _listener
+
+    # The file is opened on first use instead of on import
+    if _handler is None:
+        file = RotatingFileHandler(
+            LOG_FILE, mode="a", maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT
+        )
+        file.setFormatter(fmt)
+
+        records: queue.SimpleQueue = queue.SimpleQueue()
+        _listener = QueueListener(records, file)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+        _handler = _QueueHandler(records)
+        _handler.addFilter(RateLimitFilter())
+
+    return _handler
 
 
 def create_logger(name: str):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    logger.addHandler(file)
+    with _lock:
+        logger = logging.getLogger(name)
+        if name not in _loggers:
+            logger.setLevel(_level)
+            logger.addHandler(_queue_handler())
+            _loggers[name] = logger
     return logger
+
+
+def set_level(level: int | str):
+    global _level
+
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level '{level}'")
+
+    with _lock:
+        _level = level
+        for logger in _loggers.values():
+            logger.setLevel(level)
@@ -0,0 +1,56 @@
+from typing import Callable
+import zlib
+
+# Bodies smaller than this are sent as is, the gain does not pay for the CPU
+THRESHOLD = 128
+
+# Upper bound for a decompressed body, guards against decompression bombs
+MAX_DECOMPRESSED_SIZE = 4 * 1024 * 1024
+
+# Preset dictionary built from typical conversation and batch bodies, zlib
+# matches best against the end of the dictionary so the most common
+# fragments come last
+ZDICT = (
+    b'{"group": "", "group_token": "", "messages": [{"id": "", "sender": '
+    b'["127.0.0.1", 0], "content": "", "timestamp": 1700000000.0}, '
+    b'{"sender": ["192.168.0.1", 8080], "content": "the and you to is it '
+    b'that this for with have what not are was just ok yes no ", '
+    b'"timestamp": 1760000000.000000, "group": "general", "group_token": "'
+    b'0123456789abcdef0123456789abcdef"}, {"id": "'
+)
+
+
+def _zlib_compress(data: bytes) -> bytes:
+    c = zlib.compressobj(6, zdict=ZDICT)
+    return c.compress(data) + c.flush()
+
+
+def _zlib_decompress(data: bytes) -> bytes:
+    d = zlib.decompressobj(zdict=ZDICT)
+    out = d.decompress(data, MAX_DECOMPRESSED_SIZE)
+    if d.unconsumed_tail:
+        raise ValueError("Decompressed body too large")
+    return out + d.flush()
+
+
+CODECS: dict[str, tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]] = {
+    "zlib": (_zlib_compress, _zlib_decompress),
+}
+
+
+def compress(data: bytes, codec: str) -> tuple[bytes, str | None]:
+    if len(data) < THRESHOLD or codec not in CODECS:
+        return data, None
+
+    compressed = CODECS[codec][0](data)
+    if len(compressed) >= len(data):
+        return data, None
+
+    return compressed, codec
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec not in CODECS:
+        raise ValueError(f"Unsupported encoding '{codec}'")
+
+    return CODECS[codec][1](data)
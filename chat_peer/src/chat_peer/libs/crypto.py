@@ -65,23 +65,27 @@ def rsa_decrypt(private_key: rsa.RSAPrivateKey, ciphertext: bytes) -> bytes:
     return message
 
 
-def aes_encrypt(key: bytes, plaintext: bytes) -> tuple[bytes, bytes]:
+def aes_encrypt(
+    key: bytes, plaintext: bytes, aad: bytes | None = None
+) -> tuple[bytes, bytes]:
     aes = AESGCM(key)
 
     # GCM recommended nonce size is 12 bytes
     nonce = os.urandom(12)
 
     # ciphertext includes authentication tag
-    ciphertext = aes.encrypt(nonce, plaintext, None)
+    ciphertext = aes.encrypt(nonce, plaintext, aad)
 
     return nonce, ciphertext
 
 
-def aes_decrypt(key: bytes, nonce: bytes, ciphertext: bytes) -> bytes:
+def aes_decrypt(
+    key: bytes, nonce: bytes, ciphertext: bytes, aad: bytes | None = None
+) -> bytes:
     aes = AESGCM(key)
 
     try:
-        plaintext = aes.decrypt(nonce, ciphertext, None)
+        plaintext = aes.decrypt(nonce, ciphertext, aad)
         return plaintext
     except InvalidTag:
         raise ValueError(
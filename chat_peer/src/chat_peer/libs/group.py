@@ -1,11 +1,30 @@
 from dataclasses import dataclass, field
 from .peer import Peer
-from .message import Message
+from .message_store import MessageStore
 
 
 @dataclass
 class Group:
     name: str
     token: str
-    peers: list[Peer] = field(default_factory=list)
-    messages: list[Message] = field(default_factory=list)
+    # Keyed by peer address, each member is stored and sent to exactly once
+    peers: dict[str, Peer] = field(default_factory=dict)
+    messages: MessageStore = field(default_factory=MessageStore)
+
+    def add_peer(self, peer: Peer) -> bool:
+        if peer.key in self.peers:
+            return False
+
+        self.peers[peer.key] = peer
+        peer.groups.add(self.name)
+        return True
+
+    def remove_peer(self, peer: Peer) -> bool:
+        if not self.peers.pop(peer.key, None):
+            return False
+
+        peer.groups.discard(self.name)
+        return True
+
+    def has_peer(self, peer: Peer) -> bool:
+        return peer.key in self.peers
@@ -1,9 +1,10 @@
 from dataclasses import dataclass
 
 
-@dataclass
+@dataclass(slots=True)
 class Message:
     sender: tuple[str, int]
     content: str
     sent_at: float
     received_at: float
+    id: str = ""
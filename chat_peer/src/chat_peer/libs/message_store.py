@@ -0,0 +1,107 @@
+from typing import Iterator
+from .message import Message
+import bisect
+
+# Default number of messages kept in memory per group
+MESSAGE_CAP = 5000
+
+# Messages allowed over the cap before the front is trimmed, one slice
+# deletion per batch keeps eviction amortized O(1) instead of a list shift
+# per message
+TRIM_BATCH = 64
+
+
+def _order(message: Message) -> tuple[float, str]:
+    return (message.sent_at, message.id)
+
+
+# Ordered by (sent_at, id). Appends, the common case, are amortized O(1).
+# A late message is found in O(log n) but the insert shifts the newer ones,
+# O(n) pointer moves. Kept a flat list on purpose, ChatView reads it by
+# position for every rendered line and the shift over a capped store is a
+# few microseconds
+class MessageStore:
+    def __init__(self, cap: int = MESSAGE_CAP, page_cap: int | None = None) -> None:
+        self._cap = cap
+        # Pages loaded on demand are kept on top of the live cap, up to here
+        self._page_cap = cap if page_cap is None else page_cap
+        self._paged = 0
+        self._messages: list[Message] = []
+        self._ids: dict[str, Message] = {}
+
+        # False once older messages exist outside of memory
+        self.complete = True
+
+    def add(self, message: Message) -> bool:
+        if message.id and message.id in self._ids:
+            return False
+
+        # Messages mostly arrive in order, so this is usually an append
+        if not self._messages or _order(self._messages[-1]) <= _order(message):
+            self._messages.append(message)
+        else:
+            bisect.insort(self._messages, message, key=_order)
+
+        if message.id:
+            self._ids[message.id] = message
+
+        self._trim()
+        return True
+
+    def prepend(self, messages: list[Message]) -> int:
+        # Older pages loaded on demand, counted against page_cap instead of
+        # the live cap
+        oldest = _order(self._messages[0]) if self._messages else None
+        older = [
+            m
+            for m in messages
+            if m.id not in self._ids and (oldest is None or _order(m) < oldest)
+        ]
+
+        self._messages[0:0] = older
+        for m in older:
+            self._ids[m.id] = m
+        self._paged += len(older)
+
+        return len(older)
+
+    def _trim(self):
+        # The oldest live messages join the paged ones instead of pushing
+        # them out, scrolling back survives the next incoming message
+        live = len(self._messages) - self._paged
+        if self._paged and live > self._cap:
+            self._paged += live - self._cap
+
+        limit = self._cap + (self._page_cap if self._paged else 0)
+        excess = len(self._messages) - limit
+        if excess < TRIM_BATCH:
+            return
+
+        evicted = self._messages[:excess]
+        del self._messages[:excess]
+        for m in evicted:
+            self._ids.pop(m.id, None)
+        self._paged = max(0, self._paged - excess)
+        self.complete = False
+
+    def get(self, id: str) -> Message | None:
+        return self._ids.get(id)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self._ids
+
+    def latest(self, limit: int) -> list[Message]:
+        return self._messages[-limit:] if limit else []
+
+    def before(self, sent_at: float, limit: int) -> list[Message]:
+        end = bisect.bisect_left(self._messages, (sent_at, ""), key=_order)
+        return self._messages[max(0, end - limit) : end]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __getitem__(self, i: int) -> Message:
+        return self._messages[i]
+
+    def __iter__(self) -> Iterator[Message]:
+        return iter(self._messages)
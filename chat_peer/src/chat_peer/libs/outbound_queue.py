@@ -0,0 +1,106 @@
+from typing import Literal
+from dataclasses import dataclass, asdict
+from collections import deque
+from common.utils.async_tcp_socket import AsyncTcpSocket
+import asyncio
+
+type OverflowPolicy = Literal["drop-oldest", "disconnect", "block"]
+
+
+@dataclass
+class QueueStats:
+    depth: int = 0
+    max_depth: int = 0
+    enqueued: int = 0
+    dropped: int = 0
+    writes: int = 0
+    sent_frames: int = 0
+    sent_bytes: int = 0
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class OutboundQueue:
+    def __init__(
+        self,
+        conn: AsyncTcpSocket,
+        max_frames: int = 1024,
+        policy: OverflowPolicy = "drop-oldest",
+        max_batch: int = 64,
+    ) -> None:
+        self.stats = QueueStats()
+        self._conn = conn
+        self._max_frames = max_frames
+        self._policy = policy
+        self._max_batch = max_batch
+        self._frames: deque[bytes] = deque()
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._writer())
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    async def put(self, frame: bytes):
+        while len(self._frames) >= self._max_frames and not self._closed:
+            match self._policy:
+                case "drop-oldest":
+                    self._frames.popleft()
+                    self.stats.dropped += 1
+                case "disconnect":
+                    self.close()
+                case "block":
+                    self._space.clear()
+                    await self._space.wait()
+
+        if self._closed:
+            raise ConnectionError("Outbound queue closed")
+
+        self._frames.append(frame)
+        self._ready.set()
+
+        self.stats.enqueued += 1
+        self.stats.depth = len(self._frames)
+        self.stats.max_depth = max(self.stats.max_depth, self.stats.depth)
+
+    def close(self):
+        if self._closed:
+            return
+
+        self._closed = True
+        self._frames.clear()
+        self.stats.depth = 0
+
+        # Wake blocked producers and the writer so they observe the close
+        self._space.set()
+        self._ready.set()
+        self._conn.close()
+
+    async def _writer(self):
+        try:
+            while True:
+                await self._ready.wait()
+                if self._closed:
+                    return
+
+                batch = []
+                while self._frames and len(batch) < self._max_batch:
+                    batch.append(self._frames.popleft())
+
+                if not self._frames:
+                    self._ready.clear()
+
+                self.stats.depth = len(self._frames)
+                self._space.set()
+
+                # Queued frames are flushed with a single scatter-gather write
+                await self._conn.send_many(batch)
+
+                self.stats.writes += 1
+                self.stats.sent_frames += len(batch)
+                self.stats.sent_bytes += sum(len(f) for f in batch)
+        except (ConnectionError, OSError):
+            self.close()
@@ -1,17 +1,37 @@
+from typing import Literal
 from dataclasses import dataclass, field
-from common.utils.tcp_socket import TcpSocket
+from common.utils.async_tcp_socket import AsyncTcpSocket
 from ..libs.crypto import rsa
-import time
+from .outbound_queue import OutboundQueue
+import asyncio
+
+type ConnectionState = Literal["idle", "connecting", "handshaking", "ready", "backoff"]
 
 
 @dataclass
 class Peer:
     address: tuple[str, int]
-    conn: TcpSocket | None = None
+    conn: AsyncTcpSocket | None = None
+    outbox: OutboundQueue | None = None
     public_key: rsa.RSAPublicKey | None = None
     public_key_sent: bool = False
-    groups: list[str] = field(default_factory=list)
+    groups: set[str] = field(default_factory=set)
+    codecs: list[str] = field(default_factory=list)
+    state: ConnectionState = "idle"
+    _key_ready: asyncio.Event = field(default_factory=asyncio.Event, repr=False)
+
+    @property
+    def key(self) -> str:
+        return f"{self.address[0]}:{self.address[1]}"
+
+    def set_public_key(self, public_key: rsa.RSAPublicKey):
+        self.public_key = public_key
+        self._key_ready.set()
+
+    async def wait_public_key(self):
+        await self._key_ready.wait()
 
-    def wait_public_key(self):
-        while not self.public_key:
-            pass
+    def reset_handshake(self):
+        # The key is kept, a new connection still has to prove the peer is there
+        self.public_key_sent = False
+        self._key_ready.clear()
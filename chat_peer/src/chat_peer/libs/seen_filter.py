@@ -0,0 +1,103 @@
+from collections import OrderedDict
+import hashlib
+import math
+import time
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, fp_rate: float) -> None:
+        self.count = 0
+        self._size = max(8, int(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._size / capacity * math.log(2)))
+        self._bits = bytearray((self._size + 7) // 8)
+
+    def add(self, item: bytes):
+        for i in self._indexes(item):
+            self._bits[i >> 3] |= 1 << (i & 7)
+        self.count += 1
+
+    def __contains__(self, item: bytes) -> bool:
+        return all(self._bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(item))
+
+    def nbytes(self) -> int:
+        return len(self._bits)
+
+    def _indexes(self, item: bytes):
+        # Double hashing, k indexes from two 64-bit halves of one digest
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8])
+        h2 = int.from_bytes(digest[8:]) | 1
+        return ((h1 + i * h2) % self._size for i in range(self._hashes))
+
+
+class SeenFilter:
+    def __init__(
+        self,
+        window: float = 600.0,
+        capacity: int = 100_000,
+        fp_rate: float = 1e-4,
+        exact: int = 4096,
+    ) -> None:
+        self._window = window
+        self._capacity = capacity
+        self._exact_size = exact
+
+        # Two generations are checked per lookup, each gets half the budget
+        self._fp_rate = fp_rate / 2
+
+        self._exact: OrderedDict[bytes, None] = OrderedDict()
+        self._current = BloomFilter(capacity, self._fp_rate)
+        self._previous: BloomFilter | None = None
+        self._rotated_at = time.monotonic()
+
+    def add(self, id: str):
+        self._maybe_rotate()
+
+        key = self._key(id)
+        self._exact[key] = None
+        if len(self._exact) > self._exact_size:
+            self._exact.popitem(last=False)
+
+        self._current.add(key)
+
+    def __contains__(self, id: str) -> bool:
+        key = self._key(id)
+        if key in self._exact:
+            return True
+
+        self._maybe_rotate()
+        if key in self._current:
+            return True
+
+        return self._previous is not None and key in self._previous
+
+    def check_and_add(self, id: str) -> bool:
+        if id in self:
+            return True
+
+        self.add(id)
+        return False
+
+    def nbytes(self) -> int:
+        previous = self._previous.nbytes() if self._previous else 0
+        return self._current.nbytes() + previous + len(self._exact) * 16
+
+    def _maybe_rotate(self):
+        # Each id lives between window / 2 and window before it is forgotten
+        now = time.monotonic()
+        if (
+            self._current.count < self._capacity
+            and now - self._rotated_at < self._window / 2
+        ):
+            return
+
+        self._previous = self._current
+        self._current = BloomFilter(self._capacity, self._fp_rate)
+        self._rotated_at = now
+
+    @staticmethod
+    def _key(id: str) -> bytes:
+        try:
+            return bytes.fromhex(id)
+        except ValueError:
+            return id.encode()
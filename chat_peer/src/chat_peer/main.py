@@ -1,4 +1,5 @@
-from typing import cast
+from typing import cast, TYPE_CHECKING
+import os
 import time
 import threading
 
@@ -6,6 +7,7 @@ from textual import on
 from textual.binding import Binding
 from textual.app import App, ComposeResult
 from textual.containers import Container
+from textual.message import Message
 from textual.widgets import (
     Button,
     Input,
@@ -18,36 +20,57 @@ from textual.widgets import (
 
 from .cache.memory_record_cache import MemoryRecordCache
 from dns_client import DNSClient
-from .chat.chat_model import ChatModel
-from .infra.logger import create_logger
-from .libs.crypto import generate_rsa_keypair
+from .chat.events import ChatEvent
+from .daemon.client import DaemonClient, RemoteChat
+from .ui.chat_view import ChatView
+from .infra.logger import create_logger, set_level
+from common.utils.profiling import Profiler
+
+# ChatModel brings in cryptography, it is only imported once the TUI runs
+# its own peer instead of attaching to a daemon
+if TYPE_CHECKING:
+    from .chat.chat_model import ChatModel
 
 help = """
 available commands:
+daemon        Attach to a chat daemon's socket instead of running a peer here
 dns           Connect to DNS server
 query         Query name from DNS server
 register      Register name to DNS server
 deregister    Deregister name from DNS server
-listen        Bind and listen network socket
+listen        Bind and listen network socket, optionally with a history file
 create-group  Create new chat group
-advertise     Advertise chat group to other peer
+advertise     Advertise chat group to one or more peers
+send-file     Stream a file to the connected members of a group
 sync          Sync UI with peer state
+log-level     Change the log level at runtime
+stats         Show traffic, crypto and queue metrics, optionally save them as JSON
+profile       Show or save the handler profile, needs PROFILE=1 before listen
 """
 
 
+class ChatUpdate(Message):
+    def __init__(self, events: list[ChatEvent]) -> None:
+        super().__init__()
+        self.events = events
+
+
 class MainApp(App):
     CSS_PATH = "main.tcss"
     TITLE = "P2P Gossip Chat CLI"
 
-    BINDINGS = [Binding("ctrl+x", "execute", "Execute", priority=True)]
+    BINDINGS = [
+        Binding("ctrl+x", "execute", "Execute", priority=True),
+        Binding("ctrl+o", "older", "Older messages"),
+    ]
 
     def compose(self) -> ComposeResult:
         self.theme = "nord"
         self.cache = MemoryRecordCache(create_logger("cache-model"))
-        self.chat_model: ChatModel | None = None
+        self.chat_model: "ChatModel | RemoteChat | None" = None
         self.dns: DNSClient | None = None
+        self.profiler: Profiler | None = None
         self.log_display = ""
-        self.message_idx = 0
 
         with TabbedContent(initial="chat"):
             with TabPane("Chat", id="chat"):
@@ -55,7 +78,7 @@ class MainApp(App):
                     Select([]),
                     id="chat-group-select",
                 )
-                yield Log(highlight=False, id="chat-log")
+                yield ChatView(id="chat-log")
                 yield Container(
                     Input("", "Enter your message...", id="msg-input"),
                     Button("Send", id="send-msg", variant="primary"),
@@ -71,8 +94,24 @@ class MainApp(App):
                     classes="input",
                 )
 
-    def on_mount(self):
-        threading.Thread(target=self.update_chat, daemon=True).start()
+    def on_mount(self) -> None:
+        path = os.environ.get("CHAT_DAEMON_SOCKET")
+        if path:
+            cast(Log, self.query_one("#control-log")).write_line(self.attach(path))
+
+    def attach(self, path: str) -> str:
+        try:
+            self.chat_model = RemoteChat(DaemonClient(path))
+        except Exception as e:
+            return repr(e)
+
+        self.chat_model.subscribe(self.chat_events)
+        self.update_groups()
+
+        address = self.chat_model.address
+        if not address:
+            return f"Attached to daemon at {path}, not listening yet"
+        return f"Attached to daemon at {path}, listening at {address[0]}:{address[1]}"
 
     def action_execute(self) -> None:
         tab = self.query_one(TabbedContent)
@@ -83,6 +122,21 @@ class MainApp(App):
             case "control":
                 self.execute()
 
+    def action_older(self) -> None:
+        if not self.chat_model:
+            return
+
+        group = self.query_one(Select).selection
+        if not group:
+            return
+
+        self.chat_model.load_older(group)
+        self.query_one(ChatView).messages_changed()
+
+    @on(ChatView.LoadOlder)
+    def scrolled_to_top(self) -> None:
+        self.action_older()
+
     @on(Button.Pressed)
     def button_pressed(self, event: Button.Pressed) -> None:
         match event.button.id:
@@ -95,31 +149,47 @@ class MainApp(App):
 
     @on(Select.Changed)
     def select_changes(self) -> None:
-        log = cast(Log, self.query_one("#chat-log"))
-        log.clear()
-        self.message_idx = 0
+        group = self.query_one(Select).selection
+        view = self.query_one(ChatView)
 
-    def update_chat(self):
-        i = 0
-        while True:
-            time.sleep(0.1)
+        if not self.chat_model or not group:
+            view.show(None)
+            return
 
-            if not self.chat_model:
-                continue
+        view.show(self.chat_model.groups[group].messages)
 
-            group = self.query_one(Select).selection
-            if not group:
-                continue
+    def chat_events(self, events: list[ChatEvent]):
+        # Runs on the chat event loop, post_message is thread safe and does
+        # not wait for the UI
+        self.post_message(ChatUpdate(events))
 
-            messages = self.chat_model._groups[group].messages
-            log = cast(Log, self.query_one("#chat-log"))
+    @on(ChatUpdate)
+    def chat_updated(self, update: ChatUpdate) -> None:
+        group = self.query_one(Select).selection
+        types = {
+            e.type for e in update.events if e.type != "message" or e.group == group
+        }
 
-            for i in range(self.message_idx, len(messages)):
-                m = messages[i]
-                str = f"[{m.sender[0]}:{m.sender[1]}] ({time.ctime(m.sent_at)})\n{m.content}\n\n"
-                self.call_from_thread(log.write_line, str)
+        if "message" in types:
+            self.query_one(ChatView).messages_changed()
 
-            self.message_idx = len(messages)
+        if "group" in types:
+            self.update_groups()
+        elif "peer" in types:
+            self.update_tree()
+
+    def update_groups(self):
+        if not self.chat_model:
+            return
+
+        select = self.query_one(Select)
+        group = select.selection
+
+        select.set_options((v, v) for v in self.chat_model.groups)
+        if group in self.chat_model.groups:
+            select.value = group
+
+        self.update_tree()
 
     def update_tree(self):
         if not self.chat_model:
@@ -130,10 +200,10 @@ class MainApp(App):
         tree.clear()
         tree.root.expand()
 
-        for name, group in self.chat_model._groups.items():
+        for name, group in self.chat_model.groups.items():
             group_node = tree.root.add(name, expand=True)
-            for peer in group.peers:
-                group_node.add_leaf(f"{peer.address[0]}:{peer.address[1]}")
+            for key in group.peers:
+                group_node.add_leaf(key)
 
     def send(self):
         if not self.chat_model:
@@ -163,6 +233,16 @@ class MainApp(App):
         match args[0]:
             case "clear":
                 log.clear()
+            case "daemon":
+                if len(args) < 2:
+                    log.write_line("Error: expected 'daemon <socket>'")
+                    return
+
+                if self.chat_model:
+                    log.write_line("Error: Chat peer already created")
+                    return
+
+                log.write_line(self.attach(args[1]))
             case "dns":
                 if len(args) < 2:
                     log.write_line("Error: expected 'dns <address>'")
@@ -234,18 +314,45 @@ class MainApp(App):
 
             case "listen":
                 if len(args) < 2:
-                    log.write_line("Error: expected 'listen <address>'")
+                    log.write_line("Error: expected 'listen <address> [history]'")
+                    return
+
+                if isinstance(self.chat_model, RemoteChat):
+                    try:
+                        host, port = self.chat_model.listen(
+                            args[1], args[2] if len(args) > 2 else None
+                        )
+                        self.update_groups()
+                        log.write_line(f"Chat daemon listening at {host}:{port}...")
+                    except Exception as e:
+                        log.write_line(repr(e))
                     return
 
                 try:
+                    from .chat.chat_model import ChatModel
+                    from .history.sqlite_history import SqliteHistory
+                    from .libs.crypto import generate_rsa_keypair
+
                     logger = create_logger("chat-model")
                     host, port = args[1].split(":")
                     private_key, public_key = generate_rsa_keypair()
 
+                    path = args[2] if len(args) > 2 else f"history-{port}.db"
+                    history = SqliteHistory(path, create_logger("history"))
+
+                    self.profiler = Profiler.from_env(logger.warning)
                     self.chat_model = ChatModel(
-                        logger, host, int(port), private_key, public_key
+                        logger,
+                        host,
+                        int(port),
+                        private_key,
+                        public_key,
+                        history=history,
+                        profiler=self.profiler,
                     )
+                    self.chat_model.subscribe(self.chat_events)
                     self.chat_model.listen()
+                    self.update_groups()
 
                     log.write_line(f"Chat peer listening at {host}:{port}...")
                 except Exception as e:
@@ -273,35 +380,147 @@ class MainApp(App):
                     return
 
                 if len(args) < 3:
-                    log.write_line("Error: expected 'advertise <group> <address>'")
+                    log.write_line(
+                        "Error: expected 'advertise <group> <address|name> ...'"
+                    )
                     return
 
-                try:
-                    if not ":" in args[2]:
-                        if not self.dns:
-                            log.write_line("Error: DNS client not created yet")
-                            return
-
-                        record = self.dns.query(args[2])
-                        address = (record.ip, int(record.port))
+                destinations: list[tuple[str, int] | str] = []
+                for arg in " ".join(args[2:]).replace(",", " ").split():
+                    if ":" in arg:
+                        ip, port = arg.split(":")
+                        destinations.append((ip, int(port)))
                     else:
-                        ip, port = args[2].split(":")
-                        address = (ip, int(port))
+                        destinations.append(arg)
+
+                chat_model = self.chat_model
+                dns = self.dns
+
+                # Every lookup gets its own client, one UDP socket can not
+                # serve concurrent queries
+                def resolve(name: str) -> tuple[str, int]:
+                    if not dns:
+                        raise Exception("DNS client not created yet")
+
+                    record = DNSClient(dns.host, dns.port, self.cache).query(name)
+                    return (record.ip, int(record.port))
+
+                def advertise():
+                    try:
+                        results = chat_model.advertise_many(
+                            args[1], destinations, resolve
+                        )
+                    except Exception as e:
+                        self.call_from_thread(log.write_line, repr(e))
+                        return
+
+                    lines = [
+                        f"Sent to {dest}" if e is None else f"Failed {dest}: {e!r}"
+                        for dest, e in results.items()
+                    ]
+                    self.call_from_thread(log.write_lines, lines)
+
+                threading.Thread(target=advertise, daemon=True).start()
+                log.write_line(f"Advertising to {len(destinations)} destinations...")
+
+            case "send-file":
+                if not self.chat_model:
+                    log.write_line("Error: Chat peer not created yet")
+                    return
+
+                if len(args) < 3:
+                    log.write_line("Error: expected 'send-file <group> <path>'")
+                    return
 
-                    self.chat_model.advertise_group(args[1], address)
-                    log.write_line(f"Sent to {address[0]}:{address[1]}")
+                chat_model = self.chat_model
+                group_name, path = args[1], " ".join(args[2:])
 
+                # Large files take a while, keep the UI responsive meanwhile
+                def transfer():
+                    try:
+                        chat_model.send_file(group_name, path)
+                        self.call_from_thread(log.write_line, f"Sent {path}")
+                    except Exception as e:
+                        self.call_from_thread(log.write_line, repr(e))
+
+                threading.Thread(target=transfer, daemon=True).start()
+                log.write_line(f"Sending {path} to '{group_name}'...")
+
+            case "log-level":
+                if len(args) < 2:
+                    log.write_line("Error: expected 'log-level <level>'")
+                    return
+
+                try:
+                    set_level(args[1])
+                    log.write_line(f"Log level set to {args[1].upper()}")
                 except Exception as e:
                     log.write_line(repr(e))
 
-            case "sync":
+            case "stats":
                 if not self.chat_model:
+                    log.write_line("Error: Chat peer not created yet")
+                    return
+
+                if len(args) > 1:
+                    try:
+                        self.chat_model.dump_stats(args[1])
+                        log.write_line(f"Stats written to {args[1]}")
+                    except Exception as e:
+                        log.write_line(repr(e))
+                    return
+
+                stats = self.chat_model.stats()
+                for series, value in sorted(stats["metrics"].items()):
+                    if isinstance(value, dict):
+                        value = " ".join(
+                            [f"count={value['count']}"]
+                            + [
+                                f"{k}={value[k] * 1000:.2f}ms"
+                                for k in ("p50", "p99", "max")
+                            ]
+                        )
+                    log.write_line(f"{series} {value}")
+
+                for peer, queue in stats["queues"].items():
+                    log.write_line(
+                        f"queue {peer} depth={queue['depth']} "
+                        f"max={queue['max_depth']} dropped={queue['dropped']}"
+                    )
+
+            case "profile":
+                if isinstance(self.chat_model, RemoteChat):
+                    try:
+                        path = args[1] if len(args) > 1 else None
+                        report = self.chat_model.client.call("profile", {"path": path})
+                        log.write_lines(
+                            report.splitlines()
+                            if report
+                            else [f"Profile written to {path}"]
+                        )
+                    except Exception as e:
+                        log.write_line(repr(e))
                     return
 
-                select = self.query_one(Select)
-                select.set_options((v, v) for v in self.chat_model._groups)
+                if not self.profiler:
+                    log.write_line("Error: profiling disabled, set PROFILE=1")
+                    return
+
+                if len(args) > 1:
+                    try:
+                        self.profiler.dump(args[1])
+                        log.write_line(f"Profile written to {args[1]}")
+                    except Exception as e:
+                        log.write_line(repr(e))
+                    return
+
+                log.write_lines(self.profiler.report().splitlines())
+
+            case "sync":
+                if not self.chat_model:
+                    return
 
-                self.update_tree()
+                self.update_groups()
                 log.write_line("Synchronized")
 
             case _:
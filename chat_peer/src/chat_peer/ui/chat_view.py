@@ -0,0 +1,165 @@
+from collections import OrderedDict
+import bisect
+import time
+
+from rich.cells import cell_len
+from rich.text import Text
+from textual.geometry import Size
+from textual.message import Message as TextualMessage
+from textual.scroll_view import ScrollView
+from textual.strip import Strip
+
+from ..libs.message import Message
+from ..libs.message_store import MessageStore
+
+# Formatted messages kept around, only the visible window is ever rendered
+LINE_CACHE_SIZE = 512
+
+
+def format_message(m: Message) -> list[str]:
+    header = f"[{m.sender[0]}:{m.sender[1]}] ({time.ctime(m.sent_at)})"
+    return [header, *m.content.splitlines(), ""]
+
+
+def measure(m: Message) -> tuple[int, int]:
+    # Line count and widest line in cells, lines are never wrapped
+    lines = format_message(m)
+    return len(lines), max(cell_len(line) for line in lines)
+
+
+class ChatView(ScrollView, can_focus=True):
+    class LoadOlder(TextualMessage):
+        pass
+
+    def __init__(self, id: str | None = None) -> None:
+        super().__init__(id=id)
+        self._store: MessageStore | None = None
+        # Line offset of every indexed message, with the total line count last
+        self._offsets: list[int] = [0]
+        # Widest line indexed so far, wider than the view scrolls sideways
+        self._width = 0
+        self._first: Message | None = None
+        self._last: Message | None = None
+        self._lines: OrderedDict[int, list[str]] = OrderedDict()
+        self._pending = False
+        self._requested = False
+
+    def show(self, store: MessageStore | None):
+        self._store = store
+        self._reindex()
+        self.scroll_end(animate=False)
+
+    def messages_changed(self):
+        # Bursts of updates are folded into one reindex and refresh
+        if not self._pending:
+            self._pending = True
+            self.call_after_refresh(self._sync)
+
+    def _sync(self):
+        self._pending = False
+        store = self._store
+        if store is None:
+            return
+
+        follow = self.scroll_y >= self.max_scroll_y
+        count = len(self._offsets) - 1
+
+        if count and len(store) > count and store[count - 1] is self._last:
+            # Appended at the end, only the new messages are indexed
+            total = self._offsets[-1]
+            for i in range(count, len(store)):
+                lines, width = measure(store[i])
+                total += lines
+                self._offsets.append(total)
+                self._width = max(self._width, width)
+            self._last = store[len(store) - 1]
+            self._update_size()
+        else:
+            self._reanchor(store, count)
+
+        self._requested = False
+        if follow:
+            self.scroll_end(animate=False)
+        self.refresh()
+
+    def _reanchor(self, store: MessageStore, count: int):
+        first, y = self._first, self.scroll_y
+        self._reindex()
+
+        # Older messages were prepended, keep the visible ones in place
+        added = len(store) - count
+        if first is not None and 0 < added < len(store) and store[added] is first:
+            self.scroll_to(y=y + self._offsets[added], animate=False)
+
+    def _reindex(self):
+        store = self._store
+        self._lines.clear()
+        self._offsets = [0]
+        self._width = 0
+
+        if store is not None:
+            total = 0
+            for m in store:
+                lines, width = measure(m)
+                total += lines
+                self._offsets.append(total)
+                self._width = max(self._width, width)
+
+        has = store is not None and len(store) > 0
+        self._first = store[0] if has else None
+        self._last = store[len(store) - 1] if has else None
+        self._update_size()
+        self.refresh()
+
+    def on_resize(self) -> None:
+        self._update_size()
+
+    def _update_size(self):
+        self.virtual_size = Size(
+            max(self._width, self.scrollable_content_region.width), self._offsets[-1]
+        )
+
+    def _index_at(self, y: int) -> int:
+        return bisect.bisect_right(self._offsets, y) - 1
+
+    def _message_lines(self, i: int) -> list[str]:
+        lines = self._lines.get(i)
+        if lines is None:
+            lines = self._lines[i] = format_message(self._store[i])
+            if len(self._lines) > LINE_CACHE_SIZE:
+                self._lines.popitem(last=False)
+        else:
+            self._lines.move_to_end(i)
+        return lines
+
+    def watch_scroll_y(self, old_value: float, new_value: float) -> None:
+        super().watch_scroll_y(old_value, new_value)
+
+        # Reaching the top asks for the next older page, once per page
+        store = self._store
+        if new_value < 1 and store is not None and not store.complete:
+            if not self._requested:
+                self._requested = True
+                self.post_message(self.LoadOlder())
+
+    def render_line(self, y: int) -> Strip:
+        scroll_x, scroll_y = self.scroll_offset
+        width = self.size.width
+        rich_style = self.rich_style
+
+        line_y = scroll_y + y
+        count = len(self._offsets) - 1
+        if self._store is None or line_y >= self._offsets[-1] or not count:
+            return Strip.blank(width, rich_style)
+
+        i = self._index_at(line_y)
+        if i >= len(self._store):
+            return Strip.blank(width, rich_style)
+
+        lines = self._message_lines(i)
+        n = line_y - self._offsets[i]
+        line = lines[n] if n < len(lines) else ""
+
+        text = Text(line, no_wrap=True, style=rich_style)
+        strip = Strip(text.render(self.app.console), cell_len(line))
+        return strip.crop_extend(scroll_x, scroll_x + width, rich_style)
@@ -0,0 +1,53 @@
+import pytest
+from chat_peer.bench.daemon import DaemonProcess
+from chat_peer.daemon.client import RemoteChat
+
+LISTEN = ["--listen", "127.0.0.1:0"]
+
+
+@pytest.fixture(scope="module")
+def daemon(tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("chat-daemon")
+    with DaemonProcess(str(workdir), LISTEN) as daemon:
+        with daemon.client() as client:
+            client.call("create-group", {"name": "bench"})
+        yield daemon
+
+
+@pytest.mark.benchmark(group="chat_daemon_startup")
+@pytest.mark.parametrize("args", [[], LISTEN], ids=["idle", "listen"])
+def test_daemon_startup(benchmark, tmp_path, args):
+    """Time from spawn until the control socket answers."""
+
+    def start():
+        with DaemonProcess(str(tmp_path), args) as daemon:
+            with daemon.client() as client:
+                ping = client.call("ping")
+        return daemon.startup, ping
+
+    startup, ping = benchmark.pedantic(start, rounds=3, iterations=1)
+
+    benchmark.extra_info.update({"startup": startup, **ping["startup"]})
+    print(f"startup={startup * 1000:.0f}ms", ping["startup"])
+
+    # Nothing heavy is imported until the peer is asked to listen
+    assert ("import" in ping["startup"]) == bool(args)
+
+
+@pytest.mark.benchmark(group="chat_daemon_control")
+def test_daemon_ping(benchmark, daemon):
+    """Round trip of one control request over the Unix socket."""
+
+    with daemon.client() as client:
+        benchmark(client.call, "ping")
+
+
+@pytest.mark.benchmark(group="chat_daemon_control")
+def test_daemon_send(benchmark, daemon):
+    """Round trip of a send, encrypted and stored by the daemon."""
+
+    with daemon.client() as client:
+        chat = RemoteChat(client)
+        benchmark(chat.send, "bench", "hello")
+
+    assert len(chat.groups["bench"].messages)
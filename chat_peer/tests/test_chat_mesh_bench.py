@@ -0,0 +1,53 @@
+import os
+import pytest
+from common.utils.impairment import Impairment
+from chat_peer.bench.mesh import Mesh, MeshConfig, format_result
+
+PEERS = int(os.environ.get("CHAT_MESH_PEERS", "8"))
+RATE = float(os.environ.get("CHAT_MESH_RATE", "20"))
+DURATION = float(os.environ.get("CHAT_MESH_DURATION", "3"))
+
+# Per link and direction, TCP turns the loss into retransmit stalls
+WAN = Impairment(delay=0.02, jitter=0.01, loss=0.01)
+
+
+@pytest.mark.benchmark(group="mesh_propagation")
+@pytest.mark.parametrize("topology", ["star", "ring", "random"])
+def test_mesh_propagation(benchmark, topology):
+    """Measure end-to-end delivery across an in-process mesh."""
+
+    config = MeshConfig(
+        peers=PEERS, topology=topology, rate=RATE, duration=DURATION, seed=1
+    )
+
+    with Mesh(config) as mesh:
+        result = benchmark.pedantic(mesh.run, rounds=1, iterations=1)
+
+    benchmark.extra_info.update(result.to_dict())
+    print(format_result(result))
+
+    assert result.delivery_ratio >= 0.99
+
+
+@pytest.mark.benchmark(group="mesh_propagation_wan")
+@pytest.mark.parametrize("topology", ["ring", "random"])
+def test_mesh_propagation_over_wan(benchmark, topology):
+    """Measure delivery when every link is delayed, jittery and lossy."""
+
+    config = MeshConfig(
+        peers=PEERS,
+        topology=topology,
+        rate=RATE,
+        duration=DURATION,
+        seed=1,
+        impairment=WAN,
+    )
+
+    with Mesh(config) as mesh:
+        result = benchmark.pedantic(mesh.run, rounds=1, iterations=1)
+
+    benchmark.extra_info.update(result.to_dict())
+    print(format_result(result))
+
+    assert result.delivery_ratio >= 0.99
+    assert result.p50 >= WAN.delay
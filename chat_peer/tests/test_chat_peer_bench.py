@@ -1,7 +1,9 @@
+import time
 import pytest
 from chat_peer.infra.logger import create_logger
 from chat_peer.libs.crypto import generate_rsa_keypair
-from chat_peer.chat.chat_model import ChatModel
+from chat_peer.chat.anti_entropy import SyncConfig
+from chat_peer.chat.chat_model import ChatModel, MAX_BODY_SIZE
 
 
 def create_peer(name: str, port: int):
@@ -42,3 +44,42 @@ def test_conversation_latency(benchmark):
 
     del peer3
     del peer4
+
+
+@pytest.mark.benchmark(group="peer_ops")
+def test_sync_large_messages(benchmark):
+    """Sync a history that is larger than one frame."""
+
+    private_key, public_key = generate_rsa_keypair()
+    peers = [
+        ChatModel(
+            create_logger(f"peer-{port}"),
+            "127.0.0.1",
+            port,
+            private_key,
+            public_key,
+            sync=SyncConfig(interval=1),
+        )
+        for port in (8085, 8086)
+    ]
+    for peer in peers:
+        peer.listen()
+
+    # Joined offline, the history only reaches peer 8086 through anti-entropy
+    group = peers[0].create_group("group")
+    peers[1].join_group("group", group.token)
+    for i in range(200):
+        peers[0].send("group", f"{i:04d}" + "x" * 6000)
+    assert 200 * 6000 > MAX_BODY_SIZE
+
+    def _sync():
+        peers[0].link("group", ("127.0.0.1", 8086))
+        deadline = time.monotonic() + 10
+        while len(peers[1].groups["group"].messages) < 200:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    benchmark.pedantic(_sync, rounds=1, iterations=1)
+
+    for peer in peers:
+        peer.close()
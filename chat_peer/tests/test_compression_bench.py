@@ -0,0 +1,58 @@
+import time
+import uuid
+import pytest
+from chat_peer.chat.chat_schema import ConversationBody, BatchBody
+from chat_peer.libs.compression import compress, decompress
+from chat_peer.libs.crypto import generate_aes_key, aes_encrypt
+
+TOKEN = uuid.uuid4().hex
+SENDER = ("192.168.1.20", 8081)
+LINE = "hey, did anyone get the build working on the new branch yet?"
+
+
+def conversation(content: str) -> bytes:
+    return ConversationBody(SENDER, content, time.time(), "general", TOKEN).dump()
+
+
+def batch(lines: int) -> bytes:
+    messages = [
+        {
+            "id": uuid.uuid4().hex,
+            "sender": SENDER,
+            "content": f"{LINE} ({i})",
+            "timestamp": time.time(),
+        }
+        for i in range(lines)
+    ]
+    return BatchBody("general", TOKEN, messages).dump()
+
+
+BODIES = {
+    "short": conversation("ok"),
+    "line": conversation(LINE),
+    "paste": conversation("\n".join(f"{LINE} {i}" for i in range(40))),
+    "batch": batch(50),
+}
+
+
+@pytest.mark.benchmark(group="compression")
+@pytest.mark.parametrize("name", BODIES)
+@pytest.mark.parametrize("codec", [None, "zlib"])
+def test_body_encoding(benchmark, name, codec):
+    body = BODIES[name]
+    key = generate_aes_key()
+
+    def encode():
+        data, encoding = compress(body, codec) if codec else (body, None)
+        return aes_encrypt(key, data)[1], encoding
+
+    ciphertext, encoding = benchmark(encode)
+
+    benchmark.extra_info["raw_bytes"] = len(body)
+    benchmark.extra_info["wire_bytes"] = len(ciphertext)
+    benchmark.extra_info["saving"] = round(1 - len(ciphertext) / len(body), 3)
+    print(name, codec, len(body), "->", len(ciphertext))
+
+    if encoding:
+        data, _ = compress(body, encoding)
+        assert decompress(data, encoding) == body
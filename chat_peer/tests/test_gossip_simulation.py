@@ -0,0 +1,96 @@
+from collections import deque
+import random
+import pytest
+from chat_peer.chat.gossip import GossipConfig
+
+# Approximate on-wire sizes of a sealed CONVERSATION frame and of one id
+# inside a batched IHAVE / IWANT body
+FRAME_SIZE = 256 + 256 + 12 + 200
+ID_SIZE = 35
+
+
+def random_graph(n: int, degree: int, rng: random.Random) -> list[set[int]]:
+    # Ring first so the graph is connected, random chords up to the degree
+    graph = [{(i - 1) % n, (i + 1) % n} for i in range(n)]
+    while sum(len(g) for g in graph) < n * degree:
+        a, b = rng.randrange(n), rng.randrange(n)
+        if a != b:
+            graph[a].add(b)
+            graph[b].add(a)
+
+    return graph
+
+
+def simulate(graph: list[set[int]], config: GossipConfig, messages: int, seed: int):
+    random.seed(seed)
+    rng = random.Random(seed)
+
+    sent_bytes = 0
+    bodies = 0
+    duplicates = 0
+    delivered = 0
+
+    for _ in range(messages):
+        origin = rng.randrange(len(graph))
+        have = {origin: config.initial_ttl()}
+        wanted = set[int]()
+        pushes = deque[tuple[int, int, int | None]]()
+        announces = deque[tuple[int, int]]()
+
+        def relay(node: int, exclude: set[int], ttl: int | None):
+            eager, lazy = config.split(sorted(graph[node] - exclude), ttl)
+            pushes.extend((peer, node, ttl) for peer in eager)
+            announces.extend((peer, node) for peer in lazy)
+
+        relay(origin, set(), have[origin])
+
+        while pushes or announces:
+            while pushes:
+                node, source, ttl = pushes.popleft()
+                sent_bytes += FRAME_SIZE
+                bodies += 1
+
+                if node in have:
+                    duplicates += 1
+                    continue
+
+                ttl = None if ttl is None else ttl - 1
+                have[node] = ttl
+                relay(node, {source, origin}, ttl)
+
+            # IHAVE rounds run after eager pushes, like the periodic flush
+            if announces:
+                node, source = announces.popleft()
+                sent_bytes += ID_SIZE
+
+                if node not in have and node not in wanted:
+                    wanted.add(node)
+                    sent_bytes += ID_SIZE
+                    pushes.append((node, source, have[source]))
+
+        delivered += len(have)
+
+    return {
+        "bytes_per_message": sent_bytes / messages,
+        "bodies_per_message": bodies / messages,
+        "duplicates_per_message": duplicates / messages,
+        "delivery_ratio": delivered / (messages * len(graph)),
+    }
+
+
+@pytest.mark.benchmark(group="gossip_simulation")
+@pytest.mark.parametrize("mode", ["flood", "gossip"])
+def test_gossip_bandwidth(benchmark, mode):
+    graph = random_graph(64, 8, random.Random(1))
+    config = GossipConfig(mode=mode, fanout=3, ttl=4)
+
+    result = benchmark.pedantic(
+        simulate, args=(graph, config, 50, 1), rounds=1, iterations=1
+    )
+    benchmark.extra_info.update(result)
+
+    flood = simulate(graph, GossipConfig(mode="flood"), 50, 1)
+    print(mode, result)
+
+    assert result["delivery_ratio"] == flood["delivery_ratio"] == 1.0
+    assert result["bytes_per_message"] <= flood["bytes_per_message"]
@@ -0,0 +1,76 @@
+from typing import Callable, Awaitable, Any
+import asyncio
+
+type PacketHandler = Callable[[AsyncTcpSocket, Any], Awaitable[None]]
+
+# Per-connection read buffer high-water mark, keeps idle connections cheap
+READ_LIMIT = 64 * 1024
+
+
+class AsyncTcpSocket:
+    _reader: asyncio.StreamReader | None
+    _writer: asyncio.StreamWriter | None
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader | None = None,
+        writer: asyncio.StreamWriter | None = None,
+    ) -> None:
+        super().__init__()
+        self._reader = reader
+        self._writer = writer
+        self._server: asyncio.Server | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def listen(self, host: str, port: int, handler: PacketHandler) -> int:
+        async def on_accept(reader, writer):
+            address = writer.get_extra_info("peername")
+            await handler(AsyncTcpSocket(reader, writer), address)
+
+        self._server = await asyncio.start_server(
+            on_accept, host, port, limit=READ_LIMIT, reuse_address=True
+        )
+
+        return self._server.sockets[0].getsockname()[1]
+
+    async def connect(self, ip: str, port: int, handler: PacketHandler):
+        address = (ip, int(port))
+        self._reader, self._writer = await asyncio.open_connection(
+            ip, int(port), limit=READ_LIMIT
+        )
+
+        # Keep a reference, the loop only holds tasks weakly
+        task = asyncio.create_task(handler(self, address))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def send(self, data: bytes):
+        if not self._writer:
+            raise ConnectionError("Socket not connected")
+
+        self._writer.write(data)
+        await self._writer.drain()
+
+    async def send_many(self, chunks: list[bytes]):
+        if not self._writer:
+            raise ConnectionError("Socket not connected")
+
+        # writelines hands the buffers to sendmsg when the transport supports it
+        self._writer.writelines(chunks)
+        await self._writer.drain()
+
+    async def recv_exact(self, size=4096) -> bytes:
+        if not self._reader:
+            raise ConnectionError("Socket not connected")
+
+        try:
+            return await self._reader.readexactly(size)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Connection closed before full packet received")
+
+    def close(self):
+        if self._server:
+            self._server.close()
+
+        if self._writer:
+            self._writer.close()
@@ -0,0 +1,308 @@
+from typing import Any
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import asyncio
+import random
+import threading
+import time
+
+type Address = tuple[str, int]
+
+# Bytes read per TCP segment forwarded by the proxy
+SEGMENT_SIZE = 64 * 1024
+
+# Segments read but not yet released per direction, bounds the proxy's
+# memory whatever the impairment
+MAX_SEGMENTS = 64
+
+
+@dataclass
+class Impairment:
+    delay: float = 0.0
+    # Extra delay drawn uniformly from [0, jitter] per packet or segment
+    jitter: float = 0.0
+    loss: float = 0.0
+    # Chance a datagram is held back by reorder_gap so later ones overtake it
+    reorder: float = 0.0
+    reorder_gap: float = 0.01
+    # Bytes per second, None for no cap
+    rate: float | None = None
+    # Bytes queued at the bottleneck before a TCP sender is pushed back
+    buffer: int = 256 * 1024
+    # TCP never loses bytes, a lost segment shows up as a retransmit stall
+    rto: float = 0.2
+
+
+# One direction of a proxied path, decides when each packet arrives
+class _Link:
+    def __init__(self, impairment: Impairment, rng: random.Random) -> None:
+        self.impairment = impairment
+        self._rng = rng
+        self._free_at = 0.0
+        self._last = 0.0
+
+    def backlog(self) -> float:
+        # Seconds of data still queued behind the bandwidth cap
+        return max(0.0, self._free_at - time.monotonic())
+
+    def schedule(self, size: int, ordered: bool) -> float | None:
+        config = self.impairment
+        now = time.monotonic()
+        lost = config.loss and self._rng.random() < config.loss
+        if lost and not ordered:
+            return None
+
+        # The bandwidth cap serializes packets, queueing builds up behind it
+        start = now
+        if config.rate:
+            start = max(now, self._free_at)
+            self._free_at = start + size / config.rate
+
+        at = start + config.delay
+        if config.jitter:
+            at += self._rng.uniform(0, config.jitter)
+        if lost:
+            at += config.rto
+        if not ordered and config.reorder and self._rng.random() < config.reorder:
+            at += config.reorder_gap
+
+        # A stream is delivered in order however the delays were drawn
+        if ordered:
+            at = max(at, self._last)
+            self._last = at
+
+        return at - now
+
+
+class _Proxy(ABC):
+    def __init__(
+        self,
+        target: Address,
+        impairment: Impairment | None = None,
+        reverse: Impairment | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        seed: int | None = None,
+    ) -> None:
+        self.target = target
+        self.address: Address | None = None
+        self.stats = {"packets": 0, "bytes": 0, "dropped": 0}
+        self._host = host
+        self._port = port
+        self._rng = random.Random(seed)
+        self._forward = _Link(impairment or Impairment(), self._rng)
+        self._backward = _Link(reverse or impairment or Impairment(), self._rng)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    @property
+    def impairment(self) -> Impairment:
+        return self._forward.impairment
+
+    @impairment.setter
+    def impairment(self, impairment: Impairment):
+        # Applies to both directions, conditions can change mid-run
+        self._loop.call_soon_threadsafe(self._set, impairment, impairment)
+
+    def set_impairment(self, forward: Impairment, backward: Impairment):
+        self._loop.call_soon_threadsafe(self._set, forward, backward)
+
+    def start(self) -> Address:
+        self._thread.start()
+        self.address = asyncio.run_coroutine_threadsafe(
+            self._start(), self._loop
+        ).result()
+        return self.address
+
+    def close(self):
+        if not self._thread.is_alive():
+            return
+
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(timeout=5)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=5)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _set(self, forward: Impairment, backward: Impairment):
+        self._forward.impairment = forward
+        self._backward.impairment = backward
+
+    def _count(self, size: int, delay: float | None):
+        if delay is None:
+            self.stats["dropped"] += 1
+            return
+        self.stats["packets"] += 1
+        self.stats["bytes"] += size
+
+    @abstractmethod
+    async def _start(self) -> Address: ...
+
+    @abstractmethod
+    async def _stop(self): ...
+
+
+class _UdpUpstream(asyncio.DatagramProtocol):
+    def __init__(self, proxy: "UdpProxy", client: Address) -> None:
+        self.proxy = proxy
+        self.client = client
+        self.transport: asyncio.DatagramTransport | None = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, _):
+        self.proxy._relay(self.proxy._backward, data, self.proxy._reply, self.client)
+
+
+class _UdpDownstream(asyncio.DatagramProtocol):
+    def __init__(self, proxy: "UdpProxy") -> None:
+        self.proxy = proxy
+
+    def datagram_received(self, data: bytes, address: Address):
+        self.proxy._loop.create_task(self.proxy._from_client(data, address))
+
+
+# Each client gets its own upstream port so replies find their way back
+class UdpProxy(_Proxy):
+    _listener: asyncio.DatagramTransport
+    _upstreams: dict[Address, _UdpUpstream]
+
+    async def _start(self) -> Address:
+        self._upstreams = {}
+        self._listener, _ = await self._loop.create_datagram_endpoint(
+            lambda: _UdpDownstream(self), local_addr=(self._host, self._port)
+        )
+        return self._listener.get_extra_info("sockname")[:2]
+
+    async def _stop(self):
+        for upstream in self._upstreams.values():
+            if upstream.transport:
+                upstream.transport.close()
+        self._listener.close()
+
+    async def _from_client(self, data: bytes, client: Address):
+        upstream = self._upstreams.get(client)
+        if not upstream:
+            transport, upstream = await self._loop.create_datagram_endpoint(
+                lambda: _UdpUpstream(self, client), remote_addr=self.target
+            )
+            # Another datagram from the same client may have won the race
+            if client in self._upstreams:
+                transport.close()
+            upstream = self._upstreams.setdefault(client, upstream)
+
+        self._relay(self._forward, data, self._send_upstream, upstream)
+
+    def _relay(self, link: _Link, data: bytes, send, dest: Any):
+        delay = link.schedule(len(data), ordered=False)
+        self._count(len(data), delay)
+        if delay is not None:
+            self._loop.call_later(delay, send, data, dest)
+
+    @staticmethod
+    def _send_upstream(data: bytes, upstream: _UdpUpstream):
+        if upstream.transport and not upstream.transport.is_closing():
+            upstream.transport.sendto(data)
+
+    def _reply(self, data: bytes, client: Address):
+        if not self._listener.is_closing():
+            self._listener.sendto(data, client)
+
+
+# Every accepted connection is forwarded over a fresh one to the target
+class TcpProxy(_Proxy):
+    _server: asyncio.Server
+    _sessions: set[asyncio.Task]
+
+    async def _start(self) -> Address:
+        self._sessions = set()
+        self._server = await asyncio.start_server(self._accept, self._host, self._port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def _stop(self):
+        self._server.close()
+        for session in list(self._sessions):
+            session.cancel()
+        await asyncio.gather(*self._sessions, return_exceptions=True)
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            up_reader, up_writer = await asyncio.open_connection(*self.target)
+        except OSError:
+            writer.close()
+            return
+
+        session = asyncio.current_task()
+        assert session
+        self._sessions.add(session)
+        try:
+            await asyncio.gather(
+                self._pump(reader, up_writer, self._forward),
+                self._pump(up_reader, writer, self._backward),
+            )
+        finally:
+            self._sessions.discard(session)
+            writer.close()
+            up_writer.close()
+
+    async def _pump(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, link: _Link
+    ):
+        # Segments are read as the link drains and released on schedule, the
+        # writer keeps them in order
+        segments = asyncio.Queue[tuple[float, bytes] | None](MAX_SEGMENTS)
+        broken = False
+
+        async def release():
+            nonlocal broken
+            while (item := await segments.get()) is not None:
+                at, data = item
+                delay = at - self._loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if broken:
+                    continue
+                try:
+                    writer.write(data)
+                    await writer.drain()
+                except (ConnectionError, RuntimeError):
+                    broken = True
+
+        sender = self._loop.create_task(release())
+        try:
+            while not broken:
+                # A full bottleneck stops the reads, so TCP pushes back on the
+                # sender instead of the proxy buffering without bound
+                config = link.impairment
+                if config.rate:
+                    wait = link.backlog() - config.buffer / config.rate
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+
+                data = await reader.read(SEGMENT_SIZE)
+                if not data:
+                    break
+
+                delay = link.schedule(len(data), ordered=True)
+                self._count(len(data), delay)
+                await segments.put((self._loop.time() + (delay or 0.0), data))
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            sender.cancel()
+            raise
+
+        await segments.put(None)
+        await sender
+        # Half close so the other side sees the end of the stream
+        try:
+            if not broken and writer.can_write_eof():
+                writer.write_eof()
+        except (ConnectionError, RuntimeError):
+            pass
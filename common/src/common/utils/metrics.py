@@ -0,0 +1,214 @@
+from typing import Callable
+import math
+import os
+import threading
+import time
+
+# Linear sub-buckets per power of two, bounds the relative error of a
+# recorded value to about 1 / (2 * SUB_BUCKETS)
+SUB_BUCKETS = 64
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+type Labels = tuple[tuple[str, str], ...]
+
+
+def _bucket(value: float) -> int:
+    m, e = math.frexp(value)
+    return e * SUB_BUCKETS + int((m - 0.5) * 2 * SUB_BUCKETS)
+
+
+def _bucket_value(index: int) -> float:
+    # Midpoint of the bucket, within the error bound of every value in it
+    e, k = divmod(index, SUB_BUCKETS)
+    return math.ldexp(0.5 + (k + 0.5) / (2 * SUB_BUCKETS), e)
+
+
+class Counter:
+    def __init__(self) -> None:
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: int = 1):
+        with self._lock:
+            self._value += n
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def snapshot(self) -> int:
+        return self._value
+
+
+class Gauge:
+    def __init__(self, fn: Callable[[], float]) -> None:
+        self._fn = fn
+
+    @property
+    def value(self) -> float:
+        return self._fn()
+
+    def snapshot(self) -> float:
+        return self._fn()
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_start")
+
+    def __init__(self, histogram: "Histogram") -> None:
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self._histogram.record(time.perf_counter() - self._start)
+
+
+class Histogram:
+    def __init__(self) -> None:
+        self._buckets: dict[int, int] = {}
+        self._count = 0
+        self._sum = 0.0
+        self._min = math.inf
+        self._max = 0.0
+        self._zeros = 0
+        self._lock = threading.Lock()
+
+    def record(self, value: float):
+        with self._lock:
+            self._count += 1
+            self._sum += value
+            if value < self._min:
+                self._min = value
+            if value > self._max:
+                self._max = value
+
+            if value <= 0:
+                self._zeros += 1
+                return
+
+            b = _bucket(value)
+            self._buckets[b] = self._buckets.get(b, 0) + 1
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def quantiles(self, qs: tuple[float, ...] = QUANTILES) -> dict[float, float]:
+        with self._lock:
+            count, zeros = self._count, self._zeros
+            buckets = sorted(self._buckets.items())
+            lo, hi = self._min, self._max
+
+        out: dict[float, float] = {}
+        if not count:
+            return {q: 0.0 for q in qs}
+
+        it = iter(buckets)
+        seen, value = zeros, 0.0
+        for q in sorted(qs):
+            rank = max(1, math.ceil(q * count))
+            while seen < rank:
+                index, n = next(it)
+                seen += n
+                value = _bucket_value(index)
+            out[q] = min(max(value, lo), hi)
+
+        return out
+
+    def snapshot(self) -> dict:
+        quantiles = self.quantiles()
+        return {
+            "count": self._count,
+            "sum": self._sum,
+            "min": self._min if self._count else 0.0,
+            "max": self._max,
+            **{
+                f"p{str(q * 100).rstrip('0').rstrip('.')}": v
+                for q, v in quantiles.items()
+            },
+        }
+
+
+type Metric = Counter | Gauge | Histogram
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: dict[tuple[str, Labels], Metric] = {}
+        self._help: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help: str = "", **labels: str) -> Counter:
+        return self._get(name, help, labels, Counter)
+
+    def histogram(self, name: str, help: str = "", **labels: str) -> Histogram:
+        return self._get(name, help, labels, Histogram)
+
+    def gauge(
+        self, name: str, fn: Callable[[], float], help: str = "", **labels: str
+    ) -> Gauge:
+        return self._get(name, help, labels, lambda: Gauge(fn))
+
+    def _get(self, name: str, help: str, labels: dict[str, str], factory):
+        key = (name, tuple(sorted(labels.items())))
+
+        # Lookups are lock free, only the first registration takes the lock
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = self._metrics[key] = factory()
+                    if help:
+                        self._help[name] = help
+        return metric
+
+    def snapshot(self) -> dict:
+        out = {}
+        for (name, labels), metric in list(self._metrics.items()):
+            out[_series(name, labels)] = metric.snapshot()
+        return out
+
+    def to_prometheus(self) -> str:
+        lines: list[str] = []
+        typed: set[str] = set()
+
+        for (name, labels), metric in sorted(self._metrics.items(), key=lambda i: i[0]):
+            if name not in typed:
+                typed.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                kind = {Counter: "counter", Gauge: "gauge", Histogram: "summary"}
+                lines.append(f"# TYPE {name} {kind[type(metric)]}")
+
+            if isinstance(metric, Histogram):
+                for q, v in metric.quantiles().items():
+                    series = _series(name, labels + (("quantile", str(q)),))
+                    lines.append(f"{series} {v:.9g}")
+                lines.append(f"{_series(name + '_sum', labels)} {metric._sum:.9g}")
+                lines.append(f"{_series(name + '_count', labels)} {metric.count}")
+            else:
+                lines.append(f"{_series(name, labels)} {metric.value}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        # Written aside and renamed so scrapers never read a partial file
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+
+def _series(name: str, labels: Labels) -> str:
+    if not labels:
+        return name
+    inner = ",".join(f'{k}="{v}"' for k, v in labels)
+    return f"{name}{{{inner}}}"
@@ -0,0 +1,191 @@
+from typing import Callable, Any
+from dataclasses import dataclass
+from collections import Counter
+import os
+import sys
+import threading
+import time
+
+type Stack = tuple[str, ...]
+
+# Innermost frames kept per sampled stack
+MAX_DEPTH = 24
+
+
+@dataclass
+class ProfilerConfig:
+    interval: float = 0.005
+    slow: float = 0.1
+    dump_interval: float = 30.0
+    path: str | None = None
+    top: int = 5
+
+    @staticmethod
+    def from_env() -> "ProfilerConfig | None":
+        # Profiling is off unless PROFILE is set, nothing is started then
+        if os.environ.get("PROFILE", "0") in ("", "0"):
+            return None
+
+        return ProfilerConfig(
+            interval=float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000,
+            slow=float(os.environ.get("PROFILE_SLOW_MS", "100")) / 1000,
+            dump_interval=float(os.environ.get("PROFILE_DUMP_INTERVAL", "30")),
+            path=os.environ.get("PROFILE_DUMP") or None,
+        )
+
+
+class _Request:
+    __slots__ = ("label", "start", "samples")
+
+    def __init__(self, label: str) -> None:
+        self.label = label
+        self.start = time.perf_counter()
+        self.samples: Counter[Stack] = Counter()
+
+
+class _Tracker:
+    __slots__ = ("_profiler", "_label", "_key")
+
+    def __init__(self, profiler: "Profiler", label: str) -> None:
+        self._profiler = profiler
+        self._label = label
+
+    def __enter__(self):
+        # The caller's frame marks the request, samples are attributed by
+        # finding it on a thread's stack, which also works for coroutines
+        # since a suspended one is simply not on any stack
+        self._key = id(sys._getframe(1))
+        self._profiler._requests[self._key] = _Request(self._label)
+        return self
+
+    def __exit__(self, *_):
+        request = self._profiler._requests.pop(self._key, None)
+        if request:
+            self._profiler._finish(request)
+
+
+class Profiler:
+    def __init__(
+        self, config: ProfilerConfig, log: Callable[[str], Any] = print
+    ) -> None:
+        self.config = config
+        self._log = log
+        self._requests: dict[int, _Request] = {}
+        self._stacks: dict[str, Counter[Stack]] = {}
+        # Requests, total and max seconds per label
+        self._totals: dict[str, list[float]] = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._sample_loop, name="profiler", daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def from_env(log: Callable[[str], Any] = print) -> "Profiler | None":
+        config = ProfilerConfig.from_env()
+        return Profiler(config, log) if config else None
+
+    def track(self, label: str) -> _Tracker:
+        return _Tracker(self, label)
+
+    def report(self) -> str:
+        with self._lock:
+            totals = {k: list(v) for k, v in self._totals.items()}
+            stacks = {
+                k: v.most_common(self.config.top) for k, v in self._stacks.items()
+            }
+
+        lines: list[str] = []
+        # Slowest handlers first, by time spent in them overall
+        for label, (count, total, slowest) in sorted(
+            totals.items(), key=lambda i: i[1][1], reverse=True
+        ):
+            lines.append(
+                f"{label}: {int(count)} requests, total {total * 1000:.1f}ms, "
+                f"avg {total / count * 1000:.2f}ms, max {slowest * 1000:.1f}ms"
+            )
+            for stack, n in stacks.get(label, []):
+                lines.append(f"  {n:6d}  {' <- '.join(stack)}")
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str | None = None):
+        path = path or self.config.path
+        if not path:
+            return
+
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(self.report())
+        os.replace(tmp, path)
+
+    def close(self):
+        if self._stop_event.is_set():
+            return
+
+        self._stop_event.set()
+        self._thread.join(timeout=1)
+        self.dump()
+
+    def _finish(self, request: _Request):
+        elapsed = time.perf_counter() - request.start
+
+        with self._lock:
+            totals = self._totals.get(request.label)
+            if totals is None:
+                totals = self._totals[request.label] = [0, 0.0, 0.0]
+            totals[0] += 1
+            totals[1] += elapsed
+            totals[2] = max(totals[2], elapsed)
+
+        if elapsed >= self.config.slow:
+            hottest = request.samples.most_common(1)
+            where = f", mostly in {' <- '.join(hottest[0][0])}" if hottest else ""
+            self._log(f"slow {request.label} took {elapsed * 1000:.1f}ms{where}")
+
+    def _sample_loop(self):
+        me = threading.get_ident()
+        next_dump = time.monotonic() + self.config.dump_interval
+
+        while not self._stop_event.wait(self.config.interval):
+            if self._requests:
+                self._sample(me)
+
+            if time.monotonic() >= next_dump:
+                next_dump += self.config.dump_interval
+                try:
+                    self.dump()
+                except OSError as e:
+                    self._log(f"profile dump failed: {e!r}")
+
+    def _sample(self, me: int):
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+
+            stack: list[str] = []
+            request: _Request | None = None
+            f = frame
+            while f is not None:
+                if len(stack) < MAX_DEPTH:
+                    code = f.f_code
+                    stack.append(
+                        f"{os.path.basename(code.co_filename)}:{code.co_name}:{f.f_lineno}"
+                    )
+
+                request = self._requests.get(id(f))
+                if request:
+                    break
+                f = f.f_back
+
+            if not request:
+                continue
+
+            key = tuple(stack)
+            request.samples[key] += 1
+            with self._lock:
+                counter = self._stacks.get(request.label)
+                if counter is None:
+                    counter = self._stacks[request.label] = Counter()
+                counter[key] += 1
@@ -1,6 +1,9 @@
 from typing import Callable, Any, Protocol
 from .responses import Response, ErrorResponse
+from .metrics import MetricsRegistry
+from .profiling import Profiler
 import json
+import time
 
 type RouteHandler = Callable[[dict, Any], Response]
 
@@ -13,27 +16,58 @@ class Sendable(Protocol):
 class Router:
     handlers: dict[str, RouteHandler] = {}
 
+    def __init__(
+        self, metrics: MetricsRegistry | None = None, profiler: Profiler | None = None
+    ) -> None:
+        self.metrics = metrics or MetricsRegistry()
+        self.profiler = profiler
+
     def handler(self, data: bytes, address: Any, socket: Sendable):
+        start = time.perf_counter()
+        method = "INVALID"
+        status = "ERROR"
+
         try:
-            payload = json.loads(data.decode())
-        except Exception:
-            socket.send(ErrorResponse("invalid json").dump(), address)
-            return
+            try:
+                payload = json.loads(data.decode())
+            except Exception:
+                socket.send(ErrorResponse("invalid json").dump(), address)
+                return
 
-        method = payload.get("method")
-        if not method:
-            socket.send(ErrorResponse("missing field 'method'").dump(), address)
-            return
+            if not payload.get("method"):
+                socket.send(ErrorResponse("missing field 'method'").dump(), address)
+                return
 
-        del payload["method"]
+            method = payload.pop("method")
 
-        handler = self.handlers[method]
-        if not handler:
-            socket.send(ErrorResponse(f"unsupported method '{method}'").dump(), address)
-            return
+            handler = self.handlers.get(method)
+            if not handler:
+                socket.send(
+                    ErrorResponse(f"unsupported method '{method}'").dump(), address
+                )
+                method = "UNSUPPORTED"
+                return
 
-        response = handler(payload, address)
-        socket.send(response.dump(), address)
+            if self.profiler:
+                with self.profiler.track(method):
+                    response = handler(payload, address)
+            else:
+                response = handler(payload, address)
+            status = response.status
+            socket.send(response.dump(), address)
+        finally:
+            self._observe(method, status, time.perf_counter() - start)
 
     def add_route(self, method: str, handler: RouteHandler):
         self.handlers[method] = handler
+
+    def _observe(self, method: str, status: str, elapsed: float):
+        self.metrics.counter(
+            "dns_requests_total",
+            "Requests by method and status",
+            method=method,
+            status=status,
+        ).inc()
+        self.metrics.histogram(
+            "dns_request_seconds", "Request handling time", method=method
+        ).record(elapsed)
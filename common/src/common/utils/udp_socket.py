@@ -20,11 +20,26 @@ class UdpSocket:
         except:
             pass
 
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._sock.getsockname()
+
     def bind(self, host: str, port: int, handler: PacketHandler):
         self._sock.bind((host, port))
         threading.Thread(target=self._recv_loop, args=(self._sock, handler)).start()
 
-        print(f"[udp-socket] listening {host}:{port}")
+        # Port 0 binds an ephemeral port, print the one actually taken
+        host, port = self.address
+        print(f"[udp-socket] listening {host}:{port}", flush=True)
+
+    def close(self):
+        self._stop_event.set()
+        # Shutdown wakes a receiver blocked in recvfrom, close alone does not
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
 
     def send(self, data: bytes, address: Any):
         self._sock.sendto(data, address)
@@ -37,7 +52,11 @@ class UdpSocket:
         while not self._stop_event.is_set():
             try:
                 data, address = sock.recvfrom(4096)
+                if self._stop_event.is_set():
+                    return
                 args = (data, address, self)
                 threading.Thread(target=handler, args=args).start()
             except Exception as e:
+                if self._stop_event.is_set():
+                    return
                 print("error:", e)
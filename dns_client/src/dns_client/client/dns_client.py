@@ -3,22 +3,31 @@ from dns_server.registry.registry_schema import (
     RegisterRequest,
     QueryRequest,
     DeregisterRequest,
+    StatsRequest,
 )
 from dns_server.libs.record import Record
 from common.utils.udp_socket import UdpSocket
 from .record_cache import RecordCache
 import json
 
+# Stats replies carry every series and outgrow the default receive buffer
+STATS_BUFSIZE = 65507
+
+# Seconds to wait for a reply, UDP drops lost requests without an error
+TIMEOUT = 5.0
+
 
 class DNSException(Exception):
     pass
 
 
 class DNSClient:
-    def __init__(self, host: str, port: int, cache: RecordCache) -> None:
+    def __init__(
+        self, host: str, port: int, cache: RecordCache, timeout: float = TIMEOUT
+    ) -> None:
         self.host = host
         self.port = port
-        self.socket = UdpSocket()
+        self.socket = UdpSocket(timeout)
         self._cache = cache
 
     def register(self, name: str, port: int, ttl: int) -> Record:
@@ -39,13 +48,16 @@ class DNSClient:
         self._fetch(DeregisterRequest(name))
         self._cache.delete(name)
 
-    def _fetch(self, request: Request):
+    def stats(self, format: str = "json") -> dict:
+        return self._fetch(StatsRequest(format), STATS_BUFSIZE)
+
+    def _fetch(self, request: Request, bufsize: int = 4096):
         self.socket.send(
             request.dump(),
             (self.host, self.port),
         )
 
-        res = self.socket.recv()
+        res = self.socket.recv(bufsize)
 
         payload = json.loads(res.decode())
         status = payload["status"]
@@ -0,0 +1,263 @@
+from dataclasses import dataclass, asdict, replace
+from dns_server.registry.registry_schema import RegisterRequest, QueryRequest
+from common.utils.metrics import Histogram
+from common.utils.impairment import Impairment, UdpProxy
+from .server import ServerProcess, name_for
+import argparse
+import asyncio
+import json
+import random
+import tempfile
+import time
+
+
+@dataclass
+class LoadConfig:
+    # Requests per second put on the schedule. Each client has one request in
+    # flight, once the server falls behind they queue and the achieved send
+    # rate drops below this, latency is still charged from the schedule
+    rate: float = 1000.0
+    duration: float = 5.0
+    clients: int = 64
+    read_ratio: float = 0.9
+    names: int = 1000
+    timeout: float = 1.0
+    ttl: int = 3600
+    seed: int | None = None
+
+
+@dataclass
+class LoadResult:
+    rate: float
+    send_rate: float
+    sent: int
+    ok: int
+    errors: int
+    timeouts: int
+    elapsed: float
+    throughput: float
+    p50: float
+    p99: float
+    p999: float
+    max: float
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+class _Client(asyncio.DatagramProtocol):
+    def __init__(self) -> None:
+        self.transport: asyncio.DatagramTransport | None = None
+        self.waiter: asyncio.Future[bytes] | None = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, _):
+        if self.waiter and not self.waiter.done():
+            self.waiter.set_result(data)
+
+    def error_received(self, exc: Exception):
+        if self.waiter and not self.waiter.done():
+            self.waiter.set_exception(exc)
+
+
+def run(address: tuple[str, int], config: LoadConfig) -> LoadResult:
+    return asyncio.run(_run(address, config))
+
+
+def sweep(
+    address: tuple[str, int],
+    config: LoadConfig,
+    rates: list[float],
+    slo: float = 0.05,
+    tolerance: float = 0.95,
+) -> tuple[list[LoadResult], float | None]:
+    # Rates are stepped up until the clients can not keep the schedule, the
+    # server falls behind it, misses the p99 objective or drops requests
+    results: list[LoadResult] = []
+    sustained: float | None = None
+
+    for rate in rates:
+        result = run(address, replace(config, rate=rate))
+        results.append(result)
+
+        if (
+            result.send_rate < tolerance * rate
+            or result.throughput < tolerance * rate
+            or result.p99 > slo
+            or result.timeouts
+        ):
+            break
+        sustained = rate
+
+    return results, sustained
+
+
+async def _run(address: tuple[str, int], config: LoadConfig) -> LoadResult:
+    loop = asyncio.get_running_loop()
+    rng = random.Random(config.seed)
+    latency = Histogram()
+    counts = {"ok": 0, "errors": 0, "timeouts": 0}
+    last_done = 0.0
+    last_send = 0.0
+
+    async def connect() -> _Client:
+        _, client = await loop.create_datagram_endpoint(_Client, remote_addr=address)
+        return client
+
+    async def worker(queue: asyncio.Queue[tuple[float, bytes] | None]):
+        nonlocal last_done, last_send
+
+        # One request in flight per client, replies carry no id to match on
+        client = await connect()
+        while (item := await queue.get()) is not None:
+            scheduled, payload = item
+            client.waiter = loop.create_future()
+            assert client.transport
+            client.transport.sendto(payload)
+            last_send = time.perf_counter()
+
+            try:
+                reply = await asyncio.wait_for(client.waiter, config.timeout)
+                status = json.loads(reply)["status"]
+                counts["ok" if status == "OK" else "errors"] += 1
+            except asyncio.TimeoutError:
+                counts["timeouts"] += 1
+                # A late reply must not be taken for the next request's
+                assert client.transport
+                client.transport.close()
+                client = await connect()
+                continue
+            except OSError:
+                counts["errors"] += 1
+                continue
+
+            # Measured from the scheduled send time, a request queued behind
+            # a slow one is charged for the wait
+            now = time.perf_counter()
+            latency.record(now - scheduled)
+            last_done = now
+
+        assert client.transport
+        client.transport.close()
+
+    queues = [
+        asyncio.Queue[tuple[float, bytes] | None]() for _ in range(config.clients)
+    ]
+    workers = [asyncio.create_task(worker(q)) for q in queues]
+
+    total = int(config.rate * config.duration)
+    start = time.perf_counter()
+    for i in range(total):
+        scheduled = start + i / config.rate
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        name = name_for(rng.randrange(max(config.names, 1)))
+        if rng.random() < config.read_ratio:
+            payload = QueryRequest(name).dump()
+        else:
+            payload = RegisterRequest(name, 10000 + i % 50000, config.ttl).dump()
+
+        queues[i % config.clients].put_nowait((scheduled, payload))
+
+    for queue in queues:
+        queue.put_nowait(None)
+    await asyncio.gather(*workers)
+
+    elapsed = (last_done or time.perf_counter()) - start
+    # The last request is scheduled (total - 1) / rate after the first
+    sending = last_send - start
+    quantiles = latency.quantiles((0.5, 0.99, 0.999))
+
+    return LoadResult(
+        rate=config.rate,
+        send_rate=(total - 1) / sending if sending > 0 else config.rate,
+        sent=total,
+        ok=counts["ok"],
+        errors=counts["errors"],
+        timeouts=counts["timeouts"],
+        elapsed=elapsed,
+        throughput=(counts["ok"] + counts["errors"]) / elapsed if elapsed else 0.0,
+        p50=quantiles[0.5],
+        p99=quantiles[0.99],
+        p999=quantiles[0.999],
+        max=latency.snapshot()["max"],
+    )
+
+
+def format_result(result: LoadResult) -> str:
+    return (
+        f"rate={result.rate:>8.0f}/s  sent={result.send_rate:>8.0f}/s  "
+        f"done={result.throughput:>8.0f}/s  "
+        f"p50={result.p50 * 1000:7.2f}ms  p99={result.p99 * 1000:7.2f}ms  "
+        f"p999={result.p999 * 1000:7.2f}ms  errors={result.errors}  "
+        f"timeouts={result.timeouts}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduled load for dns_server")
+    parser.add_argument("--address", help="host:port, starts a server if omitted")
+    parser.add_argument("--names", type=int, default=1000)
+    parser.add_argument("--rates", default="500,1000,2000,4000,8000")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--read-ratio", type=float, default=0.9)
+    parser.add_argument("--slo", type=float, default=0.05, help="p99 in seconds")
+    parser.add_argument("--json", action="store_true")
+    parser.add_argument("--delay", type=float, default=0.0, help="ms each way")
+    parser.add_argument("--jitter", type=float, default=0.0, help="ms each way")
+    parser.add_argument("--loss", type=float, default=0.0)
+    args = parser.parse_args()
+
+    config = LoadConfig(
+        duration=args.duration,
+        clients=args.clients,
+        read_ratio=args.read_ratio,
+        names=args.names,
+    )
+    rates = [float(r) for r in args.rates.split(",")]
+
+    impairment = None
+    if args.delay or args.jitter or args.loss:
+        impairment = Impairment(
+            delay=args.delay / 1000, jitter=args.jitter / 1000, loss=args.loss
+        )
+
+    def report(address: tuple[str, int]):
+        # Clients talk to the server through a proxy that adds the WAN
+        if impairment:
+            with UdpProxy(address, impairment) as proxy:
+                assert proxy.address
+                address = proxy.address
+                results, sustained = sweep(address, config, rates, args.slo)
+        else:
+            results, sustained = sweep(address, config, rates, args.slo)
+        if args.json:
+            print(
+                json.dumps(
+                    {"results": [r.to_dict() for r in results], "sustained": sustained}
+                )
+            )
+            return
+
+        for result in results:
+            print(format_result(result))
+        print(f"saturation: sustained {sustained or 0:.0f}/s at p99 <= {args.slo}s")
+
+    if args.address:
+        host, port = args.address.split(":")
+        report((host, int(port)))
+        return
+
+    with tempfile.TemporaryDirectory() as workdir:
+        with ServerProcess(workdir, args.names) as server:
+            assert server.address
+            report(server.address)
+
+
+if __name__ == "__main__":
+    main()
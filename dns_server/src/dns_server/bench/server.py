@@ -0,0 +1,96 @@
+from dns_server.libs.record import Record
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+# Prefilled records outlive any benchmark run
+PREFILL_TTL = 7 * 24 * 3600
+
+LISTENING = re.compile(r"listening (\S+):(\d+)")
+
+
+def name_for(i: int) -> str:
+    return f"name-{i}"
+
+
+def prefill(workdir: str, names: int):
+    # Written the way RegistryModel saves it, the server loads it on start
+    expires_at = time.time() + PREFILL_TTL
+    data = {
+        name_for(i): Record(
+            name_for(i), "127.0.0.1", 10000 + i % 50000, expires_at
+        ).to_dict()
+        for i in range(names)
+    }
+
+    with open(os.path.join(workdir, "registry.json"), "w") as f:
+        json.dump(data, f)
+
+
+class ServerProcess:
+    def __init__(self, workdir: str, names: int = 0, env: dict | None = None):
+        self.workdir = workdir
+        self.names = names
+        self.address: tuple[str, int] | None = None
+        self._env = env or {}
+        self._proc: subprocess.Popen | None = None
+
+    def start(self, timeout: float = 60.0) -> tuple[str, int]:
+        prefill(self.workdir, self.names)
+
+        env = {
+            **os.environ,
+            "DNS_HOST": "127.0.0.1",
+            "DNS_PORT": "0",
+            "PYTHONPATH": os.pathsep.join(sys.path),
+            **self._env,
+        }
+        self._proc = subprocess.Popen(
+            [sys.executable, "-u", "-m", "dns_server.main"],
+            cwd=self.workdir,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+
+        # The server binds an ephemeral port and prints it once it listens
+        deadline = time.monotonic() + timeout
+        assert self._proc.stdout
+        while time.monotonic() < deadline:
+            line = self._proc.stdout.readline()
+            if not line:
+                break
+
+            match = LISTENING.search(line)
+            if match:
+                self.address = (match.group(1), int(match.group(2)))
+                # Keep draining so a chatty server never blocks on the pipe
+                threading.Thread(target=self._proc.stdout.read, daemon=True).start()
+                return self.address
+
+        self.stop()
+        raise Exception("DNS server did not start")
+
+    def stop(self):
+        if not self._proc or self._proc.poll() is not None:
+            return
+
+        self._proc.send_signal(signal.SIGINT)
+        try:
+            self._proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+            self._proc.wait()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stop()
@@ -1,27 +1,49 @@
 from common.utils.udp_socket import UdpSocket
 from .registry.registry_model import RegistryModel
 from .registry.registry_controller import RegistryController
+from .stats.stats_controller import StatsController
+from common.utils.metrics import MetricsRegistry
+from common.utils.profiling import Profiler
 from common.utils.router import Router
+import os
 import time
 
-HOST = "0.0.0.0"
-PORT = 8080
+HOST = os.environ.get("DNS_HOST", "0.0.0.0")
+PORT = int(os.environ.get("DNS_PORT", "8080"))
+
+# Prometheus text file rewritten every METRICS_INTERVAL seconds when set
+METRICS_FILE = os.environ.get("DNS_METRICS_FILE")
+METRICS_INTERVAL = int(os.environ.get("DNS_METRICS_INTERVAL", "15"))
 
 if __name__ == "__main__":
     socket = UdpSocket()
 
-    registry_model = RegistryModel()
+    metrics = MetricsRegistry()
+
+    registry_model = RegistryModel(metrics)
     registry_controller = RegistryController(registry_model)
+    stats_controller = StatsController(metrics)
+
+    # Enabled with PROFILE=1, see ProfilerConfig.from_env
+    profiler = Profiler.from_env()
 
-    router = Router()
+    router = Router(metrics, profiler)
     router.add_route("REGISTER", registry_controller.register)
     router.add_route("QUERY", registry_controller.query)
     router.add_route("DEREGISTER", registry_controller.deregister)
+    router.add_route("STATS", stats_controller.stats)
 
     socket.bind(HOST, PORT, router.handler)
+    ticks = 0
     while True:
         try:
             time.sleep(1)
+            ticks += 1
+            if METRICS_FILE and ticks % METRICS_INTERVAL == 0:
+                metrics.dump(METRICS_FILE)
         except KeyboardInterrupt:
             print("shutting down")
+            socket.close()
+            if profiler:
+                profiler.close()
             break
@@ -1,6 +1,7 @@
 import time
 import threading
 from ..libs.record import Record
+from common.utils.metrics import MetricsRegistry
 import json
 import os
 
@@ -10,7 +11,18 @@ class RegistryModel:
     lock = threading.Lock()
     _stop_event = threading.Event()
 
-    def __init__(self):
+    def __init__(self, metrics: MetricsRegistry | None = None):
+        self.metrics = metrics or MetricsRegistry()
+        self.metrics.gauge(
+            "dns_registry_records", lambda: len(self.registry), "Registered names"
+        )
+        self._persist = self.metrics.histogram(
+            "dns_registry_persist_seconds", "Time to write registry.json"
+        )
+        self._expired = self.metrics.counter(
+            "dns_registry_expired_total", "Records dropped after their ttl"
+        )
+
         threading.Thread(target=self._cleanup_loop, daemon=True).start()
         self._load()
 
@@ -18,6 +30,7 @@ class RegistryModel:
         self._stop_event.set()
 
     def register(self, name: str, ip: str, port: int, ttl: int) -> Record:
+        self._op("register")
         with self.lock:
             self.registry[name] = Record(
                 name=name, ip=ip, port=port, expires_at=time.time() + ttl
@@ -29,8 +42,11 @@ class RegistryModel:
         return self.registry[name]
 
     def query(self, name: str) -> Record | None:
+        self._op("query")
         with self.lock:
             record = self.registry.get(name)
+            if not record:
+                self._miss("query")
             # if record:
             #     print(f"[registry-model] QUERY {name} -> {record.ip}:{record.port}")
             # else:
@@ -38,6 +54,7 @@ class RegistryModel:
             return record
 
     def deregister(self, name: str) -> bool:
+        self._op("deregister")
         with self.lock:
             if name in self.registry:
                 del self.registry[name]
@@ -46,6 +63,7 @@ class RegistryModel:
                 return True
             else:
                 # print(f"[registry-model] DEREGISTER {name} -> NOT FOUND")
+                self._miss("deregister")
                 return False
 
     def _cleanup(self):
@@ -57,6 +75,9 @@ class RegistryModel:
                 # print(f"[registry-model] expired: {n}")
                 del self.registry[n]
 
+        if expired:
+            self._expired.inc(len(expired))
+
     def _load(self):
         if not os.path.exists("registry.json"):
             return
@@ -64,19 +85,28 @@ class RegistryModel:
         with open("registry.json", "r") as f:
             data = json.load(f)
 
-        print(data)
-
         for k, v in data.items():
             self.registry[k] = Record(**v)
 
     def _save(self):
-        data = {}
+        with self._persist.time():
+            data = {}
+
+            for k, v in self.registry.items():
+                data[k] = v.to_dict()
+
+            with open("registry.json", "w") as f:
+                json.dump(data, f)
 
-        for k, v in self.registry.items():
-            data[k] = v.to_dict()
+    def _op(self, op: str):
+        self.metrics.counter(
+            "dns_registry_ops_total", "Registry operations", op=op
+        ).inc()
 
-        with open("registry.json", "w") as f:
-            json.dump(data, f)
+    def _miss(self, op: str):
+        self.metrics.counter(
+            "dns_registry_misses_total", "Operations on unknown names", op=op
+        ).inc()
 
     def _cleanup_loop(self):
         while not self._stop_event.is_set():
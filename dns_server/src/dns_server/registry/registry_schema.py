@@ -53,3 +53,18 @@ class DeregisterRequest(Request):
 
     def dump(self) -> bytes:
         return json.dumps({"method": self.method, "name": self.name}).encode()
+
+
+class StatsRequest(Request):
+    def __init__(self, format: str = "json"):
+        super().__init__()
+        self.method = "STATS"
+        self.format = format
+        self._validate()
+
+    def dump(self) -> bytes:
+        return json.dumps({"method": self.method, "format": self.format}).encode()
+
+    def _validate(self):
+        if self.format not in ("json", "prometheus"):
+            raise ValidationError(f"Invalid format, got: {self.format}")
@@ -0,0 +1,19 @@
+from dns_server.registry.registry_schema import StatsRequest
+from common.utils.metrics import MetricsRegistry
+from common.utils.responses import Response, OkResponse, ErrorResponse
+
+
+class StatsController:
+    def __init__(self, metrics: MetricsRegistry) -> None:
+        self.metrics = metrics
+
+    def stats(self, payload: dict, _) -> Response:
+        try:
+            req = StatsRequest(**payload)
+        except Exception as e:
+            return ErrorResponse(repr(e))
+
+        if req.format == "prometheus":
+            return OkResponse({"text": self.metrics.to_prometheus()})
+
+        return OkResponse(self.metrics.snapshot())
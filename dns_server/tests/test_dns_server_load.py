@@ -0,0 +1,78 @@
+import os
+import pytest
+from common.utils.impairment import Impairment, UdpProxy
+from dns_server.bench.server import ServerProcess
+from dns_server.bench.loadgen import LoadConfig, run, sweep, format_result
+
+# Registry sizes and offered rates, raise them for capacity runs, for
+# example DNS_LOAD_NAMES=1000,1000000
+NAMES = [int(n) for n in os.environ.get("DNS_LOAD_NAMES", "1000,100000").split(",")]
+RATES = [
+    float(r)
+    for r in os.environ.get("DNS_LOAD_RATES", "250,500,1000,2000,4000").split(",")
+]
+DURATION = float(os.environ.get("DNS_LOAD_DURATION", "3"))
+
+# One way conditions between the clients and the server
+WAN = Impairment(delay=0.02, jitter=0.005, loss=0.01)
+
+
+@pytest.fixture(scope="module", params=NAMES, ids=lambda n: f"{n}-names")
+def server(request, tmp_path_factory):
+    workdir = tmp_path_factory.mktemp("dns-server")
+    with ServerProcess(str(workdir), request.param) as server:
+        yield server
+
+
+@pytest.mark.benchmark(group="dns_server_load")
+@pytest.mark.parametrize("read_ratio", [1.0, 0.9])
+def test_open_loop_load(benchmark, server, read_ratio):
+    """Offer the lowest rate and check every request is accounted for."""
+
+    config = LoadConfig(
+        rate=RATES[0], duration=DURATION, read_ratio=read_ratio, names=server.names
+    )
+    result = benchmark.pedantic(
+        run, args=(server.address, config), rounds=1, iterations=1
+    )
+
+    benchmark.extra_info.update(result.to_dict())
+    print(format_result(result))
+
+    assert result.ok + result.errors + result.timeouts == result.sent
+
+
+@pytest.mark.benchmark(group="dns_server_saturation")
+@pytest.mark.parametrize("read_ratio", [1.0, 0.9])
+def test_saturation(benchmark, server, read_ratio):
+    """Step the offered rate up until p99 or throughput falls behind."""
+
+    config = LoadConfig(duration=DURATION, read_ratio=read_ratio, names=server.names)
+    results, sustained = benchmark.pedantic(
+        sweep, args=(server.address, config, RATES), rounds=1, iterations=1
+    )
+
+    benchmark.extra_info["sustained"] = sustained
+    benchmark.extra_info["results"] = [r.to_dict() for r in results]
+    for result in results:
+        print(format_result(result))
+    print(f"sustained {sustained or 0:.0f}/s")
+
+
+@pytest.mark.benchmark(group="dns_server_wan")
+def test_load_over_wan(benchmark, server):
+    """Offer the lowest rate through a lossy, delayed UDP path."""
+
+    config = LoadConfig(
+        rate=RATES[0], duration=DURATION, read_ratio=1.0, names=server.names
+    )
+    with UdpProxy(server.address, WAN, seed=1) as proxy:
+        result = benchmark.pedantic(
+            run, args=(proxy.address, config), rounds=1, iterations=1
+        )
+
+    benchmark.extra_info.update(result.to_dict())
+    print(format_result(result))
+
+    assert result.ok + result.errors + result.timeouts == result.sent
+    assert result.p50 >= 2 * WAN.delay